@@ -0,0 +1,195 @@
+import re
+
+# Результаты локальной проверки
+ACCEPT = "accept"
+REJECT = "reject"
+UNSURE = "unsure"
+
+_UNITS = {
+    "ноль": 0, "один": 1, "одна": 1, "одно": 1, "два": 2, "две": 2, "три": 3, "четыре": 4,
+    "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+    "одиннадцать": 11, "двенадцать": 12, "тринадцать": 13, "четырнадцать": 14, "пятнадцать": 15,
+    "шестнадцать": 16, "семнадцать": 17, "восемнадцать": 18, "девятнадцать": 19,
+}
+_TENS = {
+    "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50, "шестьдесят": 60,
+    "семьдесят": 70, "восемьдесят": 80, "девяносто": 90,
+}
+_HUNDREDS = {
+    "сто": 100, "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500,
+    "шестьсот": 600, "семьсот": 700, "восемьсот": 800, "девятьсот": 900,
+}
+_THOUSANDS = {"тысяча", "тысячи", "тысяч"}
+
+# Слова, которые не влияют на смысл короткого ответа
+_FILLER_WORDS = {"это", "ответ", "правильный", "мой", "наверное", "думаю", "я", "равно", "получается", "будет"}
+
+# Слова, после которых ответ нельзя засчитать без модели: отрицание или несколько вариантов
+_HEDGE_WORDS = {"не", "нет", "ни", "или", "либо"}
+
+# Окончания, которые отбрасываются при сравнении слов (от длинных к коротким)
+_ENDINGS = sorted([
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ой", "ей", "ом", "ем", "ах", "ях", "ов", "ев", "ую", "юю", "ый", "ий",
+    "а", "я", "ы", "и", "у", "ю", "е", "о", "ь",
+], key=len, reverse=True)
+
+_ANSWER_PREFIX = re.compile(r"^\s*(правильный\s+)?ответ\s*[:\-—]?\s*", re.IGNORECASE)
+# Граница, после которой в сохраненном ответе начинается пояснение
+_EXPLANATION_BORDER = re.compile(r"\.(?!\d)|[!?;\n(]|(?<=\s)[—-](?=\s)|:\s|,\s*(так как|потому что|поскольку|ведь)")
+_DECIMAL = re.compile(r"(\d+)[.,](\d+)")
+_NON_WORD = re.compile(r"[^\w.\s-]|_")
+_NEGATIVE_NUMBER = re.compile(r"-\d")
+
+stats = {ACCEPT: 0, REJECT: 0, UNSURE: 0}
+
+
+def _words_to_numbers(tokens: list) -> list:
+    """
+    Заменяет числительные, записанные словами, на цифры: "минус двадцать пять" -> "-25".
+    """
+    result = []
+    number = None
+    negative = False
+    for token in tokens:
+        if token == "минус":
+            negative = True
+            continue
+        if token in _UNITS or token in _TENS or token in _HUNDREDS:
+            value = _UNITS.get(token) or _TENS.get(token) or _HUNDREDS.get(token) or 0
+            number = (number or 0) + value
+        elif token in _THOUSANDS:
+            number = (number or 1) * 1000
+        else:
+            if number is not None:
+                result.append(str(-number if negative else number))
+                number = None
+            elif negative and token.isdigit():
+                token = f"-{token}"
+            elif negative:
+                result.append("минус")
+            negative = False
+            result.append(token)
+    if number is not None:
+        result.append(str(-number if negative else number))
+    elif negative:
+        result.append("минус")
+    return result
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(text: str) -> list:
+    """
+    Приводит ответ к списку нормализованных слов: регистр, ё/е, пунктуация, числа словами.
+
+    :param text: Исходный текст.
+    :return: Список слов.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _DECIMAL.sub(r"\1.\2", text)
+    text = _NON_WORD.sub(" ", text)
+    tokens = []
+    for token in text.split():
+        token = token.strip(".")
+        if not _NEGATIVE_NUMBER.match(token):
+            token = token.strip("-")
+        if token:
+            tokens.append(token)
+    return [token for token in _words_to_numbers(tokens) if token not in _FILLER_WORDS]
+
+
+def extract_core_answer(correct_answer: str) -> str:
+    """
+    Выделяет из сохраненного ответа сам ответ, отбрасывая пояснение.
+
+    :param correct_answer: Ответ с пояснением, полученный от модели.
+    :return: Короткий ответ.
+    """
+    text = _ANSWER_PREFIX.sub("", correct_answer.strip())
+    match = _EXPLANATION_BORDER.search(text)
+    if match:
+        text = text[:match.start()]
+    return text.strip()
+
+
+def _is_number(token: str) -> bool:
+    return token.lstrip("-").replace(".", "", 1).isdigit()
+
+
+def _decide(user_tokens: list, core_tokens: list, explanation_tokens: list) -> str:
+    if not user_tokens or not core_tokens:
+        return UNSURE
+
+    if user_tokens == core_tokens:
+        return ACCEPT
+
+    # Отрицание и перечисление вариантов ("не собака", "42 или 43") засчитывать сами не можем
+    if (set(user_tokens) & _HEDGE_WORDS) - set(core_tokens):
+        return UNSURE
+
+    user_stems = {_stem(token) for token in user_tokens}
+    core_stems = {_stem(token) for token in core_tokens}
+    # Засчитываем, только если в ответе пользователя нет ничего, кроме самого ответа
+    extra_stems = user_stems - core_stems
+
+    # Числовые ответы (математика): сравниваем числа
+    user_numbers = [token for token in user_tokens if _is_number(token)]
+    core_numbers = [token for token in core_tokens if _is_number(token)]
+    if len(core_numbers) == 1 and len(user_numbers) > 1:
+        return UNSURE
+    if len(core_numbers) == 1 and len(user_numbers) == 1:
+        if float(user_numbers[0]) != float(core_numbers[0]):
+            # Если число встречается в пояснении, ответ мог быть выделен неточно - спросим модель
+            if user_numbers[0] in explanation_tokens or len(user_tokens) > len(core_tokens) + 1:
+                return UNSURE
+            return REJECT
+        # Совпадение числа засчитываем, если остальные слова ответа тоже совпадают
+        if extra_stems <= {user_numbers[0]}:
+            return ACCEPT
+        return UNSURE
+
+    # Короткие словесные ответы: сравниваем основы слов без учета порядка
+    if core_stems <= user_stems and not extra_stems:
+        return ACCEPT
+    return UNSURE
+
+
+def check_locally(user_answer: str, correct_answer: str, accepted_answers: list = None) -> str:
+    """
+    Быстрая локальная проверка ответа пользователя по сохраненному правильному ответу.
+
+    :param user_answer: Ответ пользователя.
+    :param correct_answer: Правильный ответ с пояснением.
+    :param accepted_answers: Короткие варианты правильного ответа, полученные вместе с головоломкой.
+    :return: ACCEPT или REJECT, если результат очевиден, иначе UNSURE - тогда нужна проверка моделью.
+    """
+    if not user_answer or not correct_answer:
+        verdict = UNSURE
+    else:
+        user_tokens = normalize(user_answer)
+        explanation_tokens = normalize(correct_answer)
+        verdict = _decide(user_tokens, normalize(extract_core_answer(correct_answer)), explanation_tokens)
+        # Совпадение с любым из вариантов ответа засчитываем
+        for variant in accepted_answers or ():
+            if verdict == ACCEPT:
+                break
+            if _decide(user_tokens, normalize(variant), explanation_tokens) == ACCEPT:
+                verdict = ACCEPT
+    stats[verdict] += 1
+    return verdict
+
+
+def fast_path_rate() -> float:
+    """
+    Доля ответов, которые были проверены без обращения к модели.
+    """
+    total = sum(stats.values())
+    if not total:
+        return 0.0
+    return (stats[ACCEPT] + stats[REJECT]) / total
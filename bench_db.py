@@ -0,0 +1,122 @@
+"""
+Микробенчмарк слоя работы с базой: сравнивает долгоживущее соединение (WAL)
+с прежним подходом, когда каждая функция открывала собственное соединение.
+
+Запуск: python bench_db.py [количество операций]
+"""
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import db_connection
+import db_main_handler
+from log_writer import log_writer
+
+USERS = 1000
+
+
+def legacy_user_exists(db_file: str, user_id: int) -> bool:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+    cursor.execute('SELECT EXISTS(SELECT 1 FROM users WHERE id = ?)', (user_id,))
+    exists = cursor.fetchone()[0]
+    connection.close()
+    return bool(exists)
+
+
+def pooled_user_exists(user_id: int) -> bool:
+    # Тот же запрос, что в db_main_handler.user_exists, но без кэша зарегистрированных пользователей:
+    # сравниваем именно соединения, а не кэш
+    cursor = db_connection.get_connection().cursor()
+    cursor.execute('SELECT EXISTS(SELECT 1 FROM users WHERE id = ?)', (user_id,))
+    return bool(cursor.fetchone()[0])
+
+
+def legacy_get_user_rating(db_file: str, user_id: int) -> float:
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+    cursor.execute('SELECT rating FROM users WHERE id = ?', (user_id,))
+    result = cursor.fetchone()
+    connection.close()
+    return result[0]
+
+
+def legacy_set_user_rating(db_file: str, user_id: int, new_rating: float):
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+    cursor.execute('UPDATE users SET rating = ? WHERE id = ?', (new_rating, user_id))
+    connection.commit()
+    connection.close()
+
+    # Прежний add_log: проверка существования и вставка на отдельных соединениях
+    log_text = f"Рейтинг изменился\n{datetime.datetime.now()}"
+    legacy_user_exists(db_file, user_id)
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO logs (user_id, log_text) VALUES (?, ?)', (user_id, log_text))
+    connection.commit()
+    connection.close()
+
+
+def measure(name: str, operations: int, func) -> float:
+    started = time.perf_counter()
+    for i in range(operations):
+        func(i % USERS + 1)
+    # Логи пишутся в фоне, поэтому в замер входит и их запись
+    log_writer.wait_flushed()
+    elapsed = time.perf_counter() - started
+    ops = operations / elapsed
+    print(f"{name:<48} {ops:>12.0f} ops/s")
+    return ops
+
+
+def prepare(db_file: str):
+    db_connection.set_db_file(db_file)
+    db_main_handler.initialize_database()
+    connection = db_connection.get_connection()
+    with connection:
+        connection.executemany(
+            'INSERT INTO users (id, full_name, hobbies, rating) VALUES (?, ?, ?, ?)',
+            [(user_id, f"Пользователь {user_id}", "головоломки", 0.0) for user_id in range(1, USERS + 1)]
+        )
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_file = os.path.join(directory, "legacy.db")
+        pooled_file = os.path.join(directory, "pooled.db")
+
+        prepare(legacy_file)
+        db_connection.close_all()
+        # Прежняя база работала в режиме журнала по умолчанию
+        connection = sqlite3.connect(legacy_file)
+        connection.execute("PRAGMA journal_mode = DELETE")
+        connection.close()
+        prepare(pooled_file)
+
+        results = {}
+        print(f"Операций в каждом тесте: {operations}\n")
+        for name, legacy, pooled in (
+            ("user_exists", lambda uid: legacy_user_exists(legacy_file, uid), pooled_user_exists),
+            ("get_user_rating", lambda uid: legacy_get_user_rating(legacy_file, uid), db_main_handler.get_user_rating),
+            ("set_user_rating (+ add_log)", lambda uid: legacy_set_user_rating(legacy_file, uid, 1.0),
+             lambda uid: db_main_handler.set_user_rating(uid, 1.0)),
+        ):
+            before = measure(f"{name}: соединение на вызов", operations, legacy)
+            after = measure(f"{name}: постоянное соединение", operations, pooled)
+            results[name] = after / before
+            print()
+
+        for name, speedup in results.items():
+            print(f"{name:<48} ускорение x{speedup:.1f}")
+        log_writer.stop()
+        db_connection.close_all()
+
+
+if __name__ == "__main__":
+    main()
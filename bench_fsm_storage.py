@@ -0,0 +1,69 @@
+"""
+Бенчмарк хранилищ состояний FSM: SQLiteStorage против MemoryStorage.
+
+Имитирует типичный обработчик: чтение состояния и данных, несколько update_data и set_state.
+
+Запуск: python bench_fsm_storage.py [количество обновлений]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import db_async
+import db_connection
+from sqlite_storage import SQLiteStorage
+
+USERS = 1000
+
+
+async def simulate_update(storage, key: StorageKey, step: int):
+    await storage.get_state(key)
+    await storage.get_data(key)
+    await storage.update_data(key, {"difficulty": "easy", "current_puzzle": "Текст головоломки " * 10})
+    await storage.update_data(key, {"attempts_left": 3 - step % 3})
+    await storage.update_data(key, {"hints_used": step % 4})
+    await storage.set_state(key, "PuzzleState:solving_puzzle")
+
+
+async def measure(name: str, storage, updates: int) -> float:
+    keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(1, USERS + 1)]
+
+    started = time.perf_counter()
+    for step in range(updates):
+        await simulate_update(storage, keys[step % USERS], step)
+    elapsed = time.perf_counter() - started
+
+    flush_started = time.perf_counter()
+    await storage.close()
+    flush = time.perf_counter() - flush_started
+
+    per_update = elapsed / updates * 1e6
+    print(f"{name:<20} {per_update:>8.1f} мкс на обновление, финальная запись {flush * 1000:.1f} мс")
+    return per_update
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_connection.set_db_file(os.path.join(directory, "fsm.db"))
+        await db_async.initialize_database()
+
+        print(f"Обновлений: {updates}, пользователей: {USERS}\n")
+        memory = await measure("MemoryStorage", MemoryStorage(), updates)
+        # Первый проход - холодный кэш (чтение из базы), второй - теплый
+        sqlite_storage = SQLiteStorage(flush_delay=0.3, cache_size=USERS * 2, ttl=3600)
+        cold = await measure("SQLite (холодный)", sqlite_storage, updates)
+        warm = await measure("SQLite (теплый)", sqlite_storage, updates)
+        print(f"\nЗаписей в базу: {sqlite_storage.writes} на {2 * updates} обновлений")
+        print(f"Накладные расходы: x{cold / memory:.1f} (холодный), x{warm / memory:.1f} (теплый)")
+        db_async.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
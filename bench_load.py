@@ -0,0 +1,285 @@
+"""
+Сквозной нагрузочный тест бота: синтетические пользователи проходят весь сценарий
+(регистрация -> категория -> сложность -> подсказка/ответ/отказ -> отзыв) через настоящие
+dp и router из main.py. Telegram заменен на FakeSession, модель - на LocalBackend,
+база создается во временном файле. Сеть не нужна.
+
+Отчет: апдейтов в секунду, p50/p95/p99 по каждому обработчику (из метрик бота), задержка event loop,
+SQL-запросов в секунду. Результат сохраняется в JSON; с --compare печатается сравнение
+с результатом предыдущего прогона.
+
+Запуск: python bench_load.py --users 200 --rounds 3 --llm-latency 0.5 --output result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Временная база и локальная модель выбираются до импорта модулей бота
+os.environ["PUZZLES_DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="puzzles-load-"), "bench.db")
+os.environ["LLM_BACKEND"] = "local"
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+import main
+import puzzle_generation
+from db_async import run_in_db_thread, shutdown as db_shutdown
+from db_connection import get_connection
+from fake_telegram import BOT_ID, callback_update, create_bot, message_update
+from llm_backends import LocalBackend
+from llm_gateway import shutdown as llm_shutdown, warm_up as llm_warm_up
+from log_writer import log_writer
+from metrics import handler_seconds
+from puzzle_pool import puzzle_pool
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    quantiles = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return {
+        "count": len(values),
+        "p50": round(quantiles[49] * 1000, 2),
+        "p95": round(quantiles[94] * 1000, 2),
+        "p99": round(quantiles[98] * 1000, 2),
+        "max": round(max(values) * 1000, 2),
+    }
+
+
+def handler_percentiles() -> dict:
+    """
+    Время обработчиков из той же гистограммы, что отдается в /metrics (HandlerMetricsMiddleware).
+    Квантили оцениваются по бакетам гистограммы.
+    """
+    result = {}
+    for labels in sorted(handler_seconds.label_values()):
+        result[labels[0]] = {
+            "count": handler_seconds.count(*labels),
+            "p50": round(handler_seconds.quantile(0.5, *labels) * 1000, 2),
+            "p95": round(handler_seconds.quantile(0.95, *labels) * 1000, 2),
+            "p99": round(handler_seconds.quantile(0.99, *labels) * 1000, 2),
+        }
+    return result
+
+
+async def measure_loop_lag(lags: list, stop: asyncio.Event, interval: float = 0.01):
+    # Насколько позже запланированного просыпается корутина - столько event loop был занят
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - started - interval))
+
+
+class SimulatedUser:
+    def __init__(self, user_id: int, bot, rounds: int, think_time: float, rng: random.Random, stats: dict):
+        self.user_id = user_id
+        self.bot = bot
+        self.rounds = rounds
+        self.think_time = think_time
+        self.rng = rng
+        self.stats = stats
+        self.key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+    async def _feed(self, raw: dict):
+        if self.think_time:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think_time))
+        update = Update.model_validate(raw, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await main.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"Ошибка обработки апдейта пользователя {self.user_id}: {e}")
+        self.stats["updates"].append(time.perf_counter() - started)
+
+    async def message(self, text: str):
+        await self._feed(message_update(self.user_id, text))
+
+    async def press(self, data: str):
+        await self._feed(callback_update(self.user_id, data))
+
+    async def run(self):
+        await self.message("/start")
+        await self.message(f"Пользователь {self.user_id}")
+        await self.message("Головоломки")
+
+        for _ in range(self.rounds):
+            await self.message("Получить новую головоломку")
+            await self.press(self.rng.choice(["logic", "charades", "riddles", "math", "associations", "random"]))
+            await self.press(self.rng.choice(["easy", "medium", "hard"]))
+
+            if self.rng.random() < 0.3:
+                await self.press("hint")
+            if self.rng.random() < 0.15:
+                await self.press("cancel")
+            else:
+                await self.solve()
+
+            if self.rng.random() < 0.3:
+                await self.press("rate")
+                await self.message("Интересная задача")
+            if self.rng.random() < 0.2:
+                await self.message(self.rng.choice(["Профиль", "Таблица лидеров", "Мои головоломки"]))
+
+    async def solve(self):
+        for _ in range(3):
+            data = await main.dp.storage.get_data(self.key)
+            if "current_puzzle" not in data:
+                return
+            variants = data.get("accepted_answers") or ["не знаю"]
+            # Примерно половина ответов верные, часть из них - в свободной форме (пойдут на проверку моделью)
+            roll = self.rng.random()
+            if roll < 0.4:
+                answer = variants[0]
+            elif roll < 0.5:
+                answer = f"Мне кажется, что это {variants[0]}, потому что так получается"
+            else:
+                answer = "не знаю"
+            await self.message(answer)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(result: dict, previous: dict):
+    print(f"\nСравнение с {previous.get('revision')} ({previous.get('started_at')}):")
+
+    def line(name: str, new: float, old: float, lower_is_better: bool):
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change > 5 if lower_is_better else change < -5
+        print(f"  {name:<40} {old:>10.2f} -> {new:>10.2f} ({change:+.1f}%){'  <-- хуже' if worse else ''}")
+
+    line("апдейтов/с", result["updates_per_sec"], previous["updates_per_sec"], False)
+    line("задержка апдейта p95, мс", result["update_latency"]["p95"], previous["update_latency"]["p95"], True)
+    line("задержка event loop p99, мс", result["loop_lag"]["p99"], previous["loop_lag"]["p99"], True)
+    line("SQL-запросов/с", result["db"]["statements_per_sec"], previous["db"]["statements_per_sec"], False)
+    for name, timing in sorted(result["handlers"].items()):
+        if name in previous["handlers"]:
+            line(f"{name} p95, мс", timing["p95"], previous["handlers"][name]["p95"], True)
+
+
+async def run(args) -> dict:
+    # Информационные логи бота на каждый апдейт только искажают замер
+    logging.getLogger().setLevel(logging.WARNING)
+    # Модель - детерминированная заглушка с заданной задержкой и долей ошибок
+    puzzle_generation.backend = LocalBackend(latency_median=args.llm_latency, latency_sigma=args.llm_sigma,
+                                             error_rate=args.llm_error_rate, chunk_size=40, seed=args.seed)
+    await llm_warm_up()
+    bot = create_bot(args.bot_latency)
+    dp = main.setup_dispatcher()
+
+    await main.initialize_database()
+    # Считаем все SQL-запросы, выполненные в потоке базы данных
+    statements = [0]
+
+    def count_statement(_):
+        statements[0] += 1
+
+    await run_in_db_thread(lambda: get_connection().set_trace_callback(count_statement))
+    if args.pool:
+        puzzle_pool.start()
+
+    stats = {"updates": [], "errors": 0}
+    rng = random.Random(args.seed)
+    users = [SimulatedUser(1_000_000 + i, bot, args.rounds, args.think_time, random.Random(rng.random()), stats)
+             for i in range(args.users)]
+
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+
+    started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run() for user in users))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    if args.pool:
+        await puzzle_pool.stop()
+    await dp.storage.close()
+    log_writer.wait_flushed()
+    await bot.session.close()
+
+    backend = puzzle_generation.backend
+    return {
+        "revision": git_revision(),
+        "started_at": started_at,
+        "settings": vars(args),
+        "duration": round(elapsed, 3),
+        "updates": len(stats["updates"]),
+        "errors": stats["errors"],
+        "updates_per_sec": round(len(stats["updates"]) / elapsed, 2),
+        "update_latency": percentiles(stats["updates"]),
+        "handlers": handler_percentiles(),
+        "loop_lag": percentiles(lags),
+        "db": {
+            "statements": statements[0],
+            "statements_per_sec": round(statements[0] / elapsed, 2),
+            "log_rows": log_writer.written,
+            "log_batches": log_writer.batches,
+        },
+        "llm": {"requests": backend.requests, "errors": backend.errors},
+        "bot_api_calls": dict(bot.session.calls),
+    }
+
+
+def report(result: dict):
+    print(f"Ревизия {result['revision']}, пользователей: {result['settings']['users']}, "
+          f"раундов: {result['settings']['rounds']}, задержка модели: {result['settings']['llm_latency']} с")
+    print(f"Апдейтов: {result['updates']} за {result['duration']:.1f} с, "
+          f"{result['updates_per_sec']:.0f} апдейтов/с, ошибок: {result['errors']}")
+    print(f"Задержка апдейта, мс: {result['update_latency']}")
+    print(f"Задержка event loop, мс: {result['loop_lag']}")
+    print(f"SQL-запросов: {result['db']['statements']} ({result['db']['statements_per_sec']:.0f}/с), "
+          f"записей логов: {result['db']['log_rows']} пачками по {result['db']['log_batches']}")
+    print(f"Запросов к модели: {result['llm']['requests']}, ошибок модели: {result['llm']['errors']}")
+    print("Обработчики (мс):")
+    for name, timing in result["handlers"].items():
+        print(f"  {name:<28} n={timing['count']:<6} p50 {timing['p50']:>8.1f}  p95 {timing['p95']:>8.1f}  "
+              f"p99 {timing['p99']:>8.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на настоящем диспетчере")
+    parser.add_argument("--users", type=int, default=100, help="Количество одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=2, help="Сколько головоломок решает каждый пользователь")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Средняя пауза пользователя между действиями, с")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Медиана задержки модели, с")
+    parser.add_argument("--llm-sigma", type=float, default=0.3, help="Разброс задержки модели")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля запросов к модели с ошибкой")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="Задержка ответа Bot API, с")
+    parser.add_argument("--pool", action="store_true", help="Запустить фоновое пополнение пула головоломок")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_load_result.json", help="Куда сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = asyncio.run(run(arguments))
+    report(result)
+    with open(arguments.output, "w", encoding="utf-8") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(f"Результат сохранен в {arguments.output}")
+    if arguments.compare:
+        with open(arguments.compare, encoding="utf-8") as file:
+            compare(result, json.load(file))
+    llm_shutdown()
+    db_shutdown()
+    sys.exit(1 if result["errors"] else 0)
@@ -0,0 +1,184 @@
+"""
+Бенчмарк многопроцессного режима: как пропускная способность растет с числом worker'ов.
+
+Для каждого числа worker'ов запускаются настоящие worker'ы из main.py (worker_main) с Telegram,
+замененным на FakeSession, и общей временной базой. Модель - отдельный процесс local_llm_server.py
+с LocalBackend, к которому worker'ы обращаются через OpenAIBackend, как к настоящему серверу.
+Синтетические пользователи отправляют апдейты через Front и ждут обработки каждого апдейта,
+прежде чем отправить следующий.
+
+Запуск: python bench_sharding.py --workers 1 2 4 --users 200 --rounds 2 --llm-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Настройки для процессов worker'ов передаются через окружение: при spawn они наследуют его
+os.environ.setdefault("LLM_BACKEND", "openai")
+os.environ.setdefault("LLM_MODEL", "local")
+os.environ.setdefault("METRICS_ENABLED", "0")
+
+LLM_PORT = 8091
+WORKERS_PORT = 9400
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    quantiles = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return {"count": len(values), "p50": round(quantiles[49] * 1000, 2), "p95": round(quantiles[94] * 1000, 2),
+            "p99": round(quantiles[98] * 1000, 2)}
+
+
+def run_llm_server(port: int, latency: float, sigma: float):
+    from aiohttp import web
+
+    from llm_backends import LocalBackend
+    from local_llm_server import HOST, make_app
+
+    backend = LocalBackend(latency_median=latency, latency_sigma=sigma, chunk_size=40, seed=1)
+    web.run_app(make_app(backend), host=HOST, port=port, access_log=None, print=None)
+
+
+def bench_worker(index: int):
+    import logging
+
+    import main
+    from fake_telegram import create_bot
+
+    # Информационные логи на каждый апдейт только искажают замер
+    logging.getLogger().setLevel(logging.WARNING)
+    main.bot = create_bot(float(os.environ["BENCH_BOT_LATENCY"]))
+    main.run_worker(index)
+
+
+async def simulate_user(front, user_id: int, rounds: int, rng: random.Random, latencies: list, errors: list):
+    from fake_telegram import callback_update, message_update
+
+    async def send(update: dict):
+        started = time.perf_counter()
+        try:
+            if not await (await front.route(update)):
+                errors.append(update["update_id"])
+        except ConnectionError:
+            errors.append(update["update_id"])
+        latencies.append(time.perf_counter() - started)
+
+    await send(message_update(user_id, "/start"))
+    await send(message_update(user_id, f"Пользователь {user_id}"))
+    await send(message_update(user_id, "Головоломки"))
+    for _ in range(rounds):
+        await send(message_update(user_id, "Получить новую головоломку"))
+        await send(callback_update(user_id, rng.choice(["logic", "charades", "riddles", "math", "associations"])))
+        await send(callback_update(user_id, rng.choice(["easy", "medium", "hard"])))
+        if rng.random() < 0.3:
+            await send(callback_update(user_id, "hint"))
+        if rng.random() < 0.15:
+            await send(callback_update(user_id, "cancel"))
+            continue
+        for _ in range(3):
+            await send(message_update(user_id, rng.choice(["не знаю", "42", "Мне кажется, это ветер"])))
+        if rng.random() < 0.2:
+            await send(message_update(user_id, rng.choice(["Профиль", "Таблица лидеров", "Мои головоломки"])))
+
+
+async def run_once(workers: int, args) -> dict:
+    import db_connection
+    import db_main_handler
+    from config import llm_max_in_flight
+    from sharding import Front, share_llm_limit, start_worker_process, stop_worker_processes
+
+    # У каждого прогона своя база, чтобы прогоны не влияли друг на друга
+    db_file = os.path.join(tempfile.mkdtemp(prefix="puzzles-sharding-"), "bench.db")
+    os.environ["PUZZLES_DB_FILE"] = db_file
+    db_connection.set_db_file(db_file)
+    db_main_handler.initialize_database()
+    db_connection.close_all()
+
+    share_llm_limit(llm_max_in_flight, workers)
+    processes = [start_worker_process(bench_worker, index) for index in range(workers)]
+    front = Front(workers, "127.0.0.1", WORKERS_PORT, max_pending=1000)
+    try:
+        await front.connect(timeout=120)
+        # Даем worker'ам прогреть клиент модели
+        await asyncio.sleep(1)
+
+        latencies, errors = [], []
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(front, 2_000_000 + i, args.rounds, random.Random(rng.random()),
+                                             latencies, errors) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await front.close()
+        stop_worker_processes(processes, 30)
+
+    per_worker = {link.index: 0 for link in front.links}
+    for i in range(args.users):
+        per_worker[front.worker_for(2_000_000 + i)] += 1
+    return {
+        "workers": workers,
+        "duration": round(elapsed, 3),
+        "updates": len(latencies),
+        "errors": len(errors),
+        "updates_per_sec": round(len(latencies) / elapsed, 2),
+        "update_latency": percentiles(latencies),
+        "users_per_worker": per_worker,
+    }
+
+
+async def run(args) -> dict:
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{LLM_PORT}/v1"
+    os.environ["BOT_WORKERS_PORT"] = str(WORKERS_PORT)
+    os.environ["BENCH_BOT_LATENCY"] = str(args.bot_latency)
+    llm_server = multiprocessing.get_context("spawn").Process(
+        target=run_llm_server, args=(LLM_PORT, args.llm_latency, args.llm_sigma), name="llm-server")
+    llm_server.start()
+    try:
+        results = []
+        for workers in args.workers:
+            result = await run_once(workers, args)
+            print(f"worker'ов: {workers:<3} апдейтов: {result['updates']:<6} за {result['duration']:>7.1f} с, "
+                  f"{result['updates_per_sec']:>8.1f} апдейтов/с, p95 {result['update_latency']['p95']:>8.1f} мс, "
+                  f"ошибок: {result['errors']}, пользователей по worker'ам: {result['users_per_worker']}", flush=True)
+            results.append(result)
+    finally:
+        llm_server.terminate()
+        llm_server.join()
+
+    base = results[0]["updates_per_sec"]
+    for result in results:
+        result["speedup"] = round(result["updates_per_sec"] / base, 2) if base else 0.0
+    return {"cpu_count": os.cpu_count(), "settings": vars(args), "runs": results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Масштабирование обработки апдейтов по worker-процессам")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Числа worker'ов для прогонов")
+    parser.add_argument("--users", type=int, default=200, help="Количество одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=2, help="Сколько головоломок решает каждый пользователь")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Медиана задержки модели, с")
+    parser.add_argument("--llm-sigma", type=float, default=0.3, help="Разброс задержки модели")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="Задержка ответа Bot API, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_sharding_result.json", help="Куда сохранить результат в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = asyncio.run(run(arguments))
+    print(f"Ядер процессора: {result['cpu_count']}")
+    for run_result in result["runs"]:
+        print(f"  {run_result['workers']} worker'ов: ускорение x{run_result['speedup']}")
+    with open(arguments.output, "w", encoding="utf-8") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(f"Результат сохранен в {arguments.output}")
+    sys.exit(1 if any(run_result["errors"] for run_result in result["runs"]) else 0)
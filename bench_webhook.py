@@ -0,0 +1,89 @@
+"""
+Локальный стенд для webhook-режима: поднимает WebhookServer на localhost, отправляет
+в него синтетические апдейты Telegram и измеряет время ответа сервера и сквозную
+задержку до ответа бота пользователю. Сеть и Telegram не нужны.
+
+Запуск: python bench_webhook.py [количество апдейтов] [параллельных отправителей] [задержка обработчика, с]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from aiogram import Dispatcher, Router, types
+from aiohttp import ClientSession
+
+from fake_telegram import create_bot, message_update
+from webhook import WebhookServer
+
+HOST = "127.0.0.1"
+PORT = 8089
+PATH = "/webhook"
+
+
+def percentiles(values: list) -> str:
+    values = sorted(values)
+    quantiles = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return (f"p50 {quantiles[49] * 1000:.1f} мс, p95 {quantiles[94] * 1000:.1f} мс, "
+            f"p99 {quantiles[98] * 1000:.1f} мс")
+
+
+def create_dispatcher(handler_delay: float) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def echo(message: types.Message):
+        # Имитация работы обработчика (запросы к базе, модели и т.п.)
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+        await message.answer(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    senders = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    handler_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    bot = create_bot()
+    server = WebhookServer(create_dispatcher(handler_delay), bot, PATH, concurrency=64, max_pending=1024,
+                           drain_timeout=30)
+    await server.start(HOST, PORT)
+
+    sent_at = {}
+    ack_latencies = []
+    queue = asyncio.Queue()
+    for chat_id in range(1, updates + 1):
+        queue.put_nowait(chat_id)
+
+    async def sender(session: ClientSession):
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            sent_at[chat_id] = time.perf_counter()
+            async with session.post(f"http://{HOST}:{PORT}{PATH}", json=message_update(chat_id, "ping")) as response:
+                response.raise_for_status()
+            ack_latencies.append(time.perf_counter() - sent_at[chat_id])
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(senders)))
+    # Корректная остановка: дожидаемся обработки всех принятых апдейтов
+    await server.stop()
+    elapsed = time.perf_counter() - started
+
+    replies = bot.session.last_reply_at
+    end_to_end = [replies[chat_id] - sent_at[chat_id] for chat_id in sent_at if chat_id in replies]
+
+    print(f"Апдейтов: {updates}, отправителей: {senders}, задержка обработчика: {handler_delay * 1000:.0f} мс")
+    print(f"Пропускная способность: {updates / elapsed:.0f} апдейтов/с")
+    print(f"Ответ webhook (200): {percentiles(ack_latencies)}")
+    print(f"До ответа пользователю: {percentiles(end_to_end)}")
+    print(f"Обработано: {len(end_to_end)}, ошибок: {server.failed}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+
+from config import broadcast_settings
+from db_async import get_user_ids_page, get_broadcast_progress, save_broadcast_progress
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости: не больше rate операций в секунду с запасом burst.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Приостанавливает выдачу токенов (когда Telegram ответил RetryAfter).
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Broadcast:
+    """
+    Рассылка сообщения всем пользователям с ограничением скорости.
+
+    Пользователи читаются из базы постранично, страница отправляется параллельно,
+    после каждой страницы прогресс сохраняется в таблицу broadcasts.
+    """
+
+    def __init__(self, bot: Bot, name: str, text: str, reply_markup=None,
+                 rate: float = None, concurrency: int = None, page_size: int = None,
+                 chat_interval: float = None, max_retries: int = None):
+        self.bot = bot
+        self.name = name
+        self.text = text
+        self.reply_markup = reply_markup
+        self.page_size = page_size or broadcast_settings["page_size"]
+        self.chat_interval = chat_interval if chat_interval is not None else broadcast_settings["chat_interval"]
+        self.max_retries = max_retries if max_retries is not None else broadcast_settings["max_retries"]
+        self._bucket = TokenBucket(rate or broadcast_settings["rate"])
+        self._semaphore = asyncio.Semaphore(concurrency or broadcast_settings["concurrency"])
+        self._last_sent_to = {}
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+
+    async def _pace_chat(self, chat_id: int):
+        # Не отправляем в один чат чаще, чем раз в chat_interval (актуально для повторов)
+        last = self._last_sent_to.get(chat_id)
+        if last is not None:
+            delay = last + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send(self, chat_id: int):
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._pace_chat(chat_id)
+                await self._bucket.acquire()
+                self._last_sent_to[chat_id] = time.monotonic()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=self.text, reply_markup=self.reply_markup)
+                    self.sent += 1
+                    return
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Рассылка {self.name}: Telegram просит подождать {e.retry_after} с")
+                    self._bucket.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    # Пользователь заблокировал бота, повторять бессмысленно
+                    self.blocked += 1
+                    return
+                except TelegramNetworkError as e:
+                    logging.warning(f"Рассылка {self.name}: сетевая ошибка для {chat_id}: {e}")
+                except TelegramAPIError as e:
+                    logging.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                    self.failed += 1
+                    return
+            self.failed += 1
+
+    async def run(self) -> dict:
+        """
+        Выполняет рассылку, продолжая с сохраненного места, если она уже начиналась.
+
+        :return: Итоги рассылки: отправлено, ошибок, заблокировали бота, длительность.
+        """
+        started = time.monotonic()
+        after_id = 0
+        progress = await get_broadcast_progress(self.name)
+        if progress is not None:
+            if progress["finished"]:
+                logging.info(f"Рассылка {self.name} уже завершена")
+                return {**progress, "duration": 0.0}
+            after_id = progress["last_user_id"]
+            self.sent, self.failed, self.blocked = progress["sent"], progress["failed"], progress["blocked"]
+            logging.info(f"Рассылка {self.name} продолжается после пользователя {after_id}")
+
+        while True:
+            page = await get_user_ids_page(after_id, self.page_size)
+            if not page:
+                break
+            await asyncio.gather(*(self._send(chat_id) for chat_id in page))
+            self._last_sent_to.clear()
+            after_id = page[-1]
+            await save_broadcast_progress(self.name, after_id, self.sent, self.failed, self.blocked)
+
+        await save_broadcast_progress(self.name, after_id, self.sent, self.failed, self.blocked, finished=True)
+        result = {
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "duration": round(time.monotonic() - started, 2),
+        }
+        logging.info(f"Рассылка {self.name} завершена: {result}")
+        return result
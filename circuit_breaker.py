@@ -0,0 +1,66 @@
+import logging
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для обращений к внешнему сервису.
+
+    После failure_threshold ошибок подряд размыкается: запросы сразу отклоняются,
+    не дожидаясь таймаутов. Через reset_timeout секунд пропускает один пробный запрос;
+    если он успешен, предохранитель замыкается, иначе снова размыкается.
+    Используется только из event loop, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """
+        Можно ли выполнить запрос прямо сейчас.
+        """
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logging.info(f"Предохранитель {self.name} замкнут, сервис снова отвечает")
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            logging.warning(f"Предохранитель {self.name} разомкнут после {self.failures} ошибок подряд")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """
+        Запрос завершился без результата (например, был отменен): пробный запрос можно повторить.
+        """
+        self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        return self.state != CLOSED
@@ -1,3 +1,5 @@
+import os
+
 category_names = {
     "logic": "Логика",
     "charades": "Шарады",
@@ -10,4 +12,151 @@ difficulty_names = {
     "easy": "Легкий",
     "medium": "Средний",
     "hard": "Сложный"
-}
\ No newline at end of file
+}
+
+# Бэкенд языковой модели: gradio (Space на Hugging Face), openai (OpenAI-совместимый сервер)
+# или local (локальная заглушка для тестов и бенчмарков без сети)
+llm_backend = os.getenv("LLM_BACKEND", "gradio")
+llm_backend_settings = {
+    "gradio": {
+        "space": "Qwen/Qwen2.5-72B-Instruct",
+    },
+    "openai": {
+        "base_url": os.getenv("LLM_BASE_URL", "http://127.0.0.1:8090/v1"),
+        "model": os.getenv("LLM_MODEL", "Qwen/Qwen2.5-72B-Instruct"),
+        "api_key": os.getenv("LLM_API_KEY", ""),
+        "timeout": 120,
+    },
+    "local": {
+        "latency_median": 1.0,  # Медиана задержки ответа, в секундах
+        "latency_sigma": 0.5,  # Разброс задержки (параметр логнормального распределения)
+        "error_rate": 0.0,  # Доля запросов, которые завершаются ошибкой
+        "hang_rate": 0.0,  # Доля запросов, которые "зависают"
+        "hang_time": 300.0,  # На сколько секунд зависает такой запрос
+        "chunk_size": 40,  # По сколько символов отдается ответ при потоковой генерации
+        "seed": 0,
+    },
+}
+
+# Ограничения для обращений к модели
+# Сколько запросов к модели может выполняться одновременно (в многопроцессном режиме фронт делит лимит между worker'ами)
+llm_max_in_flight = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+llm_timeouts = {  # Таймауты (в секундах) для каждого типа запроса
+    "generate": 120,
+    "hint": 60,
+    "check": 60,
+}
+
+# Устойчивость к сбоям модели
+llm_resilience_settings = {
+    "retries": 2,  # Сколько раз повторять запрос после ошибки модели (таймауты не повторяются)
+    "backoff_base": 0.5,  # Базовая пауза перед повтором, в секундах; растет вдвое с каждой попыткой
+    "backoff_cap": 5.0,  # Максимальная пауза перед повтором
+    "failure_threshold": 5,  # После скольких ошибок подряд запросы к модели временно прекращаются
+    "reset_timeout": 30,  # Через сколько секунд пробовать обратиться к модели снова
+    "warm_up_retry": 10,  # Через сколько секунд повторять прогрев клиента модели, если он не удался
+}
+
+# Банк сгенерированных головоломок в базе
+puzzle_bank_settings = {
+    "threshold": 0.7,  # С какой оценкой похожести (по MinHash) головоломка считается повтором
+}
+
+# Банк готовых головоломок на случай недоступности модели
+offline_puzzles_file = os.getenv("OFFLINE_PUZZLES_FILE", "offline_puzzles.json")
+
+# Настройки пула заранее сгенерированных головоломок
+puzzle_pool_settings = {
+    "min_depth": 1,  # Минимальный запас головоломок для каждой пары (категория, сложность)
+    "max_depth": 8,  # Максимальный запас
+    "ttl": 6 * 60 * 60,  # Через сколько секунд головоломка считается устаревшей
+    "refill_interval": 15,  # Период работы фонового пополнения, в секундах
+    "demand_window": 15 * 60,  # Окно, по которому оценивается спрос, в секундах
+    "refill_concurrency": 1,  # Сколько генераций для пула может идти одновременно
+}
+
+# Настройки фоновой записи логов
+log_writer_settings = {
+    "max_queue": 10000,  # Максимальная длина очереди, при заполнении запись блокируется
+    "batch_size": 500,  # Сколько записей пишется одной транзакцией
+    "flush_interval": 1.0,  # Как часто сбрасываются накопившиеся записи, в секундах
+}
+
+# Хранение журнала logs (см. log_archive.py)
+log_retention_settings = {
+    "days": 30,  # Сколько дней записи логов хранятся в базе
+    "archive_dir": "logs_archive",  # Каталог для сжатых файлов архива
+    "batch_size": 5000,  # Сколько записей читается в архив за один запрос
+    "delete_batch": 500,  # Сколько записей удаляется одной транзакцией
+    "vacuum_pages": 200,  # Сколько свободных страниц освобождается за один шаг incremental_vacuum
+    "pause": 0.05,  # Пауза между транзакциями удаления и шагами incremental_vacuum, в секундах
+}
+
+# Хранить кэш зарегистрированных пользователей в виде отсортированного массива
+# (примерно в 8 раз компактнее множества, но добавление работает за O(n))
+user_cache_compact = False
+
+# Настройки хранилища контекста пользователей
+context_store_settings = {
+    "max_entries": 100,  # Сколько последних записей хранится для одного пользователя
+    "memory_budget": 64 * 1024 * 1024,  # Общий лимит памяти на контекст всех пользователей, в байтах
+    "idle_ttl": 24 * 60 * 60,  # Через сколько секунд без активности контекст пользователя удаляется
+}
+
+# Настройки сборки контекста для запросов к модели
+prompt_settings = {
+    "context_budget": 1500,  # Максимальный размер контекста в символах
+    "full_entries": 3,  # Сколько последних записей вставляется целиком, остальные - кратко
+    "digest_length": 60,  # Длина краткой записи в символах
+}
+
+# Настройки массовых рассылок
+broadcast_settings = {
+    "rate": 25,  # Сообщений в секунду суммарно (лимит Telegram - около 30)
+    "concurrency": 20,  # Сколько сообщений может отправляться одновременно
+    "page_size": 500,  # Сколько пользователей загружается из базы за раз
+    "chat_interval": 1.0,  # Минимальный интервал между сообщениями в один чат, в секундах
+    "max_retries": 3,  # Сколько раз повторять отправку после RetryAfter или сетевой ошибки
+}
+
+# Настройки хранилища состояний FSM в SQLite
+fsm_storage_settings = {
+    "flush_delay": 0.3,  # Через сколько секунд после изменения состояние записывается в базу
+    "cache_size": 50000,  # Сколько состояний держится в памяти
+    "ttl": 7 * 24 * 60 * 60,  # Через сколько секунд без изменений состояние считается брошенным
+}
+
+# Режим получения апдейтов: polling или webhook
+bot_mode = os.getenv("BOT_MODE", "polling")
+
+# Настройки webhook-сервера
+webhook_settings = {
+    "host": os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+    "port": int(os.getenv("WEBHOOK_PORT", "8080")),
+    "path": os.getenv("WEBHOOK_PATH", "/webhook"),
+    "url": os.getenv("WEBHOOK_URL"),  # Публичный адрес; если не задан, webhook в Telegram не регистрируется
+    "secret": os.getenv("WEBHOOK_SECRET"),  # Проверяется по заголовку X-Telegram-Bot-Api-Secret-Token
+    "concurrency": 64,  # Сколько апдейтов обрабатывается одновременно
+    "max_pending": 1024,  # Сколько принятых апдейтов может ждать обработки, дальше ответ задерживается
+    "drain_timeout": 30,  # Сколько секунд ждать завершения обработки при остановке
+}
+
+# Многопроцессный режим (см. sharding.py): фронт распределяет апдейты по worker'ам по ID пользователя
+sharding_settings = {
+    "workers": int(os.getenv("BOT_WORKERS", "0")),  # Количество worker'ов; 0 - все в одном процессе
+    "host": "127.0.0.1",  # Адрес, на котором worker'ы принимают апдейты от фронта
+    "base_port": int(os.getenv("BOT_WORKERS_PORT", "9300")),  # Worker i слушает base_port + i
+    "max_pending": 1000,  # Сколько апдейтов может ждать обработки в одном worker'е, дальше фронт ждет
+    "concurrency": 64,  # Сколько апдейтов worker обрабатывает одновременно
+    "stop_timeout": 30,  # Сколько секунд ждать завершения worker'а при остановке
+}
+
+# HTTP-эндпоинт с метриками в формате Prometheus, включается через METRICS_ENABLED=1
+metrics_settings = {
+    "enabled": os.getenv("METRICS_ENABLED", "0") == "1",
+    "host": os.getenv("METRICS_HOST", "127.0.0.1"),
+    "port": int(os.getenv("METRICS_PORT", "9100")),
+}
+
+# Как часто (в секундах) можно редактировать сообщение при потоковом выводе ответа модели
+stream_edit_interval = 1.0
@@ -0,0 +1,158 @@
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+# Типы записей контекста
+PUZZLE = "puzzle"
+HINT = "hint"
+NOTE = "note"
+
+# Тексты короче этого размера не сжимаются: выигрыш меньше накладных расходов zlib
+_COMPRESS_FROM = 128
+# Примерный размер служебных объектов одной записи, в байтах
+_ENTRY_OVERHEAD = 120
+
+
+class ContextEntry:
+    """
+    Одна запись контекста. Текст хранится в сжатом виде, тема и сложность интернируются.
+    """
+    __slots__ = ("kind", "topic", "difficulty", "_data", "_compressed")
+
+    def __init__(self, kind: str, text: str, topic: str = None, difficulty: str = None):
+        self.kind = sys.intern(kind)
+        self.topic = sys.intern(topic) if topic else None
+        self.difficulty = sys.intern(difficulty) if difficulty else None
+
+        data = text.encode("utf-8")
+        self._compressed = False
+        if len(data) >= _COMPRESS_FROM:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data):
+                data, self._compressed = compressed, True
+        self._data = data
+
+    @property
+    def text(self) -> str:
+        data = zlib.decompress(self._data) if self._compressed else self._data
+        return data.decode("utf-8")
+
+    @property
+    def size(self) -> int:
+        return len(self._data) + _ENTRY_OVERHEAD
+
+    def render(self) -> str:
+        """
+        Текст записи в том виде, в котором он подставляется в запрос к модели.
+        """
+        if self.kind == PUZZLE and self.topic:
+            return f"Новая загадка, тема: {self.topic}, Сложность: {self.difficulty}, Задача: {self.text}"
+        if self.kind == PUZZLE:
+            return f"Новая загадка: {self.text}"
+        if self.kind == HINT:
+            return f"Использована подсказка: {self.text}"
+        return self.text
+
+
+class _UserHistory:
+    __slots__ = ("entries", "size", "last_access")
+
+    def __init__(self, max_entries: int):
+        self.entries = deque(maxlen=max_entries)
+        self.size = 0
+        self.last_access = time.monotonic()
+
+
+class ContextStore:
+    """
+    Ограниченное по памяти хранилище истории пользователей.
+
+    У каждого пользователя кольцевой буфер последних записей, а общий объем ограничен
+    бюджетом: при его превышении и по истечении idle_ttl вытесняются давно неактивные пользователи.
+    """
+
+    def __init__(self, max_entries: int, memory_budget: int, idle_ttl: float):
+        self.max_entries = max_entries
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        # Порядок вставки = порядок последнего обращения, в начале самые давние
+        self._users = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, user_id: int, kind: str, text: str, topic: str = None, difficulty: str = None):
+        """
+        Добавляет запись в историю пользователя.
+
+        :param user_id: ID пользователя.
+        :param kind: Тип записи (PUZZLE, HINT или NOTE).
+        :param text: Текст записи.
+        :param topic: Тема головоломки, если есть.
+        :param difficulty: Сложность головоломки, если есть.
+        """
+        entry = ContextEntry(kind, text, topic, difficulty)
+        with self._lock:
+            history = self._touch(user_id, create=True)
+            if len(history.entries) == history.entries.maxlen:
+                # deque сам выбросит самую старую запись, учитываем ее размер
+                removed = history.entries[0].size
+                history.size -= removed
+                self._bytes -= removed
+            history.entries.append(entry)
+            history.size += entry.size
+            self._bytes += entry.size
+            self._evict()
+
+    def entries(self, user_id: int) -> list:
+        """
+        Возвращает записи пользователя от старых к новым.
+        """
+        with self._lock:
+            history = self._touch(user_id)
+            return list(history.entries) if history else []
+
+    def clear(self, user_id: int):
+        with self._lock:
+            history = self._users.pop(user_id, None)
+            if history is not None:
+                self._bytes -= history.size
+
+    def _touch(self, user_id: int, create: bool = False):
+        history = self._users.get(user_id)
+        if history is None:
+            if not create:
+                return None
+            history = self._users[user_id] = _UserHistory(self.max_entries)
+        else:
+            self._users.move_to_end(user_id)
+        history.last_access = time.monotonic()
+        return history
+
+    def _evict(self):
+        border = time.monotonic() - self.idle_ttl
+        while self._users:
+            user_id, history = next(iter(self._users.items()))
+            if history.last_access >= border and self._bytes <= self.memory_budget:
+                break
+            del self._users[user_id]
+            self._bytes -= history.size
+            self.evicted += 1
+
+    def evict_idle(self):
+        """
+        Удаляет контекст давно неактивных пользователей (вызывается периодически).
+        """
+        with self._lock:
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "entries": sum(len(history.entries) for history in self._users.values()),
+                "bytes": self._bytes,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,98 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db_main_handler
+from db_connection import close_all
+from log_writer import log_writer
+from metrics import registry
+
+# Все обращения к базе из асинхронного кода выполняются в одном выделенном потоке,
+# поэтому у него одно долгоживущее соединение и запись идет последовательно
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+_pending = 0
+
+db_call_seconds = registry.histogram("puzzles_db_call_seconds", "Время выполнения функций db_main_handler",
+                                     ("function",))
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию работы с базой в потоке базы данных.
+
+    :param func: Функция из db_main_handler (или любая другая, работающая с get_connection).
+    :return: Результат функции.
+    """
+    global _pending
+    loop = asyncio.get_running_loop()
+    _pending += 1
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def pending() -> int:
+    """
+    Количество обращений к базе, которые ждут выполнения или выполняются прямо сейчас.
+    """
+    return _pending
+
+
+def _make_async(func):
+    name = func.__name__
+
+    def timed(*args, **kwargs):
+        # Замеряется только выполнение в потоке базы, без ожидания в очереди
+        with db_call_seconds.time(name):
+            return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(timed, *args, **kwargs)
+    return wrapper
+
+
+initialize_database = _make_async(db_main_handler.initialize_database)
+add_user = _make_async(db_main_handler.add_user)
+user_exists = _make_async(db_main_handler.user_exists)
+add_log = _make_async(db_main_handler.add_log)
+get_leaderboard = _make_async(db_main_handler.get_leaderboard)
+has_active_task = _make_async(db_main_handler.has_active_task)
+set_active_task = _make_async(db_main_handler.set_active_task)
+add_finished_task = _make_async(db_main_handler.add_finished_task)
+get_all_finished_tasks = _make_async(db_main_handler.get_all_finished_tasks)
+get_finished_tasks_page = _make_async(db_main_handler.get_finished_tasks_page)
+get_user_rating = _make_async(db_main_handler.get_user_rating)
+get_user_rank = _make_async(db_main_handler.get_user_rank)
+get_user_profile = _make_async(db_main_handler.get_user_profile)
+set_user_rating = _make_async(db_main_handler.set_user_rating)
+award_points = _make_async(db_main_handler.award_points)
+get_category_stats = _make_async(db_main_handler.get_category_stats)
+get_all_users = _make_async(db_main_handler.get_all_users)
+get_user_ids_page = _make_async(db_main_handler.get_user_ids_page)
+get_broadcast_progress = _make_async(db_main_handler.get_broadcast_progress)
+save_broadcast_progress = _make_async(db_main_handler.save_broadcast_progress)
+
+
+async def iter_finished_tasks(user_id: int, page_size: int = 100, with_text: bool = True):
+    """
+    Асинхронно перебирает решенные пользователем задачи от новых к старым, загружая их страницами.
+    """
+    before_id = None
+    while True:
+        page = await get_finished_tasks_page(user_id, before_id, page_size, with_text)
+        if not page:
+            return
+        for task in page:
+            yield task
+        before_id = page[-1]["id"]
+
+
+def shutdown():
+    """
+    Дожидается завершения операций с базой, дописывает логи и закрывает соединения.
+    """
+    _executor.shutdown(wait=True)
+    log_writer.stop()
+    close_all()
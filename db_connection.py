@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+
+DB_FILE = os.getenv("PUZZLES_DB_FILE", "app_database.db")
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL делает fsync только на чекпоинтах
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA busy_timeout = 5000",
+)
+# Сколько подготовленных выражений sqlite3 держит в кэше для каждого соединения
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_connections = []
+_lock = threading.Lock()
+_generation = 0
+
+
+def _connect(db_file: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_file, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает долгоживущее соединение с базой для текущего потока.
+
+    Соединение создается один раз и переиспользуется, поэтому подготовленные выражения
+    остаются в кэше между вызовами.
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.generation == _generation:
+        return connection
+
+    connection = _connect(DB_FILE)
+    with _lock:
+        _connections.append(connection)
+        _local.connection = connection
+        _local.generation = _generation
+    return connection
+
+
+def close_all():
+    """
+    Закрывает все открытые соединения. Следующий вызов get_connection откроет новое.
+    """
+    global _generation
+    with _lock:
+        for connection in _connections:
+            connection.close()
+        _connections.clear()
+        _generation += 1
+
+
+def set_db_file(db_file: str):
+    """
+    Переключает слой работы с базой на другой файл (используется в бенчмарках).
+    """
+    global DB_FILE
+    close_all()
+    DB_FILE = db_file
@@ -1,48 +1,204 @@
-import sqlite3
 import datetime
+import logging
+import time
 
-DB_FILE = "app_database.db"
+from db_connection import get_connection
+from leaderboard_cache import top_cache
+from log_writer import log_writer, LOG_FEEDBACK, LOG_OTHER, LOG_RATING, LOG_REGISTER, LOG_TASK
+from user_cache import registered_users
 
 
-def initialize_database():
+def _legacy_log_kind(log_text: str) -> str:
+    if "зарегистрировался" in log_text:
+        return LOG_REGISTER
+    if "активной задачи" in log_text or "завершил задачу" in log_text:
+        return LOG_TASK
+    if "Рейтинг" in log_text or "очков" in log_text:
+        return LOG_RATING
+    # Остальные записи старого формата - отзывы пользователей
+    return LOG_FEEDBACK
+
+
+def _migrate_legacy_logs(cursor):
     """
-    Инициализирует базу данных, создавая таблицы 'users' и 'logs', если они еще не существуют.
+    Переносит записи из старой таблицы logs, где время было дописано в конец текста.
     """
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
+    cursor.execute('SELECT id, user_id, log_text FROM logs_legacy ORDER BY id')
+    rows = []
+    for log_id, user_id, log_text in cursor.fetchall():
+        text, _, stamp = log_text.rpartition("\n")
+        try:
+            ts = int(datetime.datetime.fromisoformat(stamp).timestamp())
+        except ValueError:
+            text, ts = log_text, int(time.time())
+        rows.append((log_id, ts, _legacy_log_kind(text), user_id, text))
+    cursor.executemany('INSERT INTO logs (id, ts, kind, user_id, log_text) VALUES (?, ?, ?, ?, ?)', rows)
+    cursor.execute('DROP TABLE logs_legacy')
 
-    # Создаем таблицу для пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY, 
-            full_name TEXT NOT NULL,
-            hobbies TEXT,
-            rating REAL DEFAULT 0.0,
-            have_active_task BOOLEAN DEFAULT FALSE
-        )
-    ''')
-
-    # Создаем таблицу для логов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            log_text TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            task_text TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    connection.commit()
-    connection.close()
+def initialize_database():
+    """
+    Инициализирует базу данных, создавая таблицы 'users' и 'logs', если они еще не существуют.
+    """
+    connection = get_connection()
+    # Задача хранения логов освобождает место через incremental_vacuum (см. log_archive.py).
+    # В новой базе режим auto_vacuum включается сразу, а у существующей - только вместе с VACUUM,
+    # который переписывает весь файл, поэтому при запуске бота он не выполняется (см. enable_incremental_vacuum)
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        if connection.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        else:
+            logging.warning("В базе не включен auto_vacuum = INCREMENTAL: место после архивации логов "
+                            "не возвращается системе. Остановите бота и один раз выполните python vacuum_db.py")
+    with connection:
+        cursor = connection.cursor()
+
+        # Создаем таблицу для пользователей
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY, 
+                full_name TEXT NOT NULL,
+                hobbies TEXT,
+                rating REAL DEFAULT 0.0,
+                have_active_task BOOLEAN DEFAULT FALSE
+            )
+        ''')
+
+        # Создаем таблицу для логов (старую таблицу без типизированных колонок переносим)
+        cursor.execute("SELECT name FROM pragma_table_info('logs')")
+        columns = {row[0] for row in cursor.fetchall()}
+        if columns and "ts" not in columns:
+            cursor.execute('ALTER TABLE logs RENAME TO logs_legacy')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                kind TEXT NOT NULL DEFAULT 'other',
+                user_id INTEGER NOT NULL,
+                log_text TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_logs_user_ts ON logs (user_id, ts)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_logs_kind_ts ON logs (kind, ts)
+        ''')
+        if columns and "ts" not in columns:
+            _migrate_legacy_logs(cursor)
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_text TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        # Колонки для краткого списка решенных задач, в старых базах их нет
+        cursor.execute("SELECT name FROM pragma_table_info('tasks')")
+        task_columns = {row[0] for row in cursor.fetchall()}
+        if "category" not in task_columns:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN category TEXT')
+        if "solved_at" not in task_columns:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN solved_at INTEGER')
+        # Покрывающий индекс для истории решенных задач: страница без текста задач читается только из индекса
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks (user_id, id, category, solved_at)
+        ''')
+
+        # Индекс для таблицы лидеров и подсчета места в рейтинге
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_rating ON users (rating)
+        ''')
+
+        # Прогресс рассылок, чтобы после перезапуска продолжить с того же места
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                name TEXT PRIMARY KEY,
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                finished BOOLEAN NOT NULL DEFAULT FALSE
+            )
+        ''')
+
+        # Состояния FSM (см. sqlite_storage.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)
+        ''')
+
+        # Банк сгенерированных головоломок и просмотренные пользователями (см. puzzle_bank.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS puzzles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                puzzle TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                accepted_answers TEXT NOT NULL DEFAULT '[]',
+                hints TEXT NOT NULL DEFAULT '[]',
+                fingerprint TEXT NOT NULL UNIQUE,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_puzzles_category ON puzzles (category, difficulty)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS seen_puzzles (
+                user_id INTEGER NOT NULL,
+                puzzle_id INTEGER NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (user_id, puzzle_id)
+            ) WITHOUT ROWID
+        ''')
+
+        # Журнал решенных задач: только добавление, по нему считается статистика по категориям
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS solves (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                hints_used INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                points REAL NOT NULL,
+                solved_at INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        # Покрывающий индекс: статистика пользователя по категориям считается без чтения таблицы
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_solves_user_category ON solves (user_id, category, points, hints_used)
+        ''')
+
+    registered_users.load()
+
+def enable_incremental_vacuum():
+    """
+    Включает auto_vacuum = INCREMENTAL у существующей базы. Выполняет VACUUM, который
+    переписывает весь файл базы, поэтому запускается отдельно при остановленном боте (vacuum_db.py).
+    """
+    connection = get_connection()
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        logging.info("auto_vacuum = INCREMENTAL уже включен")
+        return
+    started = time.perf_counter()
+    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    connection.execute('VACUUM')
+    logging.info(f"auto_vacuum = INCREMENTAL включен, VACUUM занял {time.perf_counter() - started:.1f} с")
 
 def add_user(user_id: int, full_name: str, hobbies: str, rating: float = 0.0):
     """
@@ -56,17 +212,17 @@ def add_user(user_id: int, full_name: str, hobbies: str, rating: float = 0.0):
     if user_exists(user_id):
         raise ValueError(f"Пользователь с ID {user_id} уже существует.")
 
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-
-    cursor.execute('''
-        INSERT INTO users (id, full_name, hobbies, rating)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, full_name, hobbies, rating))
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
 
-    connection.commit()
-    connection.close()
-    add_log(user_id, "Юзер зарегистрировался")
+        cursor.execute('''
+            INSERT INTO users (id, full_name, hobbies, rating)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, full_name, hobbies, rating))
+    registered_users.add(user_id)
+    top_cache.on_rating_changed(user_id, rating, full_name)
+    add_log(user_id, "Юзер зарегистрировался", LOG_REGISTER)
 
 def user_exists(user_id: int) -> bool:
     """
@@ -75,7 +231,10 @@ def user_exists(user_id: int) -> bool:
     :param user_id: Telegram ID пользователя.
     :return: True, если пользователь существует, иначе False.
     """
-    connection = sqlite3.connect(DB_FILE)
+    if user_id in registered_users:
+        return True
+
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('''
@@ -83,32 +242,23 @@ def user_exists(user_id: int) -> bool:
     ''', (user_id,))
 
     exists = cursor.fetchone()[0]
-    connection.close()
+    if exists:
+        registered_users.add(user_id)
 
     return bool(exists)
 
-def add_log(user_id: int, log_text: str):
+def add_log(user_id: int, log_text: str, kind: str = LOG_OTHER):
     """
     Добавляет запись в лог для указанного пользователя.
 
+    Запись попадает в очередь и пишется в базу фоновым потоком пачками,
+    записи для несуществующих пользователей отбрасываются при записи.
+
     :param user_id: Telegram ID пользователя.
     :param log_text: Текст лога.
+    :param kind: Вид события, одно из log_writer.LOG_KINDS.
     """
-
-    log_text = f"{log_text}\n{str(datetime.datetime.now())}"
-    if not user_exists(user_id):
-        raise ValueError(f"Пользователь с ID {user_id} не существует.")
-
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-
-    cursor.execute('''
-        INSERT INTO logs (user_id, log_text)
-        VALUES (?, ?)
-    ''', (user_id, log_text))
-
-    connection.commit()
-    connection.close()
+    log_writer.write(user_id, log_text, kind)
 
 
 def get_leaderboard(limit: int = 5):
@@ -118,7 +268,11 @@ def get_leaderboard(limit: int = 5):
     :param limit: Максимальное количество лидеров для отображения.
     :return: Список пар (ФИО пользователя, рейтинг), отсортированных по убыванию рейтинга.
     """
-    connection = sqlite3.connect(DB_FILE)
+    # Первые места берем из кэша в памяти, он обновляется при каждом изменении рейтинга
+    if limit <= top_cache.size:
+        return top_cache.top(limit)
+
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('''
@@ -129,7 +283,6 @@ def get_leaderboard(limit: int = 5):
     ''', (limit,))
 
     leaderboard = cursor.fetchall()
-    connection.close()
 
     # Преобразуем результат в список словарей
     return [{"full_name": user[0], "rating": user[1], "id": user[2]} for user in leaderboard]
@@ -142,14 +295,12 @@ def has_active_task(user_id: int):
     :param user_id:
     :return: true/false - наличие задачи
     """
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('SELECT have_active_task FROM users WHERE id = ?', (user_id,))
     result = cursor.fetchone()
 
-    connection.close()
-
     if result is None:
         raise ValueError("Пользователь не найден!")
     return result[0]
@@ -161,14 +312,12 @@ def set_active_task(user_id: int, is_active: bool):
     :param user_id:
     :param is_active:
     """
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-
-    cursor.execute('UPDATE users SET have_active_task = ? WHERE id = ?', (is_active, user_id))
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
 
-    connection.commit()
-    connection.close()
-    add_log(user_id, f"У Пользователя с айди {user_id} значение активной задачи поменялось на {is_active}")
+        cursor.execute('UPDATE users SET have_active_task = ? WHERE id = ?', (is_active, user_id))
+    add_log(user_id, f"У Пользователя с айди {user_id} значение активной задачи поменялось на {is_active}", LOG_TASK)
 
 
 def add_finished_task(user_id: int, task_text: str):
@@ -177,40 +326,87 @@ def add_finished_task(user_id: int, task_text: str):
     :param user_id: ID пользователя
     :param task_text: Текст задачи
     """
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-
-    cursor.execute('''
-        INSERT INTO tasks (user_id, task_text)
-        VALUES (?, ?)
-    ''', (user_id, task_text))
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
 
-    connection.commit()
-    connection.close()
-    add_log(user_id, f"Пользвоатель с айди {user_id} успешно завершил задачу")
+        cursor.execute('''
+            INSERT INTO tasks (user_id, task_text, solved_at)
+            VALUES (?, ?, ?)
+        ''', (user_id, task_text, int(time.time())))
+    add_log(user_id, f"Пользвоатель с айди {user_id} успешно завершил задачу", LOG_TASK)
 
 def get_all_finished_tasks(user_id: int):
     """
     Получение мапы решенных юзером задач
     :param user_id:
     """
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('''
         SELECT id, task_text 
         FROM tasks
         WHERE user_id = ?
+        ORDER BY id
     ''', (user_id,))
 
     tasks = cursor.fetchall()
 
-    connection.close()
     result = [{task[0]: task[1]} for task in tasks]
 
     return result
 
 
+def get_finished_tasks_page(user_id: int, before_id: int = None, limit: int = 10, with_text: bool = True):
+    """
+    Страница решенных пользователем задач, от новых к старым.
+
+    Страница выбирается по курсору (ID задачи), а не смещением, поэтому время запроса
+    не зависит от номера страницы и размера таблицы.
+
+    :param user_id: ID пользователя.
+    :param before_id: ID последней задачи предыдущей страницы (None - с самой новой).
+    :param limit: Размер страницы.
+    :param with_text: Загружать ли текст задач. Без текста страница читается только из индекса.
+    :return: Список словарей с ключами id, category, solved_at (и task_text, если with_text).
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    columns = "id, category, solved_at, task_text" if with_text else "id, category, solved_at"
+    if before_id is None:
+        cursor.execute(f'''
+            SELECT {columns} FROM tasks
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (user_id, limit))
+    else:
+        cursor.execute(f'''
+            SELECT {columns} FROM tasks
+            WHERE user_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (user_id, before_id, limit))
+
+    names = ("id", "category", "solved_at", "task_text")
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def iter_finished_tasks(user_id: int, page_size: int = 100, with_text: bool = True):
+    """
+    Постранично перебирает решенные пользователем задачи, не загружая их все в память.
+    """
+    before_id = None
+    while True:
+        page = get_finished_tasks_page(user_id, before_id, page_size, with_text)
+        if not page:
+            return
+        yield from page
+        before_id = page[-1]["id"]
+
+
 def get_user_rating(user_id: int) -> float:
     """
     Получает рейтинг пользователя по его ID.
@@ -218,7 +414,7 @@ def get_user_rating(user_id: int) -> float:
     :param user_id: ID пользователя.
     :return: Рейтинг пользователя.
     """
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('''
@@ -226,13 +422,53 @@ def get_user_rating(user_id: int) -> float:
     ''', (user_id,))
 
     result = cursor.fetchone()
-    connection.close()
 
     if result is None:
         raise ValueError(f"Пользователь с ID {user_id} не найден.")
 
     return result[0]
 
+def get_user_rank(user_id: int) -> int:
+    """
+    Получает место пользователя в рейтинге.
+
+    :param user_id: ID пользователя.
+    :return: Место (1 - первое): количество пользователей со строго большим рейтингом плюс один.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    cursor.execute('''
+        SELECT COUNT(*) + 1
+        FROM users
+        WHERE rating > (SELECT rating FROM users WHERE id = ?)
+    ''', (user_id,))
+
+    return cursor.fetchone()[0]
+
+
+def get_user_profile(user_id: int):
+    """
+    Получает данные для профиля пользователя.
+
+    :param user_id: ID пользователя.
+    :return: Словарь с ФИО, рейтингом и местом в рейтинге.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    cursor.execute('''
+        SELECT full_name, rating FROM users WHERE id = ?
+    ''', (user_id,))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        raise ValueError(f"Пользователь с ID {user_id} не найден.")
+
+    return {"full_name": result[0], "rating": result[1], "rank": get_user_rank(user_id)}
+
+
 def set_user_rating(user_id: int, new_rating: float):
     """
     Обновляет рейтинг пользователя.
@@ -240,23 +476,162 @@ def set_user_rating(user_id: int, new_rating: float):
     :param user_id: ID пользователя.
     :param new_rating: Новый рейтинг пользователя.
     """
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+
+        cursor.execute('''
+            UPDATE users SET rating = ? WHERE id = ?
+        ''', (new_rating, user_id))
+    top_cache.on_rating_changed(user_id, new_rating)
+    add_log(user_id, f"Рейтинг пользователя с айди {user_id} изменился и стал равен {new_rating}", LOG_RATING)
+
+
+def award_points(user_id: int, category: str, difficulty: str, hints_used: int, attempts: int, points: float,
+                 task_text: str = None) -> float:
+    """
+    Начисляет очки за решенную задачу: увеличивает рейтинг, добавляет запись в журнал solves
+    и (если передан текст) в историю решенных задач одной транзакцией.
+    Рейтинг увеличивается в SQL, поэтому одновременные начисления не теряются.
+
+    :param user_id: ID пользователя.
+    :param category: Ключ категории из config.category_names.
+    :param difficulty: Ключ сложности из config.difficulty_names.
+    :param hints_used: Сколько подсказок взял пользователь.
+    :param attempts: С какой попытки решена задача.
+    :param points: Начисляемые очки.
+    :param task_text: Текст решенной задачи для истории (см. get_finished_tasks_page).
+    :return: Новый рейтинг пользователя.
+    """
+    now = int(time.time())
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+
+        cursor.execute('''
+            UPDATE users SET rating = rating + ? WHERE id = ? RETURNING rating
+        ''', (points, user_id))
+        result = cursor.fetchone()
+        if result is None:
+            raise ValueError(f"Пользователь с ID {user_id} не найден.")
+        cursor.execute('''
+            INSERT INTO solves (user_id, category, difficulty, hints_used, attempts, points, solved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, category, difficulty, hints_used, attempts, points, now))
+        if task_text is not None:
+            cursor.execute('''
+                INSERT INTO tasks (user_id, task_text, category, solved_at)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, task_text, category, now))
+    rating = result[0]
+    top_cache.on_rating_changed(user_id, rating)
+    add_log(user_id, f"Пользователь с айди {user_id} получил {points} очков, рейтинг стал равен {rating}", LOG_RATING)
+    return rating
+
+
+def get_category_stats(user_id: int):
+    """
+    Статистика решенных пользователем задач по категориям.
+
+    :param user_id: ID пользователя.
+    :return: Список словарей с категорией, количеством решенных задач, суммой очков
+             и средним числом подсказок, по убыванию количества решенных.
+    """
+    connection = get_connection()
     cursor = connection.cursor()
 
     cursor.execute('''
-        UPDATE users SET rating = ? WHERE id = ?
-    ''', (new_rating, user_id))
+        SELECT category, COUNT(*), SUM(points), AVG(hints_used)
+        FROM solves
+        WHERE user_id = ?
+        GROUP BY category
+        ORDER BY COUNT(*) DESC
+    ''', (user_id,))
 
-    connection.commit()
-    connection.close()
-    add_log(user_id, f"Рейтинг пользователя с айди {user_id} изменился и стал равен {new_rating}")
+    return [{"category": row[0], "solved": row[1], "points": row[2], "avg_hints": row[3]}
+            for row in cursor.fetchall()]
 
 
 def get_all_users():
-    # Пример для SQLite
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users")
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return users
\ No newline at end of file
+    """
+    Получает ID всех пользователей.
+
+    :return: Список ID пользователей.
+    """
+    return list(iter_user_ids())
+
+
+def get_user_ids_page(after_id: int = 0, limit: int = 1000):
+    """
+    Получает страницу ID пользователей по возрастанию, начиная после after_id.
+
+    :param after_id: ID, после которого начинается страница (0 - с начала).
+    :param limit: Размер страницы.
+    :return: Список ID пользователей.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    cursor.execute('''
+        SELECT id FROM users
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, limit))
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def iter_user_ids(after_id: int = 0, page_size: int = 1000):
+    """
+    Постранично перебирает ID пользователей, не загружая всю таблицу в память.
+    """
+    while True:
+        page = get_user_ids_page(after_id, page_size)
+        if not page:
+            return
+        yield from page
+        after_id = page[-1]
+
+
+def get_broadcast_progress(name: str):
+    """
+    Получает сохраненный прогресс рассылки.
+
+    :param name: Уникальное имя рассылки.
+    :return: Словарь с прогрессом или None, если рассылка еще не начиналась.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    cursor.execute('''
+        SELECT last_user_id, sent, failed, blocked, finished
+        FROM broadcasts WHERE name = ?
+    ''', (name,))
+
+    result = cursor.fetchone()
+    if result is None:
+        return None
+
+    return {"last_user_id": result[0], "sent": result[1], "failed": result[2],
+            "blocked": result[3], "finished": bool(result[4])}
+
+
+def save_broadcast_progress(name: str, last_user_id: int, sent: int, failed: int, blocked: int, finished: bool = False):
+    """
+    Сохраняет прогресс рассылки: все пользователи с ID не больше last_user_id уже обработаны.
+    """
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+
+        cursor.execute('''
+            INSERT INTO broadcasts (name, last_user_id, sent, failed, blocked, finished)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                last_user_id = excluded.last_user_id,
+                sent = excluded.sent,
+                failed = excluded.failed,
+                blocked = excluded.blocked,
+                finished = excluded.finished
+        ''', (name, last_user_id, sent, failed, blocked, finished))
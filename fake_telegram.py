@@ -0,0 +1,113 @@
+"""
+Заглушка Telegram Bot API для бенчмарков и локальных прогонов без сети.
+
+FakeSession подменяет сетевую сессию aiogram: запросы не уходят в Telegram,
+а сразу получают правдоподобный ответ. Также здесь собраны функции для создания
+синтетических апдейтов.
+"""
+import asyncio
+import datetime
+import itertools
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, GetMe, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, User
+
+BOT_TOKEN = "123456:FAKE-token-for-local-benchmarks"
+BOT_ID = 123456
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия, которая отвечает на запросы Bot API локально с заданной задержкой.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        # Время последнего ответа бота в каждый чат, по нему считается сквозная задержка
+        self.last_reply_at = {}
+        self.replies = defaultdict(list)
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, GetMe):
+            return User(id=BOT_ID, is_bot=True, first_name="Puzzles bot", username="puzzles_bot")
+        if isinstance(method, (SendMessage, EditMessageText, EditMessageReplyMarkup)):
+            chat_id = int(method.chat_id)
+            self.last_reply_at[chat_id] = time.perf_counter()
+            text = getattr(method, "text", None)
+            if text is not None:
+                self.replies[chat_id].append(text)
+            return Message(
+                message_id=getattr(method, "message_id", None) or next(_message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                from_user=User(id=BOT_ID, is_bot=True, first_name="Puzzles bot"),
+                text=text,
+            ).as_(bot)  # Как и настоящая сессия, привязываем ответ к боту, чтобы у него работали edit_text и т.п.
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+
+def create_bot(latency: float = 0.0) -> Bot:
+    return Bot(token=BOT_TOKEN, session=FakeSession(latency))
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    """
+    Апдейт с текстовым сообщением от пользователя в личном чате.
+    """
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    """
+    Апдейт с нажатием inline-кнопки под сообщением бота.
+    """
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Puzzles bot"},
+                "text": "...",
+            },
+        },
+    }
@@ -0,0 +1,108 @@
+import threading
+from bisect import bisect_left, insort
+
+from db_connection import get_connection
+
+
+class Leaderboard:
+    """
+    Отсортированный в памяти топ пользователей по рейтингу.
+
+    Хранит первые size мест и обновляется точечно при изменении рейтинга,
+    поэтому таблица лидеров не требует сортировки всей таблицы users.
+    """
+
+    def __init__(self, size: int = 100):
+        self.size = size
+        # Записи (-рейтинг, id): по возрастанию идут от первого места к последнему
+        self._entries = []
+        self._ratings = {}
+        self._names = {}
+        self._loaded = False
+        # True, если в кэше лежат вообще все пользователи
+        self._complete = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT id, full_name, rating
+            FROM users
+            ORDER BY rating DESC, id
+            LIMIT ?
+        ''', (self.size,))
+
+        self._entries = []
+        self._ratings = {}
+        self._names = {}
+        for user_id, full_name, rating in cursor.fetchall():
+            self._entries.append((-rating, user_id))
+            self._ratings[user_id] = rating
+            self._names[user_id] = full_name
+        self._complete = len(self._entries) < self.size
+        self._loaded = True
+
+    def _remove(self, user_id: int):
+        entry = (-self._ratings.pop(user_id), user_id)
+        del self._entries[bisect_left(self._entries, entry)]
+        del self._names[user_id]
+
+    def top(self, limit: int) -> list:
+        """
+        Возвращает первые limit мест таблицы лидеров.
+
+        :param limit: Количество мест, не больше размера кэша.
+        :return: Список словарей с ФИО, рейтингом и ID пользователя.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return [
+                {"full_name": self._names[user_id], "rating": -rating, "id": user_id}
+                for rating, user_id in self._entries[:limit]
+            ]
+
+    def on_rating_changed(self, user_id: int, rating: float, full_name: str = None):
+        """
+        Обновляет кэш после изменения рейтинга пользователя (или его регистрации).
+
+        :param user_id: ID пользователя.
+        :param rating: Новый рейтинг.
+        :param full_name: ФИО, если известно (иначе берется из кэша или базы).
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+
+            was_cached = user_id in self._ratings
+            if was_cached:
+                full_name = full_name or self._names[user_id]
+                self._remove(user_id)
+
+            entry = (-rating, user_id)
+            if not self._complete and self._entries and entry > self._entries[-1]:
+                # Пользователь оказался ниже последнего известного места
+                if was_cached:
+                    # Освободилось место в топе, кто его займет - знает только база
+                    self._loaded = False
+                return
+
+            if full_name is None:
+                cursor = get_connection().cursor()
+                cursor.execute('SELECT full_name FROM users WHERE id = ?', (user_id,))
+                full_name = cursor.fetchone()[0]
+
+            insort(self._entries, entry)
+            self._ratings[user_id] = rating
+            self._names[user_id] = full_name
+            if len(self._entries) > self.size:
+                _, last_id = self._entries[-1]
+                self._remove(last_id)
+                self._complete = False
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+
+top_cache = Leaderboard()
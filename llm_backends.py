@@ -0,0 +1,289 @@
+"""
+Бэкенды языковой модели.
+
+Функции генерации из puzzle_generation работают с моделью только через интерфейс LLMBackend:
+complete (ответ целиком) и stream (накопленный текст по мере генерации). Реализации:
+
+- GradioBackend - Space на Hugging Face через gradio_client (основной режим);
+- OpenAIBackend - любой сервер с OpenAI-совместимым API /v1/chat/completions;
+- LocalBackend - детерминированная локальная заглушка с настраиваемыми задержками и ошибками
+  для тестов и бенчмарков без сети.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+
+import httpx
+
+from offline_bank import offline_bank
+
+
+class LLMBackendError(Exception):
+    """Модель вернула ошибку или оказалась недоступна."""
+
+
+class LLMBackend:
+    """
+    Базовый класс бэкенда модели.
+    """
+
+    name = "base"
+
+    def complete(self, prompt: str, system: str = None) -> str:
+        """
+        Отправляет запрос модели и возвращает ответ целиком.
+
+        :param prompt: Текст запроса пользователя.
+        :param system: Системный промпт.
+        :return: Текст ответа модели.
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt: str, system: str = None):
+        """
+        Отправляет запрос модели и по мере генерации отдает накопленный текст ответа.
+        По умолчанию отдает ответ целиком одним куском.
+        """
+        yield self.complete(prompt, system)
+
+    def warm_up(self):
+        """
+        Готовит бэкенд к первому запросу (создает клиент, устанавливает соединение).
+        Вызывается в фоне после запуска бота; при ошибке бросает LLMBackendError.
+        """
+
+
+class GradioBackend(LLMBackend):
+    """
+    Модель в Space на Hugging Face. Клиент создается при первом запросе, а не при импорте.
+    """
+
+    name = "gradio"
+
+    def __init__(self, space: str, api_name: str = "/model_chat"):
+        self.space = space
+        self.api_name = api_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # gradio_client импортируется долго, поэтому только когда клиент действительно нужен
+                    from gradio_client import Client
+                    self._client = Client(self.space)
+        return self._client
+
+    def warm_up(self):
+        # Создание клиента обращается к Space и загружает описание его API
+        try:
+            self.client
+        except Exception as e:
+            raise LLMBackendError(f"Не удалось подключиться к Space {self.space}: {e}") from e
+
+    def _kwargs(self, system: str) -> dict:
+        return {"system": system} if system else {}
+
+    def complete(self, prompt: str, system: str = None) -> str:
+        try:
+            response = self.client.predict(prompt, api_name=self.api_name, **self._kwargs(system))
+            # Пустой или неожиданный ответ Space - такая же ошибка модели, как и отказ
+            return response[1][0][1]
+        except Exception as e:
+            raise LLMBackendError(f"Ошибка Space {self.space}: {e}") from e
+
+    def stream(self, prompt: str, system: str = None):
+        try:
+            job = self.client.submit(prompt, api_name=self.api_name, **self._kwargs(system))
+        except Exception as e:
+            raise LLMBackendError(f"Ошибка Space {self.space}: {e}") from e
+        text = ""
+        try:
+            for response in job:
+                chunk = response[1][0][1] if response[1] else ""
+                if chunk and chunk != text:
+                    text = chunk
+                    yield text
+            # Последний промежуточный ответ может не совпадать с итоговым
+            final = job.result()[1][0][1]
+            if final != text:
+                yield final
+        except LLMBackendError:
+            raise
+        except Exception as e:
+            raise LLMBackendError(f"Ошибка Space {self.space}: {e}") from e
+        finally:
+            if not job.done():
+                job.cancel()
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Сервер с OpenAI-совместимым API (vLLM, llama.cpp, TGI, облачные провайдеры, local_llm_server.py).
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url: str, model: str, api_key: str = "", timeout: float = 120):
+        self.model = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.Client(base_url=base_url.rstrip("/"), headers=headers, timeout=timeout)
+
+    def _payload(self, prompt: str, system: str, stream: bool) -> dict:
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        return {"model": self.model, "messages": messages, "stream": stream}
+
+    def warm_up(self):
+        # Устанавливаем соединение заранее, чтобы первый запрос пользователя не ждал рукопожатия
+        try:
+            self._client.get("/models").raise_for_status()
+        except httpx.HTTPError as e:
+            raise LLMBackendError(f"OpenAI-совместимый сервер недоступен: {e}") from e
+
+    def complete(self, prompt: str, system: str = None) -> str:
+        try:
+            response = self._client.post("/chat/completions", json=self._payload(prompt, system, False))
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            raise LLMBackendError(f"Ошибка OpenAI-совместимого сервера: {e}") from e
+
+    def stream(self, prompt: str, system: str = None):
+        text = ""
+        finished = False
+        try:
+            with self._client.stream("POST", "/chat/completions", json=self._payload(prompt, system, True)) as response:
+                response.raise_for_status()
+                # Ответ приходит в формате server-sent events: строки "data: {...}", в конце "data: [DONE]"
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        finished = True
+                        break
+                    delta = json.loads(data)["choices"][0]["delta"].get("content")
+                    if delta:
+                        text += delta
+                        yield text
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            raise LLMBackendError(f"Ошибка OpenAI-совместимого сервера: {e}") from e
+        if not finished:
+            raise LLMBackendError("OpenAI-совместимый сервер оборвал ответ")
+
+
+# Локальная заглушка отвечает головоломками из банка, который поставляется вместе с ботом
+LOCAL_PUZZLES = offline_bank.all()
+
+_PUZZLE_LINE = re.compile(r"^Головоломка: (.*)$", re.MULTILINE)
+_ANSWER_LINE = re.compile(r"^Ответ пользователя: (.*)$", re.MULTILINE)
+
+
+class LocalBackend(LLMBackend):
+    """
+    Детерминированная локальная заглушка модели.
+
+    Отвечает головоломками из LOCAL_PUZZLES (банк offline_puzzles.json) в формате, который ожидает puzzle_generation.
+    Задержка ответа распределена логнормально (медиана latency_median, разброс latency_sigma),
+    с вероятностью error_rate запрос завершается ошибкой, а с вероятностью hang_rate "зависает"
+    на hang_time секунд. При одинаковом seed последовательность ответов и задержек повторяется.
+    """
+
+    name = "local"
+
+    def __init__(self, latency_median: float = 1.0, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_time: float = 300.0, chunk_size: int = 40, seed: int = 0):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.chunk_size = chunk_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def plan(self, prompt: str, system: str = None):
+        """
+        Определяет, что и когда ответит заглушка.
+
+        :return: (текст ответа, задержка в секундах, ошибка или None).
+        """
+        with self._lock:
+            self.requests += 1
+            if self.latency_median > 0:
+                delay = self._random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+            else:
+                delay = 0.0
+            failure = self._random.random() < self.error_rate
+            if self._random.random() < self.hang_rate:
+                delay = self.hang_time
+            puzzle = self._random.choice(LOCAL_PUZZLES)
+            if failure:
+                self.errors += 1
+
+        error = LLMBackendError("Локальная модель: имитация ошибки") if failure else None
+        return self._respond(prompt, system or "", puzzle), delay, error
+
+    def _respond(self, prompt: str, system: str, puzzle: dict) -> str:
+        if prompt.startswith("Создай"):
+            if "JSON" in system:
+                return json.dumps(puzzle, ensure_ascii=False)
+            return f"{puzzle['puzzle']}${puzzle['answer']}"
+
+        puzzle_match = _PUZZLE_LINE.search(prompt)
+        known = next((item for item in LOCAL_PUZZLES if puzzle_match and item["puzzle"] == puzzle_match.group(1)), None)
+        if prompt.startswith("Проверь"):
+            answer_match = _ANSWER_LINE.search(prompt)
+            user_answer = answer_match.group(1).strip().lower().rstrip(".") if answer_match else ""
+            if known is not None and user_answer in known["accepted_answers"]:
+                return "$Верно! Вы правильно решили головоломку."
+            return "К сожалению, ответ неверный. Попробуйте еще раз внимательно перечитать условие"
+        if "подсказ" in prompt:
+            return known["hints"][0] if known is not None else "Попробуйте взглянуть на условие с другой стороны."
+        return "Не понимаю запрос."
+
+    def chunks(self, text: str):
+        """
+        Нарезает ответ на накопленные куски так, как их отдавала бы модель при потоковой генерации.
+        """
+        for end in range(self.chunk_size, len(text) + self.chunk_size, self.chunk_size):
+            yield text[:end]
+
+    def complete(self, prompt: str, system: str = None) -> str:
+        text, delay, error = self.plan(prompt, system)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return text
+
+    def stream(self, prompt: str, system: str = None):
+        text, delay, error = self.plan(prompt, system)
+        chunks = list(self.chunks(text))
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            if error is not None:
+                raise error
+            yield chunk
+
+
+_BACKENDS = {backend.name: backend for backend in (GradioBackend, OpenAIBackend, LocalBackend)}
+
+
+def create_backend(name: str, **settings) -> LLMBackend:
+    """
+    Создает бэкенд модели по имени.
+
+    :param name: gradio, openai или local.
+    :param settings: Параметры конструктора бэкенда (см. config.llm_backend_settings).
+    """
+    if name not in _BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд модели: {name}")
+    return _BACKENDS[name](**settings)
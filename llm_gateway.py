@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import puzzle_generation
+from circuit_breaker import CircuitBreaker
+from config import llm_max_in_flight, llm_timeouts, llm_resilience_settings
+from llm_backends import LLMBackendError
+from metrics import registry
+from puzzle_generation import generate_puzzle, generate_hint, check_answer
+from puzzle_generation import stream_puzzle_with_user_context, stream_check_answer
+from startup import startup
+from user_guard import mark_model_call
+
+# Пул потоков, в котором выполняются синхронные обращения к модели
+_executor = ThreadPoolExecutor(max_workers=llm_max_in_flight, thread_name_prefix="llm")
+_semaphore = None
+
+llm_request_seconds = registry.histogram(
+    "puzzles_llm_request_seconds", "Время запросов к модели с учетом ожидания в очереди", ("kind", "outcome"))
+llm_retries = registry.counter("puzzles_llm_retries_total", "Повторы запросов к модели после ошибки", ("kind",))
+llm_rejected = registry.counter("puzzles_llm_rejected_total",
+                                "Запросы, отклоненные без обращения к модели, пока она недоступна", ("kind",))
+
+# Размыкается после серии ошибок, чтобы при сбое модели не ждать таймаута на каждом запросе
+breaker = CircuitBreaker("llm", llm_resilience_settings["failure_threshold"], llm_resilience_settings["reset_timeout"])
+
+
+class LLMError(Exception):
+    """Не удалось получить ответ модели."""
+
+
+class LLMTimeoutError(LLMError):
+    """Модель не ответила за отведенное время."""
+
+
+class LLMBusyError(LLMTimeoutError):
+    """Не дождались свободного слота для запроса: перегружен бот, а не модель."""
+
+
+class LLMUnavailableError(LLMError):
+    """Модель недоступна: ошибки не прекратились после повторов или предохранитель разомкнут."""
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(llm_max_in_flight)
+    return _semaphore
+
+
+def in_flight() -> int:
+    """
+    Количество запросов к модели, которые выполняются прямо сейчас.
+    """
+    if _semaphore is None:
+        return 0
+    return llm_max_in_flight - _semaphore._value
+
+
+def _release(loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore):
+    # Вызывается из потока пула, поэтому освобождаем слот через event loop
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(semaphore.release)
+
+
+def _put(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, item):
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+
+async def _acquire_slot(kind: str, timeout: float) -> asyncio.Semaphore:
+    semaphore = _get_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Не дождались свободного слота для запроса к модели ({kind})")
+        raise LLMBusyError(kind)
+    return semaphore
+
+
+async def _attempt(kind: str, func, args: tuple, timeout: float):
+    """
+    Выполняет синхронную функцию генерации в пуле потоков, не блокируя event loop.
+
+    Слот семафора освобождается только когда поток действительно завершил работу,
+    поэтому даже после таймаута одновременно выполняется не больше llm_max_in_flight запросов.
+    Ожидание свободного слота тоже входит в таймаут.
+
+    :param kind: Тип запроса (generate/hint/check).
+    :param func: Синхронная функция из puzzle_generation.
+    :param timeout: Сколько секунд осталось на запрос.
+    """
+    mark_model_call()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    outcome = "error"
+    try:
+        semaphore = await _acquire_slot(kind, timeout)
+        try:
+            future = _executor.submit(func, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: _release(loop, semaphore))
+
+        # При отмене корутины еще не начатая задача снимается из очереди пула
+        result = await asyncio.wait_for(asyncio.wrap_future(future), started + timeout - loop.time())
+        outcome = "ok"
+        return result
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logging.warning(f"Запрос к модели ({kind}) не уложился в {timeout:.1f} с")
+        raise LLMTimeoutError(kind)
+    except LLMTimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        llm_request_seconds.observe(loop.time() - started, kind, outcome)
+
+
+def _drain_generator(generator, on_chunk, stop: threading.Event):
+    # Выполняется в потоке пула: передает куски в event loop и возвращает итог генератора
+    try:
+        while True:
+            if stop.is_set():
+                generator.close()
+                return None
+            on_chunk(next(generator))
+    except StopIteration as result:
+        return result.value
+
+
+async def _attempt_stream(kind: str, generator_func, args: tuple, on_chunk, timeout: float):
+    """
+    Выполняет потоковую функцию генерации в пуле потоков.
+
+    Промежуточные куски передаются в on_chunk (корутину); если куски приходят быстрее,
+    чем on_chunk их обрабатывает, промежуточные пропускаются и передается только последний.
+
+    :param on_chunk: Асинхронная функция, принимающая накопленный текст.
+    :return: Итоговый результат потоковой функции.
+    """
+    mark_model_call()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + timeout
+    outcome = "error"
+    chunks = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    try:
+        semaphore = await _acquire_slot(kind, timeout)
+    except LLMTimeoutError:
+        llm_request_seconds.observe(loop.time() - started, kind, "timeout")
+        raise
+    try:
+        future = _executor.submit(_drain_generator, generator_func(*args), lambda chunk: _put(loop, chunks, chunk), stop)
+    except BaseException:
+        semaphore.release()
+        raise
+    future.add_done_callback(lambda _: _release(loop, semaphore))
+    future.add_done_callback(lambda _: _put(loop, chunks, done))
+
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            chunk = await asyncio.wait_for(chunks.get(), remaining)
+            # Берем самый свежий кусок из накопившихся
+            while not chunks.empty() and chunk is not done:
+                chunk = chunks.get_nowait()
+            if chunk is done:
+                result = future.result()
+                outcome = "ok"
+                return result
+            await on_chunk(chunk)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logging.warning(f"Потоковый запрос к модели ({kind}) не уложился в {timeout:.1f} с")
+        raise LLMTimeoutError(kind)
+    finally:
+        stop.set()
+        llm_request_seconds.observe(loop.time() - started, kind, outcome)
+
+
+async def _resilient(kind: str, attempt, timeout: float = None, can_retry=None):
+    """
+    Выполняет запрос к модели с общим дедлайном, повторами и предохранителем.
+
+    Ошибки модели повторяются с экспоненциальной паузой со случайным разбросом, пока хватает
+    времени до дедлайна; таймауты не повторяются. Пока предохранитель разомкнут, запрос сразу
+    завершается LLMUnavailableError, и обработчик переходит на работу без модели.
+    Так же завершаются запросы, пока модель не прогрета (см. warm_up).
+
+    :param attempt: Корутинная функция одной попытки, принимающая оставшееся время.
+    :param timeout: Дедлайн в секундах, по умолчанию берется из config.llm_timeouts.
+    :param can_retry: Функция, которая решает, можно ли повторить запрос после ошибки.
+    """
+    if timeout is None:
+        timeout = llm_timeouts[kind]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    retries = llm_resilience_settings["retries"]
+
+    for number in range(retries + 1):
+        # Пока клиент модели не прогрет, не ждем его создания, а сразу переходим на работу без модели
+        if not startup.model_ready or not breaker.allow():
+            llm_rejected.inc(kind)
+            raise LLMUnavailableError(kind)
+        try:
+            result = await attempt(deadline - loop.time())
+        except LLMBusyError:
+            # До модели запрос не дошел, поэтому ошибкой модели не считается
+            breaker.release()
+            raise
+        except LLMTimeoutError:
+            breaker.record_failure()
+            raise
+        except LLMBackendError as e:
+            breaker.record_failure()
+            # "Полный" разброс: пауза случайна от 0 до текущего предела, чтобы повторы не шли волной
+            delay = random.uniform(0, min(llm_resilience_settings["backoff_cap"],
+                                          llm_resilience_settings["backoff_base"] * 2 ** number))
+            if number == retries or (can_retry and not can_retry()) or loop.time() + delay >= deadline:
+                logging.warning(f"Модель недоступна ({kind}): {e}")
+                raise LLMUnavailableError(kind) from e
+            logging.info(f"Ошибка модели ({kind}), повтор через {delay:.2f} с: {e}")
+            llm_retries.inc(kind)
+            await asyncio.sleep(delay)
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+
+async def _run(kind: str, func, *args, timeout: float = None):
+    return await _resilient(kind, lambda remaining: _attempt(kind, func, args, remaining), timeout)
+
+
+async def _run_stream(kind: str, generator_func, *args, on_chunk, timeout: float = None):
+    delivered = False
+
+    async def forward(chunk):
+        nonlocal delivered
+        delivered = True
+        await on_chunk(chunk)
+
+    # Если пользователь уже видит часть ответа, повторная генерация выдала бы другой текст
+    return await _resilient(kind, lambda remaining: _attempt_stream(kind, generator_func, args, forward, remaining),
+                            timeout, can_retry=lambda: not delivered)
+
+
+async def generate_fresh_puzzle_async(topic: str, difficulty: str, timeout: float = None):
+    """
+    Асинхронная версия generate_puzzle (без пользовательского контекста).
+    """
+    return await _run("generate", generate_puzzle, topic, difficulty, timeout=timeout)
+
+
+async def generate_hint_async(user_id: int, puzzle_text: str, timeout: float = None):
+    """
+    Асинхронная версия generate_hint.
+    """
+    return await _run("hint", generate_hint, user_id, puzzle_text, timeout=timeout)
+
+
+async def check_answer_async(user_id: int, puzzle_text: str, user_answer: str, timeout: float = None):
+    """
+    Асинхронная версия check_answer.
+    """
+    return await _run("check", check_answer, user_id, puzzle_text, user_answer, timeout=timeout)
+
+
+async def stream_puzzle_async(user_id: int, topic: str, difficulty: str, on_chunk, timeout: float = None):
+    """
+    Генерирует головоломку, передавая текст в on_chunk по мере генерации.
+
+    :return: Словарь с головоломкой и ответом, как у generate_puzzle_with_user_context.
+    """
+    return await _run_stream("generate", stream_puzzle_with_user_context, user_id, topic, difficulty,
+                             on_chunk=on_chunk, timeout=timeout)
+
+
+async def stream_check_answer_async(user_id: int, puzzle_text: str, user_answer: str, on_chunk, timeout: float = None):
+    """
+    Проверяет ответ, передавая комментарий модели в on_chunk по мере генерации.
+
+    :return: [верно, комментарий], как у check_answer.
+    """
+    return await _run_stream("check", stream_check_answer, user_id, puzzle_text, user_answer,
+                             on_chunk=on_chunk, timeout=timeout)
+
+
+async def warm_up():
+    """
+    Создает и прогревает клиент модели в пуле потоков модели, не задерживая прием апдейтов.
+    Пока прогрев не удался, повторяет его с паузой; после успеха отмечает готовность модели.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(_executor, puzzle_generation.backend.warm_up)
+        except LLMBackendError as e:
+            logging.warning(f"Не удалось прогреть модель, повтор через "
+                            f"{llm_resilience_settings['warm_up_retry']} с: {e}")
+            await asyncio.sleep(llm_resilience_settings["warm_up_retry"])
+        else:
+            startup.set_model_ready()
+            return
+
+
+def shutdown():
+    """
+    Останавливает пул потоков, отменяя запросы, которые еще не начали выполняться.
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
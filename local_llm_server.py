@@ -0,0 +1,89 @@
+"""
+Локальный сервер с OpenAI-совместимым API поверх LocalBackend.
+
+Позволяет прогонять бота и бенчмарки с бэкендом openai без сети: задержки и ошибки
+имитируются так же, как в LocalBackend, но запросы идут по настоящему HTTP.
+
+Запуск: python local_llm_server.py [порт]
+Бот: LLM_BACKEND=openai LLM_BASE_URL=http://127.0.0.1:8090/v1 python main.py
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from aiohttp import web
+
+from config import llm_backend_settings
+from llm_backends import LocalBackend
+
+HOST = "127.0.0.1"
+PORT = 8090
+
+
+def _split_messages(messages: list):
+    system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    return prompt, system
+
+
+def _sse(payload: dict) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+
+def make_app(backend: LocalBackend) -> web.Application:
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt, system = _split_messages(body.get("messages", []))
+        model = body.get("model", "local")
+        text, delay, error = backend.plan(prompt, system)
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            if error is not None:
+                return web.json_response({"error": {"message": str(error)}}, status=500)
+            return web.json_response({
+                "id": f"local-{backend.requests}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunks = list(backend.chunks(text))
+        sent = ""
+        for chunk in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            if error is not None:
+                # Обрываем поток, как это делает перегруженный сервер
+                return response
+            await response.write(_sse({
+                "id": f"local-{backend.requests}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": chunk[len(sent):]}, "finish_reason": None}],
+            }))
+            sent = chunk
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "local", "object": "model", "owned_by": "local"}]})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    web.run_app(make_app(LocalBackend(**llm_backend_settings["local"])), host=HOST, port=port, access_log=None)
@@ -0,0 +1,118 @@
+"""
+Хранение журнала logs: записи старше заданного срока переносятся в сжатые файлы архива,
+после чего освободившиеся страницы возвращаются системе через incremental_vacuum.
+Так рабочая база остается небольшой и помещается в кэш.
+
+Архив - файлы JSON Lines в gzip, по одному на запуск. Записи удаляются из базы только
+после того, как файл архива полностью записан на диск.
+
+Задача выполняется в собственном потоке со своим соединением, а не в потоке базы данных,
+поэтому обращения обработчиков к базе ее не ждут. Удаление и incremental_vacuum идут
+небольшими транзакциями с паузами, чтобы блокировка записи не держалась долго.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import log_retention_settings
+from db_connection import get_connection
+from metrics import registry
+
+archived_logs = registry.counter("puzzles_logs_archived_total", "Записи логов, перенесенные в архив")
+
+# Отдельный поток: у него свое соединение с базой (get_connection хранит соединение на поток)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-archive")
+
+
+def archive_old_logs(days: int, archive_dir: str, batch_size: int, delete_batch: int, vacuum_pages: int,
+                     pause: float) -> int:
+    """
+    Переносит в архив записи логов старше days дней.
+
+    Записи читаются по возрастанию id до первой свежей записи, поэтому чтение не требует
+    отдельного индекса по времени. Время записи растет вместе с id не строго (записи пишутся
+    пачками и из нескольких процессов), поэтому удаляются только записи старше срока.
+
+    :param days: Сколько дней записи хранятся в базе.
+    :param archive_dir: Каталог для файлов архива.
+    :param batch_size: Сколько записей читается за один запрос.
+    :param delete_batch: Сколько записей удаляется одной транзакцией.
+    :param vacuum_pages: Сколько свободных страниц освобождается за один шаг incremental_vacuum.
+    :param pause: Пауза между транзакциями, чтобы другие потоки и процессы успевали писать.
+    :return: Количество перенесенных записей.
+    """
+    cutoff = int(time.time()) - days * 24 * 60 * 60
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"logs-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+    temp_path = path + ".tmp"
+    last_id, archived = 0, 0
+    with open(temp_path, "wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8") as file:
+            while True:
+                cursor.execute('''
+                    SELECT id, ts, kind, user_id, log_text FROM logs
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                # Старые записи после первой свежей будут перенесены при следующем запуске
+                old_rows = []
+                for row in rows:
+                    if row[1] >= cutoff:
+                        break
+                    old_rows.append(row)
+                for log_id, ts, kind, user_id, log_text in old_rows:
+                    file.write(json.dumps({"id": log_id, "ts": ts, "kind": kind, "user_id": user_id,
+                                           "text": log_text}, ensure_ascii=False) + "\n")
+                if old_rows:
+                    last_id = old_rows[-1][0]
+                    archived += len(old_rows)
+                if len(old_rows) < batch_size:
+                    break
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    if not archived:
+        os.remove(temp_path)
+        return 0
+    os.replace(temp_path, path)
+
+    # Удаляем небольшими транзакциями, чтобы не держать блокировку записи долго.
+    # Условие по времени гарантирует, что удаляются только записи, попавшие в архив
+    while True:
+        with connection:
+            cursor.execute('''
+                DELETE FROM logs WHERE id IN (
+                    SELECT id FROM logs WHERE id <= ? AND ts < ? ORDER BY id LIMIT ?
+                )
+            ''', (last_id, cutoff, delete_batch))
+        if cursor.rowcount < delete_batch:
+            break
+        time.sleep(pause)
+
+    # Возвращаем освободившиеся страницы системе небольшими шагами (только при auto_vacuum = INCREMENTAL).
+    # execute() делает только один шаг прагмы (одну страницу), executescript() выполняет ее целиком
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        free_pages = connection.execute('PRAGMA freelist_count').fetchone()[0]
+        for _ in range(0, free_pages, vacuum_pages):
+            connection.executescript(f'PRAGMA incremental_vacuum({vacuum_pages})')
+            time.sleep(pause)
+
+    archived_logs.inc(amount=archived)
+    logging.info(f"Перенесено в архив {archived} записей логов: {path}")
+    return archived
+
+
+async def archive_old_logs_async() -> int:
+    """
+    Переносит старые записи логов в архив с настройками из config.log_retention_settings.
+    Выполняется в отдельном потоке, не занимая поток базы данных.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: archive_old_logs(**log_retention_settings))
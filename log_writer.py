@@ -0,0 +1,134 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from config import log_writer_settings
+from db_connection import get_connection
+
+_STOP = object()
+
+# Виды событий в журнале logs
+LOG_REGISTER = "register"
+LOG_TASK = "task"
+LOG_RATING = "rating"
+LOG_FEEDBACK = "feedback"
+LOG_OTHER = "other"
+LOG_KINDS = (LOG_REGISTER, LOG_TASK, LOG_RATING, LOG_FEEDBACK, LOG_OTHER)
+
+
+class LogWriter:
+    """
+    Отложенная запись логов: вызывающий код только кладет запись в очередь,
+    а фоновый поток пишет накопившиеся записи одной транзакцией.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def write(self, user_id: int, log_text: str, kind: str = LOG_OTHER):
+        """
+        Ставит запись лога в очередь. Если очередь заполнена, ждет, пока фоновый поток ее разгрузит.
+
+        :param user_id: Telegram ID пользователя.
+        :param log_text: Текст лога.
+        :param kind: Вид события, одно из LOG_KINDS.
+        """
+        if kind not in LOG_KINDS:
+            raise ValueError(f"Неизвестный вид события лога: {kind}")
+        self._ensure_started()
+        # Время события фиксируется сразу, а не при записи пачки
+        self._queue.put((int(time.time()), kind, user_id, log_text))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(record)
+
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logging.error(f"Не удалось записать {len(batch)} записей лога: {e}")
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _flush(self, batch: list):
+        connection = get_connection()
+        user_ids = list({record[2] for record in batch})
+        placeholders = ", ".join("?" * len(user_ids))
+
+        with connection:
+            cursor = connection.cursor()
+            # Проверяем существование всех пользователей пачки одним запросом
+            cursor.execute(f'SELECT id FROM users WHERE id IN ({placeholders})', user_ids)
+            existing = {row[0] for row in cursor.fetchall()}
+
+            records = [record for record in batch if record[2] in existing]
+            if len(records) != len(batch):
+                self.dropped += len(batch) - len(records)
+                logging.warning(f"Пропущено {len(batch) - len(records)} записей лога для несуществующих пользователей")
+
+            cursor.executemany('''
+                INSERT INTO logs (ts, kind, user_id, log_text)
+                VALUES (?, ?, ?, ?)
+            ''', records)
+
+        self.written += len(records)
+        self.batches += 1
+
+    def wait_flushed(self):
+        """
+        Блокирует до тех пор, пока все поставленные в очередь записи не будут записаны.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self):
+        """
+        Записывает все оставшиеся записи и останавливает фоновый поток.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+
+log_writer = LogWriter(**log_writer_settings)
+# Гарантируем, что накопившиеся записи попадут в базу при завершении процесса
+atexit.register(log_writer.stop)
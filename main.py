@@ -1,16 +1,43 @@
+# Импортируется первым: замер этапов запуска начинается до импорта остальных модулей
+from startup import startup
 import asyncio
+import datetime
 import logging
 import random
+import signal
 from aiogram import Bot, Dispatcher, types, Router, BaseMiddleware
 from aiogram.filters.command import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, KeyboardButton, ReplyKeyboardMarkup
-from config import category_names, difficulty_names
+from config import category_names, difficulty_names, fsm_storage_settings, bot_mode, webhook_settings, metrics_settings
+from config import sharding_settings, llm_max_in_flight
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from puzzle_generation import generate_puzzle_with_user_context, check_answer, generate_hint, clear_user_context
-from db_main_handler import initialize_database, add_user, get_leaderboard, get_user_rating, set_user_rating, add_log, user_exists, add_user, get_all_users
+from puzzle_generation import clear_user_context, remember_puzzle, remember_hint, context_store
+from puzzle_pool import puzzle_pool
+from broadcast import Broadcast
+from answer_checker import check_locally, fast_path_rate, ACCEPT, REJECT
+from llm_gateway import generate_hint_async, stream_puzzle_async, stream_check_answer_async, LLMError
+from llm_gateway import breaker as llm_breaker
+from offline_bank import offline_bank
+from puzzle_bank import puzzle_bank
+from message_streamer import MessageStreamer
+from llm_gateway import shutdown as llm_shutdown, warm_up as llm_warm_up
+from db_async import initialize_database, add_user, get_leaderboard, award_points, get_category_stats, add_log, user_exists
+from db_async import get_user_profile, get_broadcast_progress, get_finished_tasks_page
+from user_cache import registered_users
+from sqlite_storage import SQLiteStorage
+from webhook import run_webhook
+from db_async import shutdown as db_shutdown, pending as db_pending, run_in_db_thread
+from llm_gateway import in_flight as llm_in_flight
+from log_writer import log_writer, LOG_FEEDBACK
+from log_archive import archive_old_logs_async
+from answer_checker import stats as answer_check_stats
+from metrics import registry, HandlerMetricsMiddleware, start_metrics_server
+from user_guard import user_guard, UserGuardMiddleware
+from leaderboard_cache import top_cache
+from sharding import Front, RoutingWebhookServer, poll_updates, serve_worker, start_worker_process, supervise
+from sharding import share_llm_limit, stop_worker_processes
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
@@ -19,7 +46,7 @@ API_TOKEN = "7898792093:AAGJq48M50ewbEqyk0j4M70Z9d1XX41o0-w"
 
 # Инициализация бота и диспетчера
 bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+storage = SQLiteStorage(**fsm_storage_settings)
 dp = Dispatcher(storage=storage)
 router = Router()
 
@@ -49,9 +76,9 @@ class CheckRegisterMiddleware(BaseMiddleware):
         if current_state in [PuzzleState.registering_name.state, PuzzleState.registering_hobby.state]:
             return await handler(event, data)
 
-        # Проверяем, зарегистрирован ли пользователь
-        if not user_exists(user_id):
-            await bot.send_message(chat_id=user_id, text="Вы не зарегистрированы! Зарегистрируйтесь, используя команду /start.")
+        # Проверяем, зарегистрирован ли пользователь (сначала по кэшу в памяти, без похода в базу)
+        if not registered_users.contains(user_id) and not await user_exists(user_id):
+            await data["bot"].send_message(chat_id=user_id, text="Вы не зарегистрированы! Зарегистрируйтесь, используя команду /start.")
             return  # Не передаем управление дальше
 
         # Если все проверки пройдены, вызываем обработчик
@@ -64,7 +91,8 @@ def get_main_menu_keyboard():
         keyboard=[
             [KeyboardButton(text="Получить новую головоломку")],
             [KeyboardButton(text="Таблица лидеров")],
-            [KeyboardButton(text="Профиль")]
+            [KeyboardButton(text="Профиль")],
+            [KeyboardButton(text="Мои головоломки")]
         ],
         resize_keyboard=True,
         one_time_keyboard=False 
@@ -75,7 +103,7 @@ async def start_handler(message: types.Message, state: FSMContext):
     
     user_id = message.from_user.id
 
-    if not user_exists(user_id):
+    if not registered_users.contains(user_id) and not await user_exists(user_id):
         await message.answer("Добро пожаловать! Похоже, вы здесь впервые.\nПожалуйста, введите ваше ФИО для регистрации.")
         await state.set_state(PuzzleState.registering_name)
     else:
@@ -99,7 +127,7 @@ async def handle_registration_hobby(message: types.Message, state: FSMContext):
     data = await state.get_data()
     full_name = data.get("full_name")
 
-    add_user(user_id, full_name, hobby)
+    await add_user(user_id, full_name, hobby)
     keyboard = get_main_menu_keyboard()
     await message.answer(f"Спасибо, {full_name}! Вы успешно зарегистрированы.\nВаше хобби: {hobby}", reply_markup=keyboard)
     await state.clear()
@@ -107,7 +135,7 @@ async def handle_registration_hobby(message: types.Message, state: FSMContext):
 
 @router.message(lambda message: message.text == "Таблица лидеров")
 async def show_leaderboard(message: types.Message, state: FSMContext):
-    leaderboard = get_leaderboard()
+    leaderboard = await get_leaderboard()
 
     leaderboard_text = "\n".join([f"{i + 1}. {user['full_name']} - {user['rating']}" for i, user in enumerate(leaderboard)])
 
@@ -115,14 +143,63 @@ async def show_leaderboard(message: types.Message, state: FSMContext):
 
 
 @router.message(lambda message: message.text == "Профиль")
-async def show_leaderboard(message: types.Message, state: FSMContext):
+async def show_profile(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    leaderboard = get_leaderboard(limit=1000)
+    profile = await get_user_profile(user_id)
+    stats = await get_category_stats(user_id)
+
+    text = f"ФИО: {profile['full_name']}\nРейтинг: {profile['rating']}\nМесто в рейтинге: {profile['rank']}"
+    if stats:
+        text += "\n\nРешено задач:\n" + "\n".join(
+            f"{category_names.get(row['category'], row['category'])}: {row['solved']} "
+            f"(очков: {row['points']:.1f}, подсказок в среднем: {row['avg_hints']:.1f})" for row in stats)
+    await message.answer(text)
+
+
+
+HISTORY_PAGE_SIZE = 5
+
+
+async def history_page(user_id: int, before_id: int = None):
+    """
+    Текст и клавиатура страницы истории решенных задач.
+    Курсор следующей страницы (ID последней показанной задачи) передается в callback_data.
+    """
+    # Берем на одну задачу больше, чтобы узнать, есть ли следующая страница
+    tasks = await get_finished_tasks_page(user_id, before_id, HISTORY_PAGE_SIZE + 1)
+    if not tasks:
+        return "Вы еще не решили ни одной головоломки", None
+    has_more = len(tasks) > HISTORY_PAGE_SIZE
+    tasks = tasks[:HISTORY_PAGE_SIZE]
+
+    lines = []
+    for task in tasks:
+        solved_at = datetime.datetime.fromtimestamp(task["solved_at"]).strftime("%d.%m.%Y") if task["solved_at"] else ""
+        category = category_names.get(task["category"], "")
+        title = " - ".join(part for part in (solved_at, category) if part)
+        text = task["task_text"] if len(task["task_text"]) <= 200 else task["task_text"][:200] + "..."
+        lines.append(f"{title}\n{text}" if title else text)
+
+    keyboard = None
+    if has_more:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Дальше", callback_data=f"history:{tasks[-1]['id']}")],
+        ])
+    return "Решенные головоломки:\n\n" + "\n\n".join(lines), keyboard
+
+
+@router.message(lambda message: message.text == "Мои головоломки")
+async def show_history(message: types.Message, state: FSMContext):
+    text, keyboard = await history_page(message.from_user.id)
+    await message.answer(text, reply_markup=keyboard)
 
-    for i, user in enumerate(leaderboard):
-        if user["id"] == user_id:
-            await message.answer(f"ФИО: {user['full_name']}\nРейтинг: {user['rating']}\nМесто в рейтинге: {i+1}")
-            break
+
+@router.callback_query(lambda c: c.data and c.data.startswith("history:"))
+async def show_history_page(callback_query: CallbackQuery, state: FSMContext):
+    before_id = int(callback_query.data.split(":", 1)[1])
+    text, keyboard = await history_page(callback_query.from_user.id, before_id)
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+    await callback_query.answer()
 
     
 # Обработчик для кнопки "Получить новую головоломку"
@@ -197,8 +274,26 @@ async def choose_difficulty(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(PuzzleState.choosing_difficulty)
     await callback_query.answer()
 
+
+async def offline_puzzle(user_id: int, category: str, difficulty: str) -> dict:
+    """
+    Головоломка из встроенного банка, которую пользователь еще не видел (по возможности).
+    Ее сложность (ключ difficulty) может оказаться ниже выбранной, если таких головоломок в банке нет.
+    Просмотренные встроенные головоломки отмечаются в банке головоломок, как и сгенерированные.
+    """
+    candidates = offline_bank.candidates(category, difficulty)
+    puzzle_data = await puzzle_bank.take_unseen_from_async(user_id, category,
+                                                           random.sample(candidates, len(candidates)))
+    if puzzle_data is None:
+        # Пользователь видел все подходящие головоломки - придется повторить
+        puzzle_data = offline_bank.pick(category, difficulty)
+    remember_puzzle(user_id, category_names[category], difficulty_names[puzzle_data["difficulty"]],
+                    puzzle_data["puzzle"])
+    return puzzle_data
+
+
 # Обработка выбора сложности
-@router.callback_query(lambda c: c.data in ["easy", "medium", "hard"])
+@router.callback_query(lambda c: c.data in ["easy", "medium", "hard"], flags={"single_flight": "generate", "serialize": True})
 async def type_puzzle(callback_query: CallbackQuery, state: FSMContext):
     current_state = await state.get_state()
     if current_state == PuzzleState.solving_puzzle.state:
@@ -212,9 +307,43 @@ async def type_puzzle(callback_query: CallbackQuery, state: FSMContext):
     category_name = category_names[category]
     user_id = callback_query.from_user.id
 
-    puzzle_data = generate_puzzle_with_user_context(user_id, category_names[category], difficulty_names[difficulty])
+    # Сначала берем готовую головоломку из пула, затем не виденную пользователем из банка,
+    # и только если таких нет - генерируем новую
+    puzzle_data = puzzle_pool.take(category, difficulty)
+    # Головоломки пула уже лежат в банке, и пользователь мог получить такую оттуда
+    while puzzle_data is not None and await puzzle_bank.is_seen_async(user_id, puzzle_data["id"]):
+        puzzle_data = puzzle_pool.take(category, difficulty)
+    if puzzle_data is None:
+        puzzle_data = await puzzle_bank.take_unseen_async(user_id, category, difficulty)
+    if puzzle_data is not None:
+        remember_puzzle(user_id, category_name, difficulty_name, puzzle_data["puzzle"])
+    elif not startup.model_ready:
+        # Клиент модели еще прогревается после запуска - не ждем его
+        puzzle_data = await offline_puzzle(user_id, category, difficulty)
+    else:
+        # Показываем головоломку по мере генерации
+        header = f"Головоломка\nТип: {category_name}\nСложность: {difficulty_name}\n\n"
+        await callback_query.message.edit_text(f"{header}Генерируем головоломку...")
+        streamer = MessageStreamer(callback_query.message, prefix=header)
+        try:
+            puzzle_data = await stream_puzzle_async(user_id, category_name, difficulty_name, on_chunk=streamer.update)
+            puzzle_data["id"], is_new = await puzzle_bank.add_async(category, difficulty, puzzle_data)
+            if not is_new and await puzzle_bank.is_seen_async(user_id, puzzle_data["id"]):
+                # Модель повторила головоломку, которую пользователь уже видел
+                puzzle_data = await offline_puzzle(user_id, category, difficulty)
+        except LLMError:
+            # Модель недоступна или не успела ответить
+            puzzle_data = await offline_puzzle(user_id, category, difficulty)
+    if puzzle_data.get("id") is not None:
+        await puzzle_bank.mark_seen_async(user_id, puzzle_data["id"])
+    # Встроенная головоломка может оказаться проще выбранной: очки начисляются по ее сложности
+    difficulty = puzzle_data.get("difficulty", difficulty)
+    difficulty_name = difficulty_names[difficulty]
     puzzle_text, correct_answer = puzzle_data["puzzle"], puzzle_data["answer"]
-    await state.update_data(difficulty=difficulty, current_puzzle=puzzle_text, correct_answer=correct_answer, score=0)
+    # Варианты ответа и подсказки приходят вместе с головоломкой, отдельные запросы к модели не нужны
+    await state.update_data(difficulty=difficulty, current_puzzle=puzzle_text, correct_answer=correct_answer,
+                            accepted_answers=puzzle_data.get("accepted_answers", []),
+                            hints=puzzle_data.get("hints", []), score=0)
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Получить подсказку", callback_data="hint")],
@@ -233,10 +362,16 @@ async def type_puzzle(callback_query: CallbackQuery, state: FSMContext):
 
 
 # Ожидание ответа от пользователя
-@router.message(PuzzleState.solving_puzzle)
+@router.message(PuzzleState.solving_puzzle, flags={"single_flight": "answer", "serialize": True})
 async def process_user_answer(message: types.Message, state: FSMContext):
-    
-    await message.answer("Проверяем ваш ответ, ожидайте")
+    # Пока ждали очереди, предыдущий ответ мог завершить задачу
+    if await state.get_state() != PuzzleState.solving_puzzle.state:
+        await message.answer("Эта задача уже завершена")
+        return
+
+    wait_message = await message.answer("Проверяем ваш ответ, ожидайте")
+    # Итог проверки показываем в том же сообщении, комментарий модели - по мере генерации
+    streamer = MessageStreamer(wait_message)
     
     user_answer = message.text
     data = await state.get_data()
@@ -245,8 +380,22 @@ async def process_user_answer(message: types.Message, state: FSMContext):
     score = data.get("score")
     user_id = message.from_user.id
 
-    # Проверка ответа
-    is_correct, comment = check_answer(user_id, puzzle_text, user_answer)  # Функция для проверки ответа
+    # Сначала пробуем проверить ответ локально, к модели обращаемся только в спорных случаях
+    verdict = check_locally(user_answer, data.get("correct_answer"), data.get("accepted_answers"))
+    if verdict == ACCEPT:
+        is_correct, comment = 1, f"Верно! Правильный ответ: {data.get('correct_answer')}"
+        clear_user_context(user_id)
+    elif verdict == REJECT:
+        is_correct, comment = 0, "К сожалению, ответ неверный"
+    else:
+        try:
+            is_correct, comment = await stream_check_answer_async(user_id, puzzle_text, user_answer, on_chunk=streamer.update)
+        except LLMError:
+            # Без модели можно проверить только короткий ответ, попытку при этом не списываем
+            await streamer.finish("Сейчас не получается проверить такой ответ. Попробуйте ответить короче: "
+                                  "одним словом или числом")
+            return
+    logging.info(f"Проверка ответа: {verdict}, доля проверок без модели: {fast_path_rate():.2f}")
 
     # Если ответ правильный
     if is_correct:
@@ -259,35 +408,35 @@ async def process_user_answer(message: types.Message, state: FSMContext):
         score += diff_points[difficulty]
         hints_used = data.get("hints_used", 0)
         score *= 0.9**hints_used
-        rating = get_user_rating(user_id)
-        set_user_rating(user_id, rating + score)
+        # Рейтинг и запись в журнале решений обновляются одной транзакцией
+        await award_points(user_id, data.get("category"), difficulty, hints_used, 4 - attempts_left, score,
+                           puzzle_text)
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Оценить", callback_data="rate")],
             [InlineKeyboardButton(text="Получить новую головоломку", callback_data="new_puzzle")],
         ])
-        await message.answer(comment, reply_markup=keyboard)
+        await streamer.finish(comment, reply_markup=keyboard)
         await state.clear()  # Завершаем задачу
     else:
         # Уменьшаем количество попыток
         attempts_left -= 1
         score -= 0.5
-        state.update_data(score = score)
         
         if attempts_left > 0:
-            await state.update_data(attempts_left=attempts_left)
-            await message.answer(f"{comment}.\n\nОсталось попыток: {attempts_left}. Попробуйте снова.")
+            await state.update_data(attempts_left=attempts_left, score=score)
+            await streamer.finish(f"{comment}.\n\nОсталось попыток: {attempts_left}. Попробуйте снова.")
         else:
             correct_answer = data.get("correct_answer")
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Оценить", callback_data="rate")],
                 [InlineKeyboardButton(text="Получить новую головоломку", callback_data="new_puzzle")],
             ])
-            await message.answer(f"Вы исчерпали все попытки! Задача отменена.\n\nПравильный ответ: {correct_answer}", reply_markup=keyboard)
+            await streamer.finish(f"Вы исчерпали все попытки! Задача отменена.\n\nПравильный ответ: {correct_answer}", reply_markup=keyboard)
             await state.clear()  # Завершаем задачу
 
 
 # Обработчик для кнопки "Получить подсказку"
-@router.callback_query(lambda c: c.data == "hint")
+@router.callback_query(lambda c: c.data == "hint", flags={"single_flight": "hint", "serialize": True})
 async def handle_hint(callback_query: CallbackQuery, state: FSMContext):
     current_state = await state.get_state()
     if current_state != PuzzleState.solving_puzzle.state:
@@ -305,18 +454,28 @@ async def handle_hint(callback_query: CallbackQuery, state: FSMContext):
         await callback_query.answer()
         return
     
+    # Подсказки, сгенерированные вместе с головоломкой, выдаем сразу; модель нужна, только если их не хватило
+    stored_hints = data.get("hints") or []
+    if hints_used < len(stored_hints):
+        hint = stored_hints[hints_used]
+        remember_hint(user_id, hint)
+    else:
+        try:
+            hint = await generate_hint_async(user_id, puzzle_text)
+        except LLMError:
+            await callback_query.message.answer("Не удалось получить подсказку, сервис перегружен. Попробуйте позже")
+            await callback_query.answer()
+            return
+
     hints_used += 1
     await state.update_data(hints_used=hints_used)
-    
-    # Генерация подсказки (в данном случае для примера, можно дополнить логику)
-    hint = generate_hint(user_id, puzzle_text)
 
     await callback_query.message.answer(f"{hint}")
     await callback_query.answer()
 
 
 # Обработчик для кнопки "Отказаться"
-@router.callback_query(lambda c: c.data == "cancel")
+@router.callback_query(lambda c: c.data == "cancel", flags={"serialize": True})
 async def handle_cancel(callback_query: CallbackQuery, state: FSMContext):
     current_state = await state.get_state()
     if current_state != PuzzleState.solving_puzzle.state:
@@ -351,7 +510,7 @@ async def handle_feedback(message: types.Message, state: FSMContext):
     feedback = message.text
     user_id = message.from_user.id
 
-    add_log(user_id, feedback)
+    await add_log(user_id, feedback, LOG_FEEDBACK)
 
     await message.answer("Спасибо за ваш отзыв! Мы ценим ваше мнение.")
     await state.clear()
@@ -366,10 +525,12 @@ async def handle_unrecognized_message(message: types.Message):
     await message.reply(commands_text, reply_markup=keyboard)
     
 
+def morning_broadcast_name() -> str:
+    # Имя с датой позволяет продолжить рассылку после перезапуска
+    return f"morning-{datetime.date.today().isoformat()}"
+
+
 async def my_cron_task():
-    # Получаем список всех пользователей из базы данных
-    users = get_all_users()  # Эта функция должна вернуть список user_id (например, [12345, 67890])
-    
     # Сообщение, которое будет отправлено пользователям
     message_text = (
         "Доброе утро! 🌞\n"
@@ -382,23 +543,208 @@ async def my_cron_task():
         [InlineKeyboardButton(text="Получить задачу", callback_data="new_puzzle")],
     ])
     
-    # Отправляем сообщение каждому пользователю
-    for user_id in users:
-        try:
-            await bot.send_message(chat_id=user_id, text=message_text, reply_markup=keyboard)
-        except Exception as e:
-            logging.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+    # Рассылка с ограничением скорости и сохранением прогресса
+    await Broadcast(bot, morning_broadcast_name(), message_text, reply_markup=keyboard).run()
+
+
+def setup_dispatcher() -> Dispatcher:
+    """
+    Подключает middleware и обработчики к диспетчеру. Повторные вызовы ничего не делают,
+    поэтому функцию можно использовать и при запуске бота, и в нагрузочном бенчмарке.
+    """
+    if router.parent_router is None:
+        dp.message.outer_middleware(CheckRegisterMiddleware())
+        # Время работы каждого обработчика по имени
+        router.message.middleware(HandlerMetricsMiddleware())
+        router.callback_query.middleware(HandlerMetricsMiddleware())
+        # Повторные нажатия и ответы одного пользователя не запускают параллельную работу
+        busy_text = "Предыдущий запрос еще обрабатывается, подождите"
+        router.message.middleware(UserGuardMiddleware(busy_text))
+        router.callback_query.middleware(UserGuardMiddleware(busy_text))
+        dp.include_router(router)
+    return dp
+
+
+def register_gauges():
+    """
+    Регистрирует метрики текущего состояния: очереди, буферы и кэши.
+    """
+    registry.gauge("puzzles_llm_in_flight", "Запросы к модели, выполняющиеся сейчас", llm_in_flight)
+    registry.gauge("puzzles_db_pending", "Обращения к базе в очереди потока базы данных", db_pending)
+    registry.gauge("puzzles_log_queue_size", "Записи логов, ожидающие записи в базу", log_writer.queue_size)
+    registry.gauge("puzzles_context_users", "Пользователи с сохраненным контекстом",
+                   lambda: context_store.stats()["users"])
+    registry.gauge("puzzles_context_entries", "Записи контекста в памяти", lambda: context_store.stats()["entries"])
+    registry.gauge("puzzles_context_bytes", "Объем контекста в памяти, байт", lambda: context_store.stats()["bytes"])
+    registry.gauge("puzzles_pool_depth", "Готовые головоломки в пуле", lambda: puzzle_pool.stats()["depth"])
+    registry.gauge("puzzles_pool_hit_rate", "Доля головоломок, выданных из пула", lambda: puzzle_pool.stats()["hit_rate"])
+    registry.gauge("puzzles_bank_size", "Головоломки в банке", puzzle_bank.size)
+    registry.gauge("puzzles_fsm_cached", "Состояния FSM в кэше", lambda: storage.stats()["cached"])
+    registry.gauge("puzzles_fsm_dirty", "Несохраненные состояния FSM", lambda: storage.stats()["dirty"])
+    registry.gauge("puzzles_registered_users_cached", "Пользователи в кэше зарегистрированных",
+                   lambda: registered_users.stats()["size"])
+    registry.gauge("puzzles_llm_breaker_open", "Предохранитель модели разомкнут (1) или замкнут (0)",
+                   lambda: int(llm_breaker.is_open()))
+    registry.gauge("puzzles_user_actions_in_flight", "Выполняющиеся действия пользователей", user_guard.in_flight)
+    registry.gauge("puzzles_answer_checks", "Проверки ответов по результату локальной проверки",
+                   lambda: dict(answer_check_stats), ("verdict",))
 
 
 # Основная функция запуска
+async def warm_up_model():
+    # Прогреваем модель уже после начала приема апдейтов, пул пополняем, когда она готова
+    await llm_warm_up()
+    puzzle_pool.start()
+
+
+async def on_startup():
+    startup.set_accepting_updates()
+    # Ссылку храним, чтобы задачу не удалил сборщик мусора и ее можно было отменить
+    startup.warm_up_task = asyncio.create_task(warm_up_model())
+
+
 async def main():
+    startup.mark("imports")
     scheduler = AsyncIOScheduler(timezone='Europe/Moscow')
     job = scheduler.add_job(my_cron_task, 'cron', hour=10, minute=0)
+    # Периодически освобождаем контекст давно неактивных пользователей
+    scheduler.add_job(context_store.evict_idle, 'interval', minutes=10)
+    # Удаляем состояния брошенных задач
+    scheduler.add_job(storage.cleanup, 'interval', hours=1)
+    # Старые записи логов переносим в архив ночью
+    scheduler.add_job(archive_old_logs_async, 'cron', hour=4, minute=0)
+    scheduler.start()
+    setup_dispatcher()
+    register_gauges()
+    metrics_runner = None
+    if metrics_settings["enabled"]:
+        metrics_runner = await start_metrics_server(metrics_settings["host"], metrics_settings["port"])
+    with startup.phase("database"):
+        await initialize_database()
+    with startup.phase("puzzle_bank"):
+        await puzzle_bank.load_async()
+    dp.startup.register(on_startup)
+    # Если утренняя рассылка была прервана перезапуском, продолжаем ее
+    progress = await get_broadcast_progress(morning_broadcast_name())
+    if progress is not None and not progress["finished"]:
+        asyncio.create_task(my_cron_task())
+    try:
+        if bot_mode == "webhook":
+            await run_webhook(dp, bot, **webhook_settings)
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        if startup.warm_up_task is not None:
+            startup.warm_up_task.cancel()
+        await puzzle_pool.stop()
+        # Дописываем отложенные изменения состояний FSM
+        await storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        llm_shutdown()
+        db_shutdown()
+
+
+async def worker_main(index: int):
+    """
+    Worker многопроцессного режима: обрабатывает апдейты своих пользователей, полученные от фронта.
+    """
+    startup.mark("imports")
+    # Топ в памяти не видит изменений рейтинга в других процессах, поэтому таблицу лидеров читаем из базы
+    top_cache.size = 0
+    # Пул пополняет только первый worker, иначе модель генерировала бы его N раз. Головоломки пула
+    # сохраняются в общий банк, поэтому остальные worker'ы выдают их через take_unseen
+    puzzle_pool.enabled = index == 0
+    scheduler = AsyncIOScheduler(timezone='Europe/Moscow')
+    # Контекст и состояния FSM пользователей этого worker'а хранятся только в нем
+    scheduler.add_job(context_store.evict_idle, 'interval', minutes=10)
+    scheduler.add_job(storage.cleanup, 'interval', hours=1)
     scheduler.start()
-    dp.message.outer_middleware(CheckRegisterMiddleware())
-    dp.include_router(router)
-    initialize_database()
-    await dp.start_polling(bot, skip_updates=True)
+    setup_dispatcher()
+    register_gauges()
+    metrics_runner = None
+    if metrics_settings["enabled"]:
+        metrics_runner = await start_metrics_server(metrics_settings["host"], metrics_settings["port"] + 1 + index)
+    with startup.phase("puzzle_bank"):
+        await puzzle_bank.load_async()
+    # Пользователь всегда попадает в один и тот же worker и регистрируется в нем же,
+    # поэтому кэш зарегистрированных, загруженный при запуске, остается точным
+    with startup.phase("user_cache"):
+        await run_in_db_thread(registered_users.load)
+    dp.startup.register(on_startup)
+    # Фронт останавливает worker'ы сигналом SIGTERM, при этом нужно дописать состояния и логи
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await serve_worker(dp, bot, sharding_settings["host"], sharding_settings["base_port"] + index,
+                           sharding_settings["concurrency"])
+    except asyncio.CancelledError:
+        logging.info(f"Worker {index} останавливается")
+    finally:
+        if startup.warm_up_task is not None:
+            startup.warm_up_task.cancel()
+        await puzzle_pool.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await storage.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        llm_shutdown()
+        db_shutdown()
+
+
+def run_worker(index: int):
+    asyncio.run(worker_main(index))
+
+
+async def run_front():
+    """
+    Фронт многопроцессного режима: получает апдейты и распределяет их по worker'ам.
+    Сам фронт апдейты не обрабатывает, а выполняет общие задачи: утреннюю рассылку и архивацию логов.
+    """
+    startup.mark("imports")
+    with startup.phase("database"):
+        await initialize_database()
+    share_llm_limit(llm_max_in_flight, sharding_settings["workers"])
+    processes = [start_worker_process(run_worker, index) for index in range(sharding_settings["workers"])]
+    front = Front(sharding_settings["workers"], sharding_settings["host"], sharding_settings["base_port"],
+                  sharding_settings["max_pending"])
+    supervisor = None
+    metrics_runner = None
+    try:
+        with startup.phase("workers"):
+            await front.connect()
+        supervisor = asyncio.create_task(supervise(processes, front, run_worker))
+        scheduler = AsyncIOScheduler(timezone='Europe/Moscow')
+        scheduler.add_job(my_cron_task, 'cron', hour=10, minute=0)
+        scheduler.add_job(archive_old_logs_async, 'cron', hour=4, minute=0)
+        scheduler.start()
+        registry.gauge("puzzles_front_pending", "Апдейты, переданные worker'ам и еще не обработанные", front.pending)
+        if metrics_settings["enabled"]:
+            metrics_runner = await start_metrics_server(metrics_settings["host"], metrics_settings["port"])
+        progress = await get_broadcast_progress(morning_broadcast_name())
+        if progress is not None and not progress["finished"]:
+            asyncio.create_task(my_cron_task())
+
+        if bot_mode == "webhook":
+            server_settings = {key: value for key, value in webhook_settings.items()
+                               if key not in ("host", "port", "url")}
+            server = RoutingWebhookServer(front, dp, bot, **server_settings)
+            dp.startup.register(startup.set_accepting_updates)
+            await run_webhook(dp, bot, server=server, **webhook_settings)
+        else:
+            startup.set_accepting_updates()
+            await poll_updates(bot, front)
+    finally:
+        if supervisor is not None:
+            supervisor.cancel()
+        await front.close()
+        stop_worker_processes(processes, sharding_settings["stop_timeout"])
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        db_shutdown()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run_front() if sharding_settings["workers"] else main())
@@ -0,0 +1,54 @@
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import stream_edit_interval
+
+
+class MessageStreamer:
+    """
+    Постепенно обновляет сообщение бота текстом, который модель генерирует по частям.
+
+    Редактирования прореживаются (не чаще раза в interval секунд), чтобы не упереться
+    в ограничения Telegram; финальный текст показывается всегда.
+    """
+
+    def __init__(self, message: Message, prefix: str = "", interval: float = stream_edit_interval):
+        self.message = message
+        self.prefix = prefix
+        self.interval = interval
+        self._shown = message.text
+        self._last_edit = 0.0
+
+    async def _edit(self, text: str, reply_markup=None) -> bool:
+        if text == self._shown and reply_markup is None:
+            return True
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            logging.warning(f"Слишком частое редактирование сообщения, пауза {e.retry_after} с")
+            self._last_edit = time.monotonic() + e.retry_after
+            return False
+        except TelegramBadRequest as e:
+            logging.debug(f"Не удалось отредактировать сообщение: {e}")
+            return False
+        self._shown = text
+        self._last_edit = time.monotonic()
+        return True
+
+    async def update(self, text: str):
+        """
+        Показывает очередную версию текста, если с прошлого редактирования прошло достаточно времени.
+        """
+        if not text.strip() or time.monotonic() - self._last_edit < self.interval:
+            return
+        await self._edit(self.prefix + text)
+
+    async def finish(self, text: str, reply_markup=None):
+        """
+        Показывает итоговый текст. Если отредактировать сообщение не удалось, отправляет новое.
+        """
+        if not await self._edit(text, reply_markup):
+            await self.message.answer(text, reply_markup=reply_markup)
@@ -0,0 +1,252 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Счетчики и гистограммы обновляются из обработчиков, шлюза модели и потока базы данных,
+а значения gauge вычисляются в момент запроса /metrics. Внешние зависимости не нужны.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно растущий счетчик с метками.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с метками (накопительные бакеты, сумма и количество).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+    def label_values(self) -> list:
+        with self._lock:
+            return list(self._values)
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            counts, _ = self._values.get(labels, ((), 0.0))
+            return sum(counts)
+
+    def quantile(self, q: float, *labels) -> float:
+        """
+        Оценка квантиля по бакетам: линейная интерполяция внутри бакета, как histogram_quantile в Prometheus.
+
+        :param q: Квантиль от 0 до 1.
+        :return: Значение в секундах (0.0, если наблюдений нет).
+        """
+        with self._lock:
+            counts, _ = self._values.get(labels, ((), 0.0))
+            counts = list(counts)
+        rank = q * sum(counts)
+        cumulative, lower = 0, 0.0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            if count and cumulative + count >= rank:
+                # Выше последнего бакета оценить нельзя, берем его границу
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return lower
+
+
+class Gauge:
+    """
+    Текущее значение, которое вычисляется функцией в момент запроса метрик.
+
+    Функция возвращает число или словарь {значения меток: число}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, func, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.func()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in values.items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(number)}"
+
+
+class Registry:
+    """
+    Набор всех метрик процесса.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Повторная регистрация (например, при повторном импорте) возвращает существующую метрику
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, func, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, func, labelnames))
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                logging.warning(f"Не удалось вычислить метрику {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Большинство обработчиков укладывается в миллисекунды, поэтому нужны бакеты мельче стандартных
+handler_seconds = registry.histogram("puzzles_handler_seconds", "Время работы обработчиков бота", ("handler",),
+                                     buckets=(0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS)
+handler_errors = registry.counter("puzzles_handler_errors_total", "Исключения в обработчиках бота", ("handler",))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет время работы каждого обработчика по его имени.
+    Подключается как inner middleware роутера, чтобы обработчик был уже выбран.
+    """
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер, отдающий метрики по адресу /metrics.
+    Если порт занят, бот продолжает работу без метрик.
+
+    :return: AppRunner, который нужно остановить через cleanup() при завершении, или None.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logging.warning(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
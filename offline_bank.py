@@ -0,0 +1,53 @@
+import json
+import random
+
+from config import difficulty_names, offline_puzzles_file
+
+# Сложности от простой к сложной
+_LEVELS = list(difficulty_names)
+
+
+class OfflineBank:
+    """
+    Банк заранее подготовленных головоломок, который поставляется вместе с ботом.
+
+    Используется, когда модель недоступна: головоломки в нем уже содержат ответ,
+    варианты ответа и подсказки, поэтому задачу можно решить целиком без модели.
+    У каждой головоломки указана сложность, по ней начисляются очки.
+    """
+
+    def __init__(self, path: str):
+        with open(path, encoding="utf-8") as file:
+            self._puzzles = json.load(file)
+        self._random = random.Random()
+
+    def pick(self, category: str, difficulty: str, exclude: set = frozenset()) -> dict:
+        """
+        Выбирает головоломку категории и сложности, по возможности ту, которую пользователь еще не видел.
+        Если головоломок такой сложности нет, берется головоломка категории попроще.
+
+        :param category: Ключ категории из config.category_names.
+        :param difficulty: Ключ сложности из config.difficulty_names.
+        :param exclude: Тексты головоломок, которые не нужно повторять.
+        :return: Словарь с ключами puzzle, answer, accepted_answers, hints, difficulty.
+        """
+        puzzles = self.candidates(category, difficulty)
+        unseen = [puzzle for puzzle in puzzles if puzzle["puzzle"] not in exclude]
+        return dict(self._random.choice(unseen or puzzles))
+
+    def candidates(self, category: str, difficulty: str) -> list:
+        """
+        Головоломки категории нужной сложности, а если таких нет - самой сложной из более простых.
+        """
+        puzzles = self._puzzles.get(category) or self.all()
+        for level in _LEVELS[:_LEVELS.index(difficulty) + 1][::-1]:
+            matching = [puzzle for puzzle in puzzles if puzzle["difficulty"] == level]
+            if matching:
+                return matching
+        return puzzles
+
+    def all(self) -> list:
+        return [puzzle for puzzles in self._puzzles.values() for puzzle in puzzles]
+
+
+offline_bank = OfflineBank(offline_puzzles_file)
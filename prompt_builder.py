@@ -0,0 +1,65 @@
+import logging
+
+from config import prompt_settings
+from context_store import PUZZLE, HINT
+
+
+def _digest(text: str, length: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rstrip() + "…"
+
+
+def _generation_context(entries: list, topic: str = None) -> str:
+    budget = prompt_settings["context_budget"]
+    lines = []
+    # Идем от новых записей к старым, пока не закончится бюджет
+    puzzles = [entry for entry in reversed(entries) if entry.kind == PUZZLE and (topic is None or entry.topic == topic)]
+    for index, entry in enumerate(puzzles):
+        if index < prompt_settings["full_entries"]:
+            line = entry.render()
+        else:
+            line = f"Была загадка: {_digest(entry.text, prompt_settings['digest_length'])}"
+        if len(line) > budget:
+            break
+        budget -= len(line) + 1
+        lines.append(line)
+
+    if not lines:
+        return ""
+    return "Не повторяй эти головоломки:\n" + "\n".join(reversed(lines))
+
+
+def _hint_context(entries: list) -> str:
+    # Для подсказки важны только подсказки, уже выданные к текущей головоломке
+    hints = []
+    for entry in reversed(entries):
+        if entry.kind == PUZZLE:
+            break
+        if entry.kind == HINT:
+            hints.append(entry.render())
+
+    text = "\n".join(reversed(hints))
+    return text[-prompt_settings["context_budget"]:]
+
+
+def build_context(entries: list, call_type: str, topic: str = None) -> str:
+    """
+    Собирает контекст для запроса к модели в пределах бюджета из config.prompt_settings.
+
+    :param entries: Записи контекста пользователя от старых к новым.
+    :param call_type: Тип запроса: generate, hint или check.
+    :param topic: Тема головоломки для запроса generate (None - все темы).
+    :return: Текст контекста, возможно пустой.
+    """
+    if call_type == "generate":
+        return _generation_context(entries, topic)
+    if call_type == "hint":
+        return _hint_context(entries)
+    # Для проверки ответа достаточно самой головоломки, она и так есть в запросе
+    return ""
+
+
+def log_prompt_size(call_type: str, prompt: str, system: str = ""):
+    logging.info(f"Запрос к модели ({call_type}): {len(prompt) + len(system)} символов")
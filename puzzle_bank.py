@@ -0,0 +1,260 @@
+"""
+Постоянный банк сгенерированных головоломок в SQLite.
+
+Каждая головоломка сохраняется вместе с ответом, подсказками и отпечатками:
+точным (хэш нормализованного текста) и MinHash-сигнатурой по символьным шинглам.
+По сигнатурам строится LSH-индекс в памяти, поэтому почти одинаковые головоломки
+находятся без перебора всего банка. Таблица seen_puzzles хранит, какие головоломки
+видел каждый пользователь, чтобы выдавать из банка только новые для него.
+
+Все функции работают с get_connection() и вызываются в потоке базы данных.
+"""
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import time
+import zlib
+from array import array
+from collections import defaultdict
+
+from config import puzzle_bank_settings
+from db_async import run_in_db_thread
+from db_connection import get_connection
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+# Фиксированное зерно: сигнатуры, сохраненные в базе, должны совпадать между перезапусками
+_seed = random.Random(20240601)
+_PERMUTATIONS = [(_seed.randrange(1, _PRIME), _seed.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def fingerprint(text: str) -> str:
+    """
+    Точный отпечаток: совпадает у текстов, отличающихся только регистром, пунктуацией и пробелами.
+    """
+    return hashlib.sha1(normalize_text(text).encode()).hexdigest()
+
+
+def shingles(text: str) -> set:
+    text = normalize_text(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())}
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE].encode()) for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> array:
+    """
+    MinHash-сигнатура текста: доля совпадающих позиций у двух сигнатур оценивает
+    коэффициент Жаккара их множеств шинглов.
+    """
+    values = shingles(text)
+    return array("I", (min(((a * x + b) % _PRIME) & _MASK for x in values) for a, b in _PERMUTATIONS))
+
+
+def similarity(first: array, second: array) -> float:
+    return sum(x == y for x, y in zip(first, second)) / NUM_PERMUTATIONS
+
+
+def _bands(signature: array):
+    for band in range(BANDS):
+        yield band, tuple(signature[band * ROWS:(band + 1) * ROWS])
+
+
+class PuzzleBank:
+    """
+    Банк головоломок с поиском почти одинаковых через LSH по MinHash-сигнатурам.
+
+    При BANDS=16 и ROWS=4 кандидатами становятся пары с похожестью примерно от 0.5,
+    а дубликатом считается кандидат с оценкой похожести не ниже threshold.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._signatures = {}
+        self._buckets = defaultdict(list)
+        self._loaded = False
+        self._last_id = 0
+        self.duplicates = 0
+
+    def load(self):
+        """
+        Строит LSH-индекс по сигнатурам, сохраненным в базе.
+        """
+        self._signatures.clear()
+        self._buckets.clear()
+        self._last_id = 0
+        self._sync()
+        self._loaded = True
+
+    def _sync(self):
+        # Дочитываем головоломки, добавленные после последней синхронизации (в том числе другими процессами)
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT id, signature FROM puzzles WHERE id > ? ORDER BY id', (self._last_id,))
+        for puzzle_id, blob in cursor:
+            signature = array("I")
+            signature.frombytes(blob)
+            self._index(puzzle_id, signature)
+
+    def _index(self, puzzle_id: int, signature: array):
+        self._signatures[puzzle_id] = signature
+        self._last_id = max(self._last_id, puzzle_id)
+        for key in _bands(signature):
+            self._buckets[key].append(puzzle_id)
+
+    def find_similar(self, signature: array):
+        """
+        Ищет в банке почти такую же головоломку.
+
+        :return: (id, похожесть) самой похожей головоломки или None.
+        """
+        candidates = {puzzle_id for key in _bands(signature) for puzzle_id in self._buckets.get(key, ())}
+        best = None
+        for puzzle_id in candidates:
+            score = similarity(signature, self._signatures[puzzle_id])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (puzzle_id, score)
+        return best
+
+    def add(self, category: str, difficulty: str, puzzle: dict):
+        """
+        Сохраняет головоломку, если в банке еще нет такой же или почти такой же.
+
+        :param category: Ключ категории из config.category_names.
+        :param difficulty: Ключ сложности из config.difficulty_names.
+        :param puzzle: Словарь с ключами puzzle, answer, accepted_answers, hints.
+        :return: (id головоломки в банке, True если она новая).
+        """
+        if not self._loaded:
+            self.load()
+        else:
+            self._sync()
+        text = puzzle["puzzle"]
+        exact = fingerprint(text)
+        connection = get_connection()
+        cursor = connection.cursor()
+        cursor.execute('SELECT id FROM puzzles WHERE fingerprint = ?', (exact,))
+        row = cursor.fetchone()
+        if row is not None:
+            self.duplicates += 1
+            return row[0], False
+
+        signature = minhash(text)
+        similar = self.find_similar(signature)
+        if similar is not None:
+            self.duplicates += 1
+            return similar[0], False
+
+        try:
+            with connection:
+                cursor.execute('''
+                    INSERT INTO puzzles (category, difficulty, puzzle, answer, accepted_answers, hints,
+                                         fingerprint, signature, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (category, difficulty, text, puzzle["answer"],
+                      json.dumps(puzzle.get("accepted_answers", []), ensure_ascii=False),
+                      json.dumps(puzzle.get("hints", []), ensure_ascii=False),
+                      exact, signature.tobytes(), time.time()))
+                puzzle_id = cursor.lastrowid
+        except sqlite3.IntegrityError:
+            # Такую же головоломку только что сохранил другой процесс
+            cursor.execute('SELECT id FROM puzzles WHERE fingerprint = ?', (exact,))
+            self.duplicates += 1
+            return cursor.fetchone()[0], False
+        self._index(puzzle_id, signature)
+        return puzzle_id, True
+
+    def take_unseen(self, user_id: int, category: str, difficulty: str):
+        """
+        Случайная головоломка из банка, которую пользователь еще не видел.
+
+        Вместо сортировки всей категории выбирается случайный id, и от него по индексу
+        (category, difficulty, id) берется первая не виденная головоломка; если до конца
+        банка таких нет, поиск продолжается с начала.
+
+        :return: Словарь головоломки с ключом id или None, если таких нет.
+        """
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT MAX(id) FROM puzzles')
+        max_id = cursor.fetchone()[0]
+        if max_id is None:
+            return None
+        start = random.randint(1, max_id)
+        row = None
+        for condition in ("id >= ?", "id < ?"):
+            cursor.execute(f'''
+                SELECT id, puzzle, answer, accepted_answers, hints FROM puzzles AS p
+                WHERE category = ? AND difficulty = ? AND {condition}
+                  AND NOT EXISTS (SELECT 1 FROM seen_puzzles AS s WHERE s.user_id = ? AND s.puzzle_id = p.id)
+                ORDER BY id LIMIT 1
+            ''', (category, difficulty, start, user_id))
+            row = cursor.fetchone()
+            if row is not None:
+                break
+        if row is None:
+            return None
+        return {"id": row[0], "puzzle": row[1], "answer": row[2],
+                "accepted_answers": json.loads(row[3]), "hints": json.loads(row[4])}
+
+    def take_unseen_from(self, user_id: int, category: str, puzzles: list):
+        """
+        Первая из переданных головоломок, которую пользователь еще не видел. Головоломки сохраняются
+        в банк, поэтому просмотренные учитываются так же, как сгенерированные.
+
+        :param puzzles: Словари головоломок с ключами puzzle, answer, accepted_answers, hints, difficulty.
+        :return: Копия головоломки с ключом id или None, если пользователь видел все.
+        """
+        for puzzle in puzzles:
+            puzzle_id, _ = self.add(category, puzzle["difficulty"], puzzle)
+            if not self.is_seen(user_id, puzzle_id):
+                return dict(puzzle, id=puzzle_id)
+        return None
+
+    def is_seen(self, user_id: int, puzzle_id: int) -> bool:
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM seen_puzzles WHERE user_id = ? AND puzzle_id = ?)',
+                       (user_id, puzzle_id))
+        return bool(cursor.fetchone()[0])
+
+    def mark_seen(self, user_id: int, puzzle_id: int):
+        connection = get_connection()
+        with connection:
+            connection.execute('INSERT OR IGNORE INTO seen_puzzles (user_id, puzzle_id, seen_at) VALUES (?, ?, ?)',
+                               (user_id, puzzle_id, time.time()))
+
+    def size(self) -> int:
+        return len(self._signatures)
+
+    # Асинхронные обертки: выполняются в потоке базы данных
+    async def load_async(self):
+        return await run_in_db_thread(self.load)
+
+    async def add_async(self, category: str, difficulty: str, puzzle: dict):
+        return await run_in_db_thread(self.add, category, difficulty, puzzle)
+
+    async def take_unseen_async(self, user_id: int, category: str, difficulty: str):
+        return await run_in_db_thread(self.take_unseen, user_id, category, difficulty)
+
+    async def take_unseen_from_async(self, user_id: int, category: str, puzzles: list):
+        return await run_in_db_thread(self.take_unseen_from, user_id, category, puzzles)
+
+    async def is_seen_async(self, user_id: int, puzzle_id: int):
+        return await run_in_db_thread(self.is_seen, user_id, puzzle_id)
+
+    async def mark_seen_async(self, user_id: int, puzzle_id: int):
+        return await run_in_db_thread(self.mark_seen, user_id, puzzle_id)
+
+
+puzzle_bank = PuzzleBank(**puzzle_bank_settings)
@@ -1,62 +1,206 @@
-from gradio_client import Client
+import json
+import logging
+import re
 
-client = Client("Qwen/Qwen2.5-72B-Instruct")
+from config import context_store_settings, llm_backend, llm_backend_settings
+from context_store import ContextStore, PUZZLE, HINT
+from llm_backends import LLMBackendError, create_backend
+from prompt_builder import build_context, log_prompt_size
 
-# Глобальный словарь контекстных буферов
-context_buffers = {}
+# Бэкенд модели выбирается в config.llm_backend; сеть не нужна до первого запроса
+backend = create_backend(llm_backend, **llm_backend_settings[llm_backend])
 
+# Хранилище контекста пользователей с ограничением по памяти
+context_store = ContextStore(**context_store_settings)
 
-def update_user_context(user_id: int, new_entry: str, max_size: int = 500):
-    global context_buffers
 
-    if user_id not in context_buffers:
-        context_buffers[user_id] = []
-
-    context_buffers[user_id].append(new_entry)
-
-    if len(context_buffers[user_id]) > max_size:
-        context_buffers[user_id].pop(0)
+def update_user_context(user_id: int, new_entry: str, kind: str = PUZZLE, topic: str = None, difficulty: str = None):
+    context_store.add(user_id, kind, new_entry, topic, difficulty)
 
 
 def get_user_context(user_id: int) -> str:
-    global context_buffers
-    return "\n".join(context_buffers.get(user_id, []))
+    return "\n".join(entry.render() for entry in context_store.entries(user_id))
 
 
 def clear_user_context(user_id: int):
-    global context_buffers
-    if user_id in context_buffers:
-        del context_buffers[user_id]
+    context_store.clear(user_id)
 
 
-def generate_puzzle_with_user_context(user_id: int, topic: str, difficulty: str):
-    context = get_user_context(user_id)
+def get_prompt_context(user_id: int, call_type: str, topic: str = None) -> str:
+    """
+    Контекст пользователя, отобранный и урезанный под конкретный тип запроса.
+    """
+    return build_context(context_store.entries(user_id), call_type, topic)
+
+
+def _context_line(context: str) -> str:
+    return f"Контекст: {context}\n" if context else ""
+
+
+PUZZLE_SYSTEM_PROMPT = (
+    "Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
+    "markdown в своих ответах. В своем ответе укажи только текст головоломки и ответ с пояснением, "
+    "разделенные одним символом $, так, чтобы я смог сделать split текст по этому символу "
+    "в список и там было 2 значения"
+)
+
+# Генерация одним запросом: головоломка, ответ, варианты ответа и подсказки
+STRUCTURED_PUZZLE_SYSTEM_PROMPT = (
+    "Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
+    "markdown в своих ответах. Ответь строго одним JSON-объектом без какого-либо текста вокруг него, "
+    "с полями в таком порядке: \"puzzle\" - текст головоломки, \"answer\" - правильный ответ с кратким "
+    "пояснением, \"accepted_answers\" - список коротких вариантов правильного ответа, которые тоже нужно "
+    "засчитать (число, слово, синонимы), \"hints\" - список из трех подсказок, от самой общей до самой точной, "
+    "ни одна из которых не раскрывает ответ полностью"
+)
+
+HINTS_PER_PUZZLE = 3
 
+CHECK_SYSTEM_PROMPT = (
+    "Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
+    "markdown в своих ответах. Если ответ верный, помимо текста поставь знак $ в самое начало своего ответа."
+    "Учитывай, что твой ответ будет напрямую отправлен пользователю, поэтому обращайся лично к нему"
+)
+
+
+def _puzzle_prompt(topic: str, difficulty: str, context: str) -> str:
     prompt = (
         f"Создай уникальную головоломку типа '{topic}' "
         f"с уровнем сложности '{difficulty}'.\n\n"
-        f"Контекст: {context}\n"
-        f"Укажи текст задачи и правильный ответ с кратким пояснением."
+        f"{_context_line(context)}"
+        f"Укажи текст задачи, правильный ответ с кратким пояснением, варианты ответа и три подсказки."
     )
+    log_prompt_size("generate", prompt, STRUCTURED_PUZZLE_SYSTEM_PROMPT)
+    return prompt
 
-    response = client.predict(
-        prompt,
-        api_name="/model_chat",
-        system="Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
-               "markdown в своих ответах. В своем ответе укажи только текст головоломки и ответ с пояснением, "
-               "разделенные одним символом $, так, чтобы я смог сделать split текст по этому символу "
-               "в список и там было 2 значения")
-    puzzle_data = response[1][0][1].split("$")
-    puzzle_text = puzzle_data[0]
-    correct_answer = puzzle_data[1] if len(puzzle_data) > 1 else "Ответ не найден."
-    update_user_context(user_id, f"Новая загадка, тема: {topic}, Сложность: {difficulty}, Задача: {puzzle_text}")
+
+def _parse_puzzle(text: str):
+    """
+    Разбирает ответ в старом формате "головоломка $ ответ".
+    Все, что после первого $, считается ответом (модель может использовать $ и в пояснении).
+    """
+    puzzle_text, _, correct_answer = text.partition("$")
 
     return {
         "puzzle": puzzle_text.strip(),
-        "answer": correct_answer.strip(),
+        "answer": correct_answer.strip() or "Ответ не найден.",
+        "accepted_answers": [],
+        "hints": [],
     }
 
 
+def _string_list(value) -> list:
+    if not isinstance(value, list):
+        return []
+    return [item.strip() for item in (str(item) for item in value if isinstance(item, (str, int, float)))
+            if item.strip()]
+
+
+def _parse_structured_puzzle(text: str):
+    """
+    Разбирает JSON-ответ модели с головоломкой, ответом, вариантами ответа и подсказками.
+
+    Если модель не соблюла формат, пробует разобрать ответ как "головоломка $ ответ"
+    (тогда подсказок нет и их придется генерировать отдельно).
+
+    :param text: Текст ответа модели.
+    :return: Словарь с ключами puzzle, answer, accepted_answers, hints.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            payload = json.loads(text[start:end + 1])
+        except ValueError as e:
+            logging.warning(f"Модель вернула некорректный JSON головоломки: {e}")
+        else:
+            if isinstance(payload, dict):
+                puzzle_text = str(payload.get("puzzle") or "").strip()
+                answer = str(payload.get("answer") or "").strip()
+                if puzzle_text and answer:
+                    return {
+                        "puzzle": puzzle_text,
+                        "answer": answer,
+                        "accepted_answers": _string_list(payload.get("accepted_answers")),
+                        "hints": _string_list(payload.get("hints"))[:HINTS_PER_PUZZLE],
+                    }
+            logging.warning("В JSON головоломки нет текста задачи или ответа")
+    # Из оборванного JSON разбор по $ ничего осмысленного не даст, достаем хотя бы текст задачи
+    return _parse_puzzle(_partial_puzzle_text(text) if _looks_like_json(text) else text)
+
+
+def _looks_like_json(text: str) -> bool:
+    return text.lstrip().startswith(("{", "`"))
+
+
+_PUZZLE_FIELD = re.compile(r'"puzzle"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+
+def _partial_puzzle_text(text: str) -> str:
+    """
+    Достает текст головоломки из недописанного JSON-ответа, чтобы показывать его во время генерации.
+    """
+    if not _looks_like_json(text):
+        # Модель ответила не в JSON, показываем часть до $
+        return text.split("$")[0].strip()
+
+    match = _PUZZLE_FIELD.search(text)
+    if match is None:
+        return ""
+    value = match.group(1)
+    # Недописанная escape-последовательность в конце куска
+    value = re.sub(r"\\(u[0-9a-fA-F]{0,3})?$", "", value)
+    try:
+        return json.loads(f'"{value}"').strip()
+    except ValueError:
+        return value.strip()
+
+
+def _stream_chat(prompt: str, system: str = None):
+    """
+    Отправляет запрос модели и по мере генерации отдает накопленный текст ответа.
+    """
+    return backend.stream(prompt, system)
+
+
+def _request_puzzle(topic: str, difficulty: str, context: str):
+    response = backend.complete(_puzzle_prompt(topic, difficulty, context), STRUCTURED_PUZZLE_SYSTEM_PROMPT)
+    return _parse_structured_puzzle(response)
+
+
+def generate_puzzle_with_user_context(user_id: int, topic: str, difficulty: str):
+    context = get_prompt_context(user_id, "generate", topic)
+
+    puzzle = _request_puzzle(topic, difficulty, context)
+    remember_puzzle(user_id, topic, difficulty, puzzle["puzzle"])
+
+    return puzzle
+
+
+def generate_puzzle(topic: str, difficulty: str):
+    """
+    Генерирует головоломку без привязки к пользователю (используется для заполнения пула).
+
+    :param topic: Название категории.
+    :param difficulty: Название сложности.
+    :return: Словарь с текстом головоломки, ответом, вариантами ответа и подсказками.
+    """
+    return _request_puzzle(topic, difficulty, "")
+
+
+def remember_puzzle(user_id: int, topic: str, difficulty: str, puzzle_text: str):
+    """
+    Добавляет выданную пользователю головоломку в его контекст, чтобы модель не повторялась.
+    """
+    update_user_context(user_id, puzzle_text, PUZZLE, topic, difficulty)
+
+
+def remember_hint(user_id: int, hint: str):
+    """
+    Добавляет выданную подсказку (в том числе готовую, сгенерированную вместе с головоломкой) в контекст.
+    """
+    update_user_context(user_id, hint, HINT)
+
+
 def generate_hint(user_id: int, puzzle_text: str):
     """
     Генерирует подсказки для головоломки.
@@ -65,23 +209,42 @@ def generate_hint(user_id: int, puzzle_text: str):
     :param puzzle_text: Текст головоломки.
     :return: Список подсказок.
     """
-    context = get_user_context(user_id)
+    context = get_prompt_context(user_id, "hint")
 
     prompt = (
         f"Дай одну короткую подсказок для следующей головоломки:\n"
         f"Головоломка: {puzzle_text}\n"
-        f"Контекст: {context}"
+        f"{_context_line(context)}"
     )
+    log_prompt_size("hint", prompt)
+
+    hint = backend.complete(prompt)
+    remember_hint(user_id, hint)
 
-    response = client.predict(
-        prompt,
-        api_name="/model_chat"
+    return hint
+
+
+def _check_prompt(user_id: int, puzzle_text: str, user_answer: str) -> str:
+    context = get_prompt_context(user_id, "check")
+
+    prompt = (
+        f"Проверь ответ пользователя на следующую головоломку:\n"
+        f"Головоломка: {puzzle_text}\n"
+        f"Ответ пользователя: {user_answer}\n"
+        f"{_context_line(context)}"
+        f"Сообщи, является ли ответ верным, и объясни почему. Если ответ неверный объясни почему он неверный, но не пиши правильный ответ."
     )
+    log_prompt_size("check", prompt)
+    return prompt
 
-    hint = response[1][0][1]
-    update_user_context(user_id, f"Использована подсказка: {hint}")
 
-    return hint
+def _parse_check(user_id: int, ans: str):
+    if not ans:
+        raise LLMBackendError("Модель вернула пустой ответ на проверку")
+    if ans.startswith("$"):
+        clear_user_context(user_id)
+        return [1, ans[1:]]
+    return [0, ans]
 
 
 def check_answer(user_id: int, puzzle_text: str, user_answer: str):
@@ -93,54 +256,57 @@ def check_answer(user_id: int, puzzle_text: str, user_answer: str):
     :param user_answer: Ответ пользователя.
     :return: Результат проверки.
     """
-    context = get_user_context(user_id)
+    response = backend.complete(_check_prompt(user_id, puzzle_text, user_answer), CHECK_SYSTEM_PROMPT)
 
-    prompt = (
-        f"Проверь ответ пользователя на следующую головоломку:\n"
-        f"Головоломка: {puzzle_text}\n"
-        f"Ответ пользователя: {user_answer}\n"
-        f"Контекст: {context}\n"
-        f"Сообщи, является ли ответ верным, и объясни почему. Если ответ неверный объясни почему он неверный, но не пиши правильный ответ."
-    )
+    return _parse_check(user_id, response)
 
-    response = client.predict(
-        prompt,
-        api_name="/model_chat",
-        system="Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
-               "markdown в своих ответах. Если ответ верный, помимо текста поставь знак $ в самое начало своего ответа."
-               "Учитывай, что твой ответ будет напрямую отправлен пользователю, поэтому обращайся лично к нему"
-    )
 
-    ans = response[1][0][1]
-    if ans[0] == "$":
-        clear_user_context(user_id)
-        return [1, ans[1:]]
-    return [0, ans]
+def stream_puzzle_with_user_context(user_id: int, topic: str, difficulty: str):
+    """
+    Потоковая версия generate_puzzle_with_user_context.
+
+    Отдает текст головоломки по мере генерации (ответ и подсказки не показываются),
+    а итоговый словарь с головоломкой, ответом и подсказками возвращает как результат генератора.
+    """
+    prompt = _puzzle_prompt(topic, difficulty, get_prompt_context(user_id, "generate", topic))
+
+    text = ""
+    for text in _stream_chat(prompt, STRUCTURED_PUZZLE_SYSTEM_PROMPT):
+        yield _partial_puzzle_text(text)
+
+    puzzle = _parse_structured_puzzle(text)
+    remember_puzzle(user_id, topic, difficulty, puzzle["puzzle"])
+    return puzzle
+
+
+def stream_check_answer(user_id: int, puzzle_text: str, user_answer: str):
+    """
+    Потоковая версия check_answer.
+
+    Отдает комментарий модели по мере генерации (без служебного $),
+    а результат проверки [верно, комментарий] возвращает как результат генератора.
+    """
+    prompt = _check_prompt(user_id, puzzle_text, user_answer)
+
+    text = ""
+    for text in _stream_chat(prompt, CHECK_SYSTEM_PROMPT):
+        yield text.lstrip("$")
+
+    return _parse_check(user_id, text)
 
 
 def generate_puzzle_with_user_info(user_id: int, user_info: str):
-    context = get_user_context(user_id)
+    context = get_prompt_context(user_id, "generate")
 
     prompt = (
         f"Создай уникальную головоломку ндля такого пользователя '{user_info}' "
         f"с уровнем сложности средний.\n\n"
-        f"Контекст: {context}\n"
+        f"{_context_line(context)}"
         f"Укажи текст задачи и правильный ответ с кратким пояснением."
     )
+    log_prompt_size("generate", prompt)
 
-    response = client.predict(
-        prompt,
-        api_name="/model_chat",
-        system="Вы являетесь ассистентом, который помогает создавать и решать головоломки. Вы не должны использовать "
-               "markdown в своих ответах. В своем ответе укажи только текст головоломки и ответ с пояснением, "
-               "разделенные одним символом $, так, чтобы я смог сделать split текст по этому символу "
-               "в список и там было 2 значения")
-    puzzle_data = response[1][0][1].split("$")
-    puzzle_text = puzzle_data[0]
-    correct_answer = puzzle_data[1] if len(puzzle_data) > 1 else "Ответ не найден."
-    update_user_context(user_id, f"Новая загадка: {puzzle_text}")
+    puzzle = _parse_puzzle(backend.complete(prompt, PUZZLE_SYSTEM_PROMPT))
+    update_user_context(user_id, puzzle["puzzle"], PUZZLE)
 
-    return {
-        "puzzle": puzzle_text.strip(),
-        "answer": correct_answer.strip(),
-    }
+    return puzzle
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from config import category_names, difficulty_names, puzzle_pool_settings
+from llm_gateway import generate_fresh_puzzle_async, LLMError
+from puzzle_bank import puzzle_bank
+
+
+class PuzzlePool:
+    """
+    Запас заранее сгенерированных головоломок для каждой пары (категория, сложность).
+
+    Фоновая задача поддерживает глубину каждого пула на уровне, который зависит от
+    недавнего спроса, и выбрасывает устаревшие головоломки.
+    """
+
+    def __init__(self, min_depth: int, max_depth: int, ttl: float, refill_interval: float,
+                 demand_window: float, refill_concurrency: int):
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.refill_interval = refill_interval
+        self.demand_window = demand_window
+        self.refill_concurrency = refill_concurrency
+
+        keys = [(category, difficulty) for category in category_names for difficulty in difficulty_names]
+        # Каждая запись пула - пара (время генерации, словарь головоломки)
+        self._pools = {key: deque() for key in keys}
+        # Время последних запросов, по нему оценивается спрос
+        self._demand = {key: deque() for key in keys}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.duplicates = 0
+        # Выключенный пул не пополняется и ничего не выдает (в многопроцессном режиме пул есть только у одного worker'а)
+        self.enabled = True
+        self._task = None
+
+    def take(self, category: str, difficulty: str):
+        """
+        Достает свежую головоломку из пула.
+
+        :param category: Ключ категории из config.category_names.
+        :param difficulty: Ключ сложности из config.difficulty_names.
+        :return: Словарь с головоломкой и ответом или None, если пул пуст.
+        """
+        if not self.enabled:
+            return None
+        key = (category, difficulty)
+        now = time.monotonic()
+        self._demand[key].append(now)
+
+        pool = self._pools[key]
+        while pool:
+            created_at, puzzle = pool.popleft()
+            if now - created_at <= self.ttl:
+                self.hits += 1
+                return puzzle
+            self.expired += 1
+
+        self.misses += 1
+        return None
+
+    def target_depth(self, key) -> int:
+        """
+        Желаемая глубина пула: сколько головоломок спросят за два цикла пополнения.
+        """
+        demand = self._demand[key]
+        border = time.monotonic() - self.demand_window
+        while demand and demand[0] < border:
+            demand.popleft()
+
+        expected = len(demand) / self.demand_window * self.refill_interval * 2
+        return max(self.min_depth, min(self.max_depth, math.ceil(expected)))
+
+    def expire(self):
+        """
+        Удаляет устаревшие головоломки из всех пулов.
+        """
+        border = time.monotonic() - self.ttl
+        for pool in self._pools.values():
+            while pool and pool[0][0] < border:
+                pool.popleft()
+                self.expired += 1
+
+    async def _fill(self, key, semaphore: asyncio.Semaphore):
+        category, difficulty = key
+        async with semaphore:
+            try:
+                puzzle = await generate_fresh_puzzle_async(category_names[category], difficulty_names[difficulty])
+            except LLMError:
+                # Модель не ответила или недоступна, попробуем в следующем цикле
+                return
+            except Exception as e:
+                logging.error(f"Не удалось пополнить пул {key}: {e}")
+                return
+        # Каждая сгенерированная головоломка попадает в банк; повторы уже известных в пул не кладем
+        puzzle_id, is_new = await puzzle_bank.add_async(category, difficulty, puzzle)
+        if not is_new:
+            self.duplicates += 1
+            return
+        puzzle["id"] = puzzle_id
+        self._pools[key].append((time.monotonic(), puzzle))
+
+    async def refill_once(self):
+        """
+        Один проход пополнения: догенерирует недостающие головоломки во всех пулах.
+        """
+        self.expire()
+        semaphore = asyncio.Semaphore(self.refill_concurrency)
+        jobs = []
+        for key, pool in self._pools.items():
+            missing = self.target_depth(key) - len(pool)
+            jobs.extend(self._fill(key, semaphore) for _ in range(missing))
+        if jobs:
+            await asyncio.gather(*jobs)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refill_once()
+            except Exception as e:
+                logging.error(f"Ошибка при пополнении пула головоломок: {e}")
+            logging.info(f"Пул головоломок: {self.stats()}")
+            await asyncio.sleep(self.refill_interval)
+
+    def start(self):
+        """
+        Запускает фоновое пополнение пула в текущем event loop.
+        """
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+            "expired": self.expired,
+            "duplicates": self.duplicates,
+            "depth": sum(len(pool) for pool in self._pools.values()),
+        }
+
+
+puzzle_pool = PuzzlePool(**puzzle_pool_settings)
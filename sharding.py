@@ -0,0 +1,381 @@
+"""
+Многопроцессный режим: апдейты распределяются по рабочим процессам (worker) по пользователю.
+
+Фронт получает апдейты (polling или webhook) и по согласованному хэшированию ID пользователя
+выбирает worker. Все апдейты одного пользователя всегда попадают в один и тот же worker и
+передаются ему по одному соединению в порядке получения, поэтому порядок действий пользователя,
+его состояние FSM, контекст модели и кэши остаются в одном процессе. При изменении числа
+worker'ов согласованное хэширование переносит только часть пользователей (1/N при добавлении N-го).
+
+Протокол между фронтом и worker'ом - JSON по строке на сообщение через localhost TCP:
+фронт отправляет {"id": номер, "update": апдейт}, worker отвечает {"id": номер, "ok": true/false}
+после обработки апдейта.
+
+Общие данные worker'ы хранят в одной базе SQLite: WAL и busy_timeout из db_connection.py
+позволяют нескольким процессам читать параллельно и писать по очереди.
+"""
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from metrics import registry
+from webhook import WebhookServer
+
+routed_updates = registry.counter("puzzles_routed_updates_total", "Апдейты, переданные worker'ам", ("worker",))
+failed_updates = registry.counter("puzzles_routed_updates_failed_total",
+                                  "Апдейты, которые worker не смог обработать или не получил", ("worker",))
+
+# Максимальная длина строки протокола: апдейты Telegram намного меньше
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Согласованное хэширование Lamping-Veach (jump consistent hash): ключи распределяются
+    по корзинам 0..buckets-1 равномерно, а при добавлении корзины переезжает только 1/(buckets+1) ключей.
+    """
+    bucket, candidate = -1, 0
+    key &= 0xFFFFFFFFFFFFFFFF
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def update_user_id(update: dict) -> int:
+    """
+    ID пользователя, от которого пришел апдейт (или чата, если пользователя нет).
+
+    :param update: Апдейт в формате Bot API.
+    :return: ID пользователя или 0 для апдейтов без пользователя и чата.
+    """
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+class WorkerLink:
+    """
+    Соединение фронта с одним worker'ом. Апдейты отправляются по порядку, ответы о результате
+    обработки приходят по мере готовности.
+    """
+
+    def __init__(self, index: int, host: str, port: int, max_pending: int):
+        self.index = index
+        self.host = host
+        self.port = port
+        self._pending = asyncio.Semaphore(max_pending)
+        self._futures = {}
+        self._next_id = 0
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+
+    async def connect(self, timeout: float):
+        """
+        Подключается к worker'у, дожидаясь, пока он начнет принимать соединения.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=_LINE_LIMIT)
+                break
+            except OSError:
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        self._read_task = asyncio.create_task(self._read_results())
+        logging.info(f"Фронт подключен к worker {self.index} ({self.host}:{self.port})")
+
+    async def _read_results(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                result = json.loads(line)
+                future = self._futures.pop(result["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(result["ok"])
+        finally:
+            # Соединение потеряно: апдейты в пути считаем необработанными
+            error = ConnectionError(f"Потеряно соединение с worker {self.index}")
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._futures.clear()
+            self._writer = None
+
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def send(self, update: dict) -> asyncio.Future:
+        """
+        Отправляет апдейт worker'у. Ждет, только если у worker'а слишком много необработанных апдейтов.
+
+        :return: Future, который завершится True/False после обработки апдейта.
+        """
+        await self._pending.acquire()
+        if self._writer is None:
+            self._pending.release()
+            raise ConnectionError(f"Нет соединения с worker {self.index}")
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures[self._next_id] = future
+        self._writer.write(json.dumps({"id": self._next_id, "update": update}, ensure_ascii=False).encode() + b"\n")
+        await self._writer.drain()
+        return future
+
+    def pending(self) -> int:
+        return len(self._futures)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        if self._read_task is not None:
+            await self._read_task
+
+
+class Front:
+    """
+    Фронт: распределяет апдейты по worker'ам согласованным хэшированием ID пользователя.
+    """
+
+    def __init__(self, workers: int, host: str, base_port: int, max_pending: int):
+        self.links = [WorkerLink(index, host, base_port + index, max_pending) for index in range(workers)]
+
+    async def connect(self, timeout: float = 60):
+        await asyncio.gather(*(link.connect(timeout) for link in self.links))
+
+    def worker_for(self, user_id: int) -> int:
+        return jump_hash(user_id, len(self.links))
+
+    def link_for(self, update: dict) -> WorkerLink:
+        return self.links[self.worker_for(update_user_id(update))]
+
+    async def route(self, update: dict) -> asyncio.Future:
+        """
+        Передает апдейт worker'у его пользователя.
+
+        :return: Future с результатом обработки (True - обработан без ошибок).
+        """
+        link = self.link_for(update)
+        try:
+            future = await link.send(update)
+        except ConnectionError as e:
+            failed_updates.inc(link.index)
+            logging.error(f"Апдейт {update.get('update_id')} не передан: {e}")
+            raise
+        routed_updates.inc(link.index)
+        # Ошибки обработки только считаем: фронту не нужно ждать каждый апдейт
+        future.add_done_callback(lambda done: self._on_result(link, update, done))
+        return future
+
+    def _on_result(self, link: WorkerLink, update: dict, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None or not future.result():
+            failed_updates.inc(link.index)
+            if not future.cancelled() and future.exception() is not None:
+                logging.error(f"Апдейт {update.get('update_id')} не обработан: {future.exception()}")
+
+    def pending(self) -> int:
+        return sum(link.pending() for link in self.links)
+
+    async def close(self):
+        await asyncio.gather(*(link.close() for link in self.links))
+
+
+async def poll_updates(bot: Bot, front: Front, timeout: int = 30, skip_updates: bool = True):
+    """
+    Получает апдейты long polling'ом и передает их worker'ам. Работает до отмены.
+    """
+    if skip_updates:
+        await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout)
+        except Exception as e:
+            logging.warning(f"Не удалось получить апдейты: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            try:
+                await front.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            except ConnectionError:
+                # Worker перезапускается: не подтверждаем апдейт Telegram и запросим его снова,
+                # когда supervise переподключит worker
+                await asyncio.sleep(1)
+                break
+            offset = update.update_id + 1
+
+
+class RoutingWebhookServer(WebhookServer):
+    """
+    Webhook-сервер фронта: принятые апдейты не обрабатываются на месте, а передаются worker'ам.
+    Ограничения на число апдейтов в обработке и ожидание при остановке работают как обычно.
+    """
+
+    def __init__(self, front: Front, dp: Dispatcher, bot: Bot, **settings):
+        super().__init__(dp, bot, **settings)
+        self.front = front
+
+    async def _process(self, update: Update):
+        try:
+            async with self._processing:
+                if not await (await self.front.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))):
+                    self.failed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Апдейт {update.update_id} не обработан: {e}")
+        finally:
+            self._pending.release()
+
+
+async def serve_worker(dp: Dispatcher, bot: Bot, host: str, port: int, concurrency: int):
+    """
+    Принимает апдейты от фронта и обрабатывает их диспетчером. Работает до отмены.
+
+    Апдейты одного пользователя обрабатываются строго по очереди в порядке получения,
+    апдейты разных пользователей - параллельно, не больше concurrency одновременно.
+    """
+    processing = asyncio.Semaphore(concurrency)
+    tasks = set()
+    # Последний принятый апдейт каждого пользователя: следующий ждет его завершения
+    tails = {}
+
+    async def process(message_id: int, update: dict, writer: asyncio.StreamWriter, previous: asyncio.Task):
+        if previous is not None:
+            await asyncio.wait([previous])
+        ok = True
+        try:
+            async with processing:
+                await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            ok = False
+            logging.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+        if not writer.is_closing():
+            writer.write(json.dumps({"id": message_id, "ok": ok}).encode() + b"\n")
+
+    def forget(user_id: int, task: asyncio.Task):
+        tasks.discard(task)
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                user_id = update_user_id(message["update"])
+                # Число принятых апдейтов ограничивает фронт (max_pending), поэтому задачи создаются сразу
+                task = asyncio.create_task(process(message["id"], message["update"], writer, tails.get(user_id)))
+                tails[user_id] = task
+                tasks.add(task)
+                task.add_done_callback(lambda done, user_id=user_id: forget(user_id, done))
+        finally:
+            if tasks:
+                await asyncio.wait(set(tasks))
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=_LINE_LIMIT)
+    logging.info(f"Worker принимает апдейты на {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def share_llm_limit(total: int, workers: int):
+    """
+    Делит лимит одновременных запросов к модели между worker'ами, чтобы вместе они
+    нагружали модель не сильнее, чем один процесс. Worker'ы получают лимит через окружение.
+    """
+    os.environ["LLM_MAX_IN_FLIGHT"] = str(max(1, math.ceil(total / workers)))
+
+
+def start_worker_process(target, index: int) -> multiprocessing.Process:
+    """
+    Запускает worker в отдельном процессе. Используется spawn: процесс не наследует потоки
+    и соединения с базой родителя.
+
+    :param target: Функция процесса, принимающая номер worker'а.
+    """
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(index,), name=f"worker-{index}")
+    process.start()
+    return process
+
+
+async def supervise(processes: list, front: Front, target, interval: float = 1.0, max_delay: float = 60.0,
+                    connect_timeout: float = 60.0):
+    """
+    Перезапускает завершившиеся worker'ы и заново подключает к ним фронт. Работает до отмены.
+
+    Worker, который снова падает вскоре после запуска, перезапускается с паузой, растущей
+    вдвое до max_delay; ошибка перезапуска не останавливает надзор за остальными worker'ами.
+    """
+    loop = asyncio.get_running_loop()
+    started_at = [loop.time()] * len(processes)
+    delays = [0.0] * len(processes)
+    restart_at = [None] * len(processes)
+    while True:
+        await asyncio.sleep(interval)
+        for index, process in enumerate(processes):
+            link = front.links[index]
+            if process.is_alive() and link.connected():
+                continue
+            now = loop.time()
+            if restart_at[index] is None:
+                if now - started_at[index] < max_delay:
+                    delays[index] = min(max(delays[index] * 2, interval), max_delay)
+                else:
+                    delays[index] = 0.0
+                restart_at[index] = now + delays[index]
+                logging.error(f"Worker {index} недоступен (код завершения {process.exitcode}), "
+                              f"перезапуск через {delays[index]:.1f} с")
+            if now < restart_at[index]:
+                continue
+            restart_at[index] = None
+            started_at[index] = now
+            try:
+                if not process.is_alive():
+                    processes[index] = start_worker_process(target, index)
+                await link.connect(timeout=connect_timeout)
+            except Exception as e:
+                logging.error(f"Не удалось перезапустить worker {index}: {e}")
+                # Процесс, который так и не начал принимать апдейты, перезапустим целиком
+                if processes[index].is_alive():
+                    processes[index].kill()
+
+
+def stop_worker_processes(processes: list, timeout: float):
+    """
+    Просит worker'ы завершиться (SIGTERM), дожидается их и принудительно завершает зависшие.
+    """
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            logging.warning(f"Worker {process.name} не завершился за {timeout} с")
+            process.kill()
+            process.join()
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from db_async import run_in_db_thread
+from db_connection import get_connection
+
+
+def _make_key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+
+def _load_record(key: str):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT state, data FROM fsm_states WHERE key = ?', (key,))
+    result = cursor.fetchone()
+    if result is None:
+        return _Record()
+    return _Record(result[0], json.loads(result[1]))
+
+
+def _save_records(rows: list):
+    now = time.time()
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+        # Пустые состояния (после state.clear()) не храним
+        cursor.executemany('DELETE FROM fsm_states WHERE key = ?',
+                           [(key,) for key, state, data in rows if state is None and not data])
+        cursor.executemany('''
+            INSERT INTO fsm_states (key, state, data, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = excluded.state,
+                data = excluded.data,
+                updated_at = excluded.updated_at
+        ''', [(key, state, json.dumps(data, ensure_ascii=False), now)
+              for key, state, data in rows if state is not None or data])
+
+
+def _delete_expired(border: float) -> list:
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+        cursor.execute('SELECT key FROM fsm_states WHERE updated_at < ?', (border,))
+        keys = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (border,))
+    return keys
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str] = None, data: Dict[str, Any] = None):
+        self.state = state
+        self.data = data or {}
+        self.touched = time.time()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_states, переживающее перезапуск бота.
+
+    Прочитанные состояния кэшируются в памяти, а изменения записываются в базу
+    одной пачкой через flush_delay секунд, поэтому несколько update_data внутри
+    одного обработчика превращаются в одну запись. Кэш локален для процесса:
+    обновления одного пользователя должны обрабатываться одним процессом.
+    """
+
+    def __init__(self, flush_delay: float, cache_size: int, ttl: float):
+        self.flush_delay = flush_delay
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._flush_handle = None
+        self._flush_task = None
+        self.writes = 0
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        storage_key = _make_key(key)
+        record = self._cache.get(storage_key)
+        if record is not None:
+            self._cache.move_to_end(storage_key)
+            return record
+
+        record = await run_in_db_thread(_load_record, storage_key)
+        # Пока шла загрузка, запись могла появиться в кэше из другой корутины
+        record = self._cache.setdefault(storage_key, record)
+        self._trim()
+        return record
+
+    def _trim(self):
+        for _ in range(len(self._cache) - self.cache_size):
+            storage_key, record = self._cache.popitem(last=False)
+            if storage_key in self._dirty:
+                # Несохраненные изменения не выбрасываем, вернем в конец очереди
+                self._cache[storage_key] = record
+
+    def _mark_dirty(self, key: StorageKey, record: _Record):
+        record.touched = time.time()
+        self._dirty.add(_make_key(key))
+        if self._flush_handle is None and self._flush_task is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            while self._dirty:
+                keys, self._dirty = self._dirty, set()
+                rows = []
+                for storage_key in keys:
+                    record = self._cache.get(storage_key)
+                    if record is not None:
+                        rows.append((storage_key, record.state, dict(record.data)))
+                try:
+                    await run_in_db_thread(_save_records, rows)
+                    self.writes += 1
+                except Exception as e:
+                    logging.error(f"Не удалось сохранить состояния FSM: {e}")
+                    self._dirty |= keys
+                    break
+        finally:
+            self._flush_task = None
+            if self._dirty and self._flush_handle is None:
+                loop = asyncio.get_running_loop()
+                self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    async def flush(self):
+        """
+        Немедленно записывает все несохраненные изменения.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._dirty:
+            self._flush_task = asyncio.create_task(self._flush())
+            await self._flush_task
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get_record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get_record(key)
+        return record.data.copy()
+
+    async def cleanup(self):
+        """
+        Удаляет состояния, которые не менялись дольше ttl (брошенные задачи).
+        """
+        border = time.time() - self.ttl
+        keys = await run_in_db_thread(_delete_expired, border)
+        for storage_key in keys:
+            record = self._cache.get(storage_key)
+            if record is not None and record.touched < border and storage_key not in self._dirty:
+                del self._cache[storage_key]
+        if keys:
+            logging.info(f"Удалено брошенных состояний FSM: {len(keys)}")
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "dirty": len(self._dirty), "writes": self.writes}
+
+    async def close(self) -> None:
+        await self.flush()
+
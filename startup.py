@@ -0,0 +1,70 @@
+"""
+Замер этапов запуска бота и флаги готовности.
+
+Модуль импортируется в main.py первым, поэтому отсчет начинается почти с запуска процесса.
+Этапы (импорты, база, банк головоломок, прием апдейтов, готовность модели) отмечаются по мере
+прохождения, их длительности пишутся в лог и отдаются в метриках.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+# Отсчет начинается до импорта тяжелых модулей (metrics тянет за собой aiogram и aiohttp)
+_started = time.perf_counter()
+
+from metrics import registry  # noqa: E402
+
+
+class Startup:
+    """
+    Этапы запуска и готовность бота.
+
+    accepting_updates - бот начал принимать апдейты;
+    model_ready - клиент модели создан и прогрет, к модели можно обращаться.
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases = {}
+        self.accepting_updates = False
+        self.model_ready = False
+        self.warm_up_task = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Замеряет длительность этапа, выполняемого внутри блока.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+            logging.info(f"Этап запуска {name}: {self.phases[name]:.3f} с")
+
+    def mark(self, name: str):
+        """
+        Отмечает этап, который длился с момента запуска процесса (например, импорты).
+        """
+        self.phases[name] = time.perf_counter() - self.started
+        logging.info(f"Этап запуска {name}: {self.phases[name]:.3f} с от запуска")
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started
+
+    def set_accepting_updates(self):
+        self.accepting_updates = True
+        logging.info(f"Бот принимает апдейты через {self.since_start():.3f} с после запуска")
+
+    def set_model_ready(self):
+        self.model_ready = True
+        self.phases["model_ready"] = self.since_start()
+        logging.info(f"Модель готова через {self.since_start():.3f} с после запуска")
+
+
+startup = Startup(_started)
+
+registry.gauge("puzzles_startup_phase_seconds", "Длительность этапов запуска бота", lambda: dict(startup.phases),
+               ("phase",))
+registry.gauge("puzzles_model_ready", "Клиент модели создан и прогрет", lambda: int(startup.model_ready))
+registry.gauge("puzzles_accepting_updates", "Бот принимает апдейты", lambda: int(startup.accepting_updates))
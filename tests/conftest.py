@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection  # noqa: E402
+from db_main_handler import initialize_database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    Отдельная база для теста, рабочая база бота не затрагивается.
+    """
+    original = db_connection.DB_FILE
+    db_connection.set_db_file(str(tmp_path / "test.db"))
+    initialize_database()
+    yield
+    db_connection.set_db_file(original)
@@ -0,0 +1,51 @@
+import pytest
+
+from answer_checker import ACCEPT, REJECT, UNSURE, check_locally, extract_core_answer
+
+
+@pytest.mark.parametrize("user_answer, correct_answer", [
+    ("42", "42"),
+    ("сорок два", "42"),
+    ("Ответ: 42", "42, так как 6 * 7 = 42"),
+    ("кот", "Кот"),
+    ("коты", "кот"),
+    ("100 рублей", "Ответ: 100 рублей"),
+])
+def test_accept(user_answer, correct_answer):
+    assert check_locally(user_answer, correct_answer) == ACCEPT
+
+
+@pytest.mark.parametrize("user_answer, correct_answer", [
+    ("43", "42"),
+    ("10", "100 рублей. Сначала считаем сдачу"),
+])
+def test_reject(user_answer, correct_answer):
+    assert check_locally(user_answer, correct_answer) == REJECT
+
+
+@pytest.mark.parametrize("user_answer, correct_answer", [
+    # Отрицание и перечисление вариантов оставляются модели
+    ("не кот", "Кот"),
+    ("кот или собака", "кот"),
+    ("42 или 43", "42"),
+    # Лишние слова могут менять смысл ответа
+    ("черный кот", "кот"),
+    ("рояль", "кот"),
+    ("", "кот"),
+])
+def test_unsure(user_answer, correct_answer):
+    assert check_locally(user_answer, correct_answer) == UNSURE
+
+
+def test_number_from_explanation_is_unsure():
+    # Число из пояснения могло оказаться ответом, если ответ выделен неточно
+    assert check_locally("6", "42, так как 6 * 7 = 42") == UNSURE
+
+
+def test_accepted_answers():
+    assert check_locally("эхо", "Звук, отраженный от стен", ["эхо"]) == ACCEPT
+
+
+def test_extract_core_answer():
+    assert extract_core_answer("Ответ: 100 рублей. Сначала считаем сдачу") == "100 рублей"
+    assert extract_core_answer("3.5 - потому что половина") == "3.5"
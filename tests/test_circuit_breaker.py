@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import circuit_breaker
+import llm_gateway
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from llm_backends import LLMBackendError
+from llm_gateway import LLMBusyError, LLMUnavailableError
+from startup import startup
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Пока пробный запрос выполняется, остальные отклоняются
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+
+
+def test_released_probe_can_be_repeated(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.fixture
+def gateway_breaker(monkeypatch):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    monkeypatch.setattr(llm_gateway, "breaker", breaker)
+    monkeypatch.setitem(llm_gateway.llm_resilience_settings, "retries", 0)
+    monkeypatch.setattr(startup, "model_ready", True)
+    return breaker
+
+
+def _resilient(error):
+    async def attempt(remaining):
+        raise error
+    return asyncio.run(llm_gateway._resilient("check", attempt, timeout=1))
+
+
+def test_busy_gateway_is_not_model_failure(gateway_breaker):
+    # Нет свободного слота - перегружен бот, модель тут ни при чем
+    with pytest.raises(LLMBusyError):
+        _resilient(LLMBusyError("check"))
+    assert gateway_breaker.state == CLOSED
+    assert gateway_breaker.failures == 0
+
+
+def test_model_error_opens_breaker(gateway_breaker):
+    with pytest.raises(LLMUnavailableError):
+        _resilient(LLMBackendError("модель не ответила"))
+    assert gateway_breaker.state == OPEN
+    # Следующий запрос отклоняется, не дожидаясь модели
+    with pytest.raises(LLMUnavailableError):
+        _resilient(AssertionError("запрос не должен был выполниться"))
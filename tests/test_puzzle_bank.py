@@ -0,0 +1,80 @@
+import pytest
+
+import puzzle_bank as puzzle_bank_module
+from puzzle_bank import PuzzleBank
+
+TEXTS = [
+    "Сколько будет дважды два, если считать в уме без калькулятора?",
+    "У отца Мэри пять дочерей: Чача, Чече, Чичи, Чочо. Как зовут пятую?",
+    "Что можно увидеть с закрытыми глазами, но нельзя потрогать руками?",
+    "Поезд ехал из Москвы в Тверь три часа, а обратно сто восемьдесят минут. Почему?",
+]
+
+
+def _puzzle(text: str, difficulty: str = "easy") -> dict:
+    return {"puzzle": text, "answer": "ответ", "accepted_answers": [], "hints": [], "difficulty": difficulty}
+
+
+@pytest.fixture
+def bank(db):
+    bank = PuzzleBank(threshold=0.8)
+    bank.load()
+    return bank
+
+
+def _fill(bank) -> list:
+    return [bank.add("logic", "easy", _puzzle(text))[0] for text in TEXTS]
+
+
+def test_add_skips_duplicates(bank):
+    first, is_new = bank.add("logic", "easy", _puzzle(TEXTS[0]))
+    assert is_new
+    assert bank.add("logic", "easy", _puzzle(TEXTS[0])) == (first, False)
+    # Почти такая же головоломка тоже считается повтором
+    assert bank.add("logic", "easy", _puzzle(TEXTS[0].replace("?", "!")))[0] == first
+    assert bank.size() == 1
+
+
+def test_take_unseen_skips_seen(bank):
+    ids = _fill(bank)
+    for puzzle_id in ids[:-1]:
+        bank.mark_seen(1, puzzle_id)
+    for _ in range(10):
+        assert bank.take_unseen(1, "logic", "easy")["id"] == ids[-1]
+    # Другой пользователь может получить любую
+    assert bank.take_unseen(2, "logic", "easy")["id"] in ids
+
+
+def test_take_unseen_wraps_around(bank, monkeypatch):
+    ids = _fill(bank)
+    # Поиск начинается с последней головоломки, а она уже просмотрена
+    monkeypatch.setattr(puzzle_bank_module.random, "randint", lambda start, end: end)
+    bank.mark_seen(1, ids[-1])
+    assert bank.take_unseen(1, "logic", "easy")["id"] == ids[0]
+
+
+def test_take_unseen_filters_category_and_difficulty(bank):
+    bank.add("logic", "hard", _puzzle(TEXTS[0]))
+    bank.add("math", "easy", _puzzle(TEXTS[1]))
+    assert bank.take_unseen(1, "logic", "easy") is None
+    assert bank.take_unseen(1, "math", "easy")["puzzle"] == TEXTS[1]
+
+
+def test_take_unseen_returns_none_when_all_seen(bank):
+    for puzzle_id in _fill(bank):
+        bank.mark_seen(1, puzzle_id)
+    assert bank.take_unseen(1, "logic", "easy") is None
+
+
+def test_take_unseen_from(bank):
+    puzzles = [_puzzle(text, "medium") for text in TEXTS[:2]]
+    first = bank.take_unseen_from(1, "logic", puzzles)
+    assert first["puzzle"] == TEXTS[0]
+    assert bank.is_seen(1, first["id"]) is False
+    bank.mark_seen(1, first["id"])
+    second = bank.take_unseen_from(1, "logic", puzzles)
+    assert second["puzzle"] == TEXTS[1]
+    bank.mark_seen(1, second["id"])
+    assert bank.take_unseen_from(1, "logic", puzzles) is None
+    # Головоломки сохранены в банк со своей сложностью
+    assert bank.take_unseen(2, "logic", "medium") is not None
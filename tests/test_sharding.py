@@ -0,0 +1,39 @@
+from collections import Counter
+
+import pytest
+
+from sharding import jump_hash, update_user_id
+
+KEYS = range(1, 20001)
+
+
+@pytest.mark.parametrize("buckets", [1, 2, 3, 8])
+def test_jump_hash_range_and_balance(buckets):
+    counts = Counter(jump_hash(key, buckets) for key in KEYS)
+    assert set(counts) == set(range(buckets))
+    expected = len(KEYS) / buckets
+    assert all(abs(count - expected) < expected * 0.1 for count in counts.values())
+
+
+def test_jump_hash_is_stable():
+    assert [jump_hash(key, 4) for key in KEYS] == [jump_hash(key, 4) for key in KEYS]
+    assert jump_hash(0, 1) == 0
+
+
+@pytest.mark.parametrize("buckets", [1, 2, 3, 7])
+def test_adding_worker_moves_keys_only_to_it(buckets):
+    moved = 0
+    for key in KEYS:
+        before, after = jump_hash(key, buckets), jump_hash(key, buckets + 1)
+        if before != after:
+            # Пользователь переезжает только на новый worker, остальные остаются на месте
+            assert after == buckets
+            moved += 1
+    expected = len(KEYS) / (buckets + 1)
+    assert abs(moved - expected) < expected * 0.1
+
+
+def test_update_user_id():
+    assert update_user_id({"update_id": 1, "message": {"from": {"id": 42}, "text": "/start"}}) == 42
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "1", "from": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3}) == 0
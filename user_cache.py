@@ -0,0 +1,72 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from config import user_cache_compact
+from db_connection import get_connection
+
+
+class UserCache:
+    """
+    Множество ID зарегистрированных пользователей в памяти.
+
+    Загружается из таблицы users при старте и пополняется при регистрации,
+    поэтому проверка регистрации не обращается к базе.
+    """
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self._ids = array("q") if compact else set()
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """
+        Загружает ID всех пользователей из базы.
+        """
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT id FROM users ORDER BY id')
+        ids = [row[0] for row in cursor.fetchall()]
+        with self._lock:
+            self._ids = array("q", ids) if self.compact else set(ids)
+            self.loaded = True
+
+    def __contains__(self, user_id: int) -> bool:
+        if not self.compact:
+            return user_id in self._ids
+        index = bisect_left(self._ids, user_id)
+        return index < len(self._ids) and self._ids[index] == user_id
+
+    def contains(self, user_id: int) -> bool:
+        """
+        Проверяет, есть ли пользователь в кэше.
+
+        :param user_id: Telegram ID пользователя.
+        :return: True, если пользователь точно зарегистрирован. False означает,
+                 что его нужно поискать в базе (например, он зарегистрировался в другом процессе).
+        """
+        if user_id in self:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, user_id: int):
+        with self._lock:
+            if user_id in self:
+                return
+            if self.compact:
+                self._ids.insert(bisect_left(self._ids, user_id), user_id)
+            else:
+                self._ids.add(user_id)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def stats(self) -> dict:
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
+
+
+registered_users = UserCache(compact=user_cache_compact)
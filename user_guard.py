@@ -0,0 +1,152 @@
+"""
+Защита от повторных и одновременных действий одного пользователя.
+
+Обработчики помечаются флагами aiogram:
+- single_flight - имя действия; пока такое же действие пользователя выполняется,
+  повторные нажатия и одинаковые сообщения отклоняются без обращения к модели;
+- serialize - обработчики пользователя с этим флагом выполняются строго по очереди,
+  поэтому не затирают друг другу данные FSM; нажатие кнопки, пока такой обработчик
+  выполняется, сразу отклоняется, чтобы не истек срок ответа на callback.
+"""
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from metrics import registry
+
+duplicate_requests = registry.counter("puzzles_duplicate_requests_total",
+                                      "Повторные действия, отклоненные пока такое же выполнялось", ("action",))
+llm_calls_saved = registry.counter("puzzles_llm_calls_saved_total",
+                                   "Запросы к модели, которых удалось избежать благодаря отклонению повторов",
+                                   ("action",))
+
+# Действие, которое выполняется в текущей задаче asyncio (для отметки обращений к модели)
+_current_flight = contextvars.ContextVar("current_flight", default=None)
+
+
+class _Flight:
+    __slots__ = ("key", "uses_model")
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.uses_model = False
+
+
+class UserGuard:
+    """
+    Выполняющиеся действия и очереди обработчиков для каждого пользователя.
+    Записи удаляются, как только у пользователя не остается активных действий.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        # user_id -> [блокировка, сколько обработчиков ее держат или ждут]
+        self._locks = {}
+
+    def begin(self, user_id: int, action: str, fingerprint: str = ""):
+        """
+        Отмечает начало действия.
+
+        :param fingerprint: Дополнительный ключ (например, текст ответа): повтором считается
+            только действие с тем же ключом.
+        :return: Действие для finish() или None, если такое же действие уже выполняется.
+        """
+        key = (user_id, action, fingerprint)
+        flight = self._flights.get(key)
+        if flight is not None:
+            duplicate_requests.inc(action)
+            if flight.uses_model:
+                llm_calls_saved.inc(action)
+            return None
+        flight = self._flights[key] = _Flight(key)
+        return flight
+
+    def finish(self, flight: _Flight):
+        self._flights.pop(flight.key, None)
+
+    @asynccontextmanager
+    async def serialize(self, user_id: int):
+        """
+        Выполняет блок, дождавшись окончания предыдущих блоков этого же пользователя.
+        """
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    def is_serialized(self, user_id: int) -> bool:
+        """
+        :return: True, если у пользователя уже выполняется блок serialize().
+        """
+        entry = self._locks.get(user_id)
+        return entry is not None and entry[0].locked()
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+user_guard = UserGuard()
+
+
+def mark_model_call():
+    """
+    Отмечает, что текущее действие пользователя обращается к модели.
+    Вызывается шлюзом модели, чтобы считать сэкономленные повторами запросы.
+    """
+    flight = _current_flight.get()
+    if flight is not None:
+        flight.uses_model = True
+
+
+class UserGuardMiddleware(BaseMiddleware):
+    """
+    Применяет флаги single_flight и serialize обработчика.
+    Подключается как inner middleware роутера, чтобы флаги выбранного обработчика были известны.
+    Сообщения ждут своей очереди, а нажатие кнопки во время чужого обработчика отклоняется.
+    """
+
+    def __init__(self, busy_text: str):
+        self.busy_text = busy_text
+
+    async def __call__(self, handler, event, data):
+        action = get_flag(data, "single_flight")
+        serialize = get_flag(data, "serialize", default=False)
+        if action is None and not serialize:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        flight = None
+        if action is not None:
+            fingerprint = event.text.strip().lower() if isinstance(event, Message) and event.text else ""
+            flight = user_guard.begin(user_id, action, fingerprint)
+            if flight is None:
+                # Для кнопки это всплывающее уведомление, для сообщения - короткий ответ
+                await event.answer(self.busy_text)
+                return None
+
+        token = _current_flight.set(flight)
+        try:
+            if serialize:
+                if isinstance(event, CallbackQuery) and user_guard.is_serialized(user_id):
+                    # На нажатие кнопки Telegram ждет ответа лишь несколько секунд, а очередь
+                    # за проверкой ответа может занять минуты: отклоняем сразу, а не ждем
+                    await event.answer(self.busy_text)
+                    return None
+                async with user_guard.serialize(user_id):
+                    return await handler(event, data)
+            return await handler(event, data)
+        finally:
+            _current_flight.reset(token)
+            if flight is not None:
+                user_guard.finish(flight)
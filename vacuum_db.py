@@ -0,0 +1,18 @@
+"""
+Одноразовая миграция: включает auto_vacuum = INCREMENTAL у существующей базы, чтобы задача
+хранения логов (log_archive.py) могла возвращать освободившееся место системе.
+
+VACUUM переписывает весь файл базы, поэтому запускать при остановленном боте.
+
+Запуск: python vacuum_db.py
+"""
+import logging
+
+import db_connection
+from db_main_handler import enable_incremental_vacuum
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"База: {db_connection.DB_FILE}")
+    enable_incremental_vacuum()
+    db_connection.close_all()
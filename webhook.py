@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp-сервер, принимающий апдейты от Telegram.
+
+    На запрос сразу отвечает 200, а сам апдейт обрабатывается в фоне
+    с ограничением на количество одновременно обрабатываемых апдейтов.
+    При остановке сервер перестает принимать запросы и дожидается обработки принятых.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str, concurrency: int, max_pending: int,
+                 drain_timeout: float, secret: str = None):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.drain_timeout = drain_timeout
+        self._processing = asyncio.Semaphore(concurrency)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._tasks = set()
+        self._runner = None
+        self._accepting = True
+        self.received = 0
+        self.failed = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит апдейт позже, его обработает следующий запуск
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+
+        # Если слишком много апдейтов ждут обработки, задерживаем ответ (Telegram притормозит отправку)
+        await self._pending.acquire()
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            async with self._processing:
+                await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+        finally:
+            self._pending.release()
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Webhook-сервер слушает {host}:{port}{self.path}")
+
+    async def drain(self):
+        """
+        Перестает принимать новые апдейты и ждет обработки уже принятых.
+        """
+        self._accepting = False
+        if self._tasks:
+            logging.info(f"Ожидаем обработки {len(self._tasks)} апдейтов")
+            _, still_running = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in still_running:
+                task.cancel()
+
+    async def stop(self):
+        await self.drain()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str, port: int, url: str = None,
+                      server: WebhookServer = None, **settings):
+    """
+    Запускает бота в режиме webhook и работает до отмены.
+
+    :param url: Публичный адрес webhook. Если задан, он регистрируется в Telegram.
+    :param server: Готовый сервер (например, фронт многопроцессного режима), по умолчанию WebhookServer.
+    :param settings: Остальные настройки из config.webhook_settings.
+    """
+    if server is None:
+        server = WebhookServer(dp, bot, **settings)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await server.start(host, port)
+    if url:
+        await bot.set_webhook(url, secret_token=settings.get("secret"), drop_pending_updates=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()